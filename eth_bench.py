@@ -0,0 +1,285 @@
+#! /usr/bin/python3
+
+# Decode throughput benchmark for eth_pkt
+#
+# Synthesizes a mix of ARP, IPv4/UDP, IPv4/ICMP and IPv6/ICMPv6 frames and
+# measures frames/sec for each protocol through each decode API:
+#   'print'   eth_pkt.decode() (record + printers, output discarded)
+#   'record'  eth_pkt.decode_record()
+#   'view'    eth_pkt.PacketView reading ethertype and dest_port
+#   'batch'   eth_pkt.decode_batch() over one flat buffer (needs numpy)
+#
+# Usage:
+#   python3 eth_bench.py -n 20000 --size 64 1518 --save baseline.json
+#   python3 eth_bench.py --compare baseline.json    # Exit status 1 on a regression
+
+import contextlib
+import json
+import os
+import platform
+import random
+import struct
+import sys
+import time
+
+import eth_pkt as ep
+import eth_gen
+
+PROTOCOLS = ('arp', 'udp', 'icmp', 'icmpv6')
+APIS = ('print', 'record', 'view', 'batch')
+
+_SRC_MAC = bytes.fromhex('26acddd71ebe')
+_DEST_MAC = bytes.fromhex('02000000cafe')
+_SRC_IP = bytes([192, 168, 7, 1])
+_DEST_IP = bytes([192, 168, 7, 4])
+_SRC_IP6 = bytes.fromhex('fe8000000000000024acddfffed71ebe')
+_DEST_IP6 = bytes.fromhex('fe800000000000000000000000000004')
+
+# ===== Frame synthesis =====
+# Frames start at the destination MAC (no preamble) and end with the FCS.
+# 'size' is the whole frame length including the FCS; frames are padded up
+# to the 64-byte minimum.
+
+# Every frame is built here and then copied out
+_scratch = bytearray(16384)
+
+def _payload(rng, nbytes):
+    return bytes(rng.getrandbits(8) for n in range(max(nbytes, 0)))
+
+def _frame(end):
+    return bytes(_scratch[:end])
+
+def synth_arp(rng, size):
+    tpa = bytes([192, 168, 7, rng.randrange(1, 255)])
+    return _frame(eth_gen.build_arp(_scratch, 0, _SRC_MAC, _SRC_IP, tpa))
+
+def synth_udp(rng, size):
+    overhead = ep._ETH_HEADER.size + ep._IPV4_HEADER.size + ep._UDP_HEADER.size + eth_gen.FCS_SIZE
+    sport = rng.randrange(1024, 65536)
+    dport = rng.choice((53, 123, 50006, 3000))
+    return _frame(eth_gen.build_ipv4_udp(_scratch, 0, _SRC_MAC, _DEST_MAC, _SRC_IP, _DEST_IP, sport, dport,
+                                         _payload(rng, size - overhead), ident=rng.getrandbits(16)))
+
+def synth_icmp(rng, size):
+    overhead = ep._ETH_HEADER.size + ep._IPV4_HEADER.size + ep._ICMP_HEADER.size + eth_gen.FCS_SIZE
+    # Echo request: identifier and sequence number, then data
+    rest = struct.pack('!HH', 1, rng.getrandbits(16)) + _payload(rng, size - overhead - 4)
+    return _frame(eth_gen.build_ipv4_icmp(_scratch, 0, _SRC_MAC, _DEST_MAC, _SRC_IP, _DEST_IP, rest=rest,
+                                          ident=rng.getrandbits(16)))
+
+def synth_icmpv6(rng, size):
+    overhead = ep._ETH_HEADER.size + ep._IPV6_HEADER.size + ep._ICMP_HEADER.size + eth_gen.FCS_SIZE
+    rest = struct.pack('!HH', 1, rng.getrandbits(16)) + _payload(rng, size - overhead - 4)
+    return _frame(eth_gen.build_ipv6_icmp(_scratch, 0, _SRC_MAC, _DEST_MAC, _SRC_IP6, _DEST_IP6, rest=rest))
+
+_synthesizers = {
+    'arp': synth_arp,
+    'udp': synth_udp,
+    'icmp': synth_icmp,
+    'icmpv6': synth_icmpv6,
+}
+
+def synth_frames(n, mix=None, sizes=(64, 1518), seed=0):
+    """Return a list of 'n' (protocol, frame) tuples.
+    'mix' maps protocol name (see PROTOCOLS) to a relative weight (default:
+    equal weights).  Frame sizes are drawn uniformly from 'sizes' = (min, max)
+    bytes including the FCS.  The same 'seed' always gives the same frames."""
+    if mix is None:
+        mix = dict.fromkeys(PROTOCOLS, 1)
+    for name in mix:
+        if name not in _synthesizers:
+            raise ValueError("Unknown protocol '{}'. Must be one of {}".format(name, PROTOCOLS))
+    rng = random.Random(seed)
+    names = list(mix.keys())
+    weights = [mix[name] for name in names]
+    lo, hi = sizes
+    frames = []
+    for name in rng.choices(names, weights, k=n):
+        frames.append((name, _synthesizers[name](rng, rng.randint(lo, hi))))
+    return frames
+
+# ===== Timing =====
+
+def _api_print(frames):
+    with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+        for frame in frames:
+            ep.decode(frame)
+    return
+
+def _api_record(frames):
+    for frame in frames:
+        ep.decode_record(frame)
+    return
+
+def _api_view(frames):
+    for frame in frames:
+        view = ep.PacketView(frame)
+        view.ethertype
+        view.dest_port
+    return
+
+def _api_batch(frames):
+    import numpy as np
+    offsets = [0]
+    for frame in frames[:-1]:
+        offsets.append(offsets[-1] + len(frame))
+    # Include the concatenation so the batch path isn't flattered
+    flat = np.frombuffer(b''.join(frames), dtype=np.uint8)
+    ep.decode_batch(flat, offsets)
+    return
+
+_apis = {
+    'print': _api_print,
+    'record': _api_record,
+    'view': _api_view,
+    'batch': _api_batch,
+}
+
+def _have_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return False
+    return True
+
+def measure(func, frames, repeat=3, min_time=0.2):
+    """Return the best frames/sec of func(frames) over 'repeat' runs, each
+    looping over 'frames' until at least 'min_time' seconds have passed.
+    Time is this process's CPU time, so time spent descheduled (other
+    processes, a busy VM host) doesn't count against it."""
+    if len(frames) == 0:
+        return 0.0
+    best = 0.0
+    for n in range(repeat):
+        count = 0
+        t0 = time.process_time()
+        while True:
+            func(frames)
+            count += len(frames)
+            elapsed = time.process_time() - t0
+            if elapsed >= min_time:
+                break
+        best = max(best, count/elapsed)
+    return best
+
+def run(n=10000, mix=None, sizes=(64, 1518), apis=APIS, seed=0, repeat=5, min_time=0.2):
+    """Benchmark every API in 'apis' on each protocol separately and on the
+    whole mix, keeping the best of 'repeat' runs of each.  The runs take
+    turns (every benchmark once, then every benchmark again ...) so a slow
+    patch on the machine doesn't land on just one of them.  Returns a dict
+    with 'meta' (settings and platform) and 'results': {protocol or 'mix':
+    {api: frames/sec}}."""
+    frames = synth_frames(n, mix, sizes, seed)
+    groups = {}
+    for name, frame in frames:
+        groups.setdefault(name, []).append(frame)
+    groups['mix'] = [frame for name, frame in frames]
+    if 'batch' in apis and not _have_numpy():
+        print("numpy not available; skipping the batch API", file=sys.stderr)
+        apis = [api for api in apis if api != 'batch']
+    results = {group: {api: 0.0 for api in apis} for group in groups}
+    for attempt in range(repeat):
+        for group, group_frames in groups.items():
+            for api in apis:
+                rate = measure(_apis[api], group_frames, 1, min_time)
+                results[group][api] = max(results[group][api], rate)
+    return {
+        'meta': {
+            'frames': n,
+            'mix': mix,
+            'sizes': list(sizes),
+            'seed': seed,
+            'repeat': repeat,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+def save_baseline(report, filename):
+    with open(filename, 'w') as fd:
+        json.dump(report, fd, indent=2)
+    return
+
+def load_baseline(filename):
+    with open(filename, 'r') as fd:
+        return json.load(fd)
+
+def compare(report, baseline, tolerance=0.25):
+    """Return a list of (group, api, frames/sec, baseline frames/sec) for every
+    result more than 'tolerance' (fraction) slower than the baseline."""
+    slower = []
+    for group, apis in report['results'].items():
+        for api, rate in apis.items():
+            base = baseline['results'].get(group, {}).get(api)
+            if base is not None and rate < base*(1 - tolerance):
+                slower.append((group, api, rate, base))
+    return slower
+
+def print_report(report, baseline=None):
+    apis = []
+    for group_apis in report['results'].values():
+        for api in group_apis:
+            if api not in apis:
+                apis.append(api)
+    print("{:<8}".format('') + ''.join(["{:>16}".format(api) for api in apis]))
+    for group, group_apis in report['results'].items():
+        line = "{:<8}".format(group)
+        for api in apis:
+            rate = group_apis.get(api)
+            if rate is None:
+                line += "{:>16}".format('-')
+                continue
+            base = None
+            if baseline is not None:
+                base = baseline['results'].get(group, {}).get(api)
+            if base:
+                line += "{:>16}".format("{:.0f} ({:+.0f}%)".format(rate, 100*(rate/base - 1)))
+            else:
+                line += "{:>16.0f}".format(rate)
+        print(line)
+    print("(frames/sec)")
+    return
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Measure eth_pkt decode throughput on synthetic frames.")
+    parser.add_argument('-n', '--frames', default=10000, type=int, help="Number of frames to synthesize")
+    parser.add_argument('--size', default=(64, 1518), type=int, nargs=2, metavar=('MIN', 'MAX'),
+                        help="Frame size range in bytes, including the FCS")
+    parser.add_argument('--mix', default=None, help="Protocol weights, e.g. 'udp=8,arp=1,icmp=1,icmpv6=1'")
+    parser.add_argument('--api', default=list(APIS), choices=APIS, nargs='+', help="APIs to benchmark")
+    parser.add_argument('--seed', default=0, type=int, help="Random seed for frame synthesis")
+    parser.add_argument('--save', default=None, help="Save the results to this JSON baseline")
+    parser.add_argument('--compare', default=None, help="Compare against this JSON baseline")
+    parser.add_argument('--repeat', default=5, type=int, help="Keep the best of this many runs of each benchmark")
+    # Even best-of-5 CPU-time rates can move by 10-20% between back-to-back
+    # runs (caches, frequency scaling, shared hosts), so only flag bigger
+    # slowdowns
+    parser.add_argument('--tolerance', default=0.25, type=float,
+                        help="Allowed slowdown vs. the baseline (fraction); run-to-run noise is often over 0.1")
+    args = parser.parse_args()
+    mix = None
+    if args.mix is not None:
+        mix = {}
+        for item in args.mix.split(','):
+            name, _, weight = item.partition('=')
+            mix[name.strip()] = float(weight) if weight else 1.0
+    report = run(args.frames, mix, tuple(args.size), args.api, args.seed, args.repeat)
+    baseline = None
+    if args.compare is not None:
+        baseline = load_baseline(args.compare)
+    print_report(report, baseline)
+    if args.save is not None:
+        save_baseline(report, args.save)
+    if baseline is not None:
+        slower = compare(report, baseline, args.tolerance)
+        for group, api, rate, base in slower:
+            print("REGRESSION: {} {}: {:.0f} frames/sec (baseline {:.0f})".format(group, api, rate, base))
+        if len(slower) > 0:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
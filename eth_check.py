@@ -0,0 +1,165 @@
+#! /usr/bin/python3
+
+# Checksum and FCS verification for packets decoded by eth_pkt
+#
+# Usage:
+#   import eth_pkt, eth_check
+#   rec = eth_pkt.decode_record(pkt)
+#   checks = eth_check.verify(pkt, rec)   # e.g. {'fcs': True, 'ipv4_checksum': True, 'udp_checksum': None}
+#
+# Each check is True (good), False (bad) or None (not checked, e.g. a UDP
+# checksum of zero over IPv4 or a truncated header).
+
+import zlib
+import eth_pkt as ep
+
+# CRC-32 residue left after running the CRC over a frame including its FCS
+FCS_RESIDUE = 0x2144df1c
+FCS_SIZE = 4
+
+def _ones_sum(buf, offset, end):
+    """Ones' complement sum of the 16-bit big-endian words in buf[offset:end],
+    reduced modulo 0xffff (0 stands for both 0x0000 and 0xffff).
+    Since 2**16 == 1 (mod 0xffff), the sum of the words is congruent to the
+    whole buffer read as one big integer, which int.from_bytes does in C."""
+    v = int.from_bytes(buf[offset:end], 'big')
+    if (end - offset) & 1:
+        # Odd length is padded with a zero byte
+        v <<= 8
+    return v % 0xffff
+
+def internet_checksum(data, initial=0):
+    """Return the 16-bit internet checksum (RFC 1071) of 'data' with the
+    checksum field zeroed.  'initial' is an extra sum (e.g. a pseudo header)."""
+    total = _ones_sum(data, 0, len(data)) + initial
+    s = total % 0xffff
+    if s == 0 and total != 0:
+        # The sum is 0xffff (negative zero)
+        return 0
+    return 0xffff - s
+
+def ipv4_pseudo_sum(src_ip, dest_ip, protocol, length):
+    """Sum of the IPv4 pseudo header for UDP/TCP checksums."""
+    return int.from_bytes(bytes(src_ip) + bytes(dest_ip), 'big') + protocol + length
+
+def ipv6_pseudo_sum(src_ip, dest_ip, next_header, length):
+    """Sum of the IPv6 pseudo header for UDP/TCP/ICMPv6 checksums."""
+    return int.from_bytes(bytes(src_ip) + bytes(dest_ip), 'big') + next_header + length
+
+def check_ipv4_header(buf, offset, ihl):
+    """True if the IPv4 header at 'offset' with 'ihl' words has a good checksum."""
+    end = offset + 4*ihl
+    if end > len(buf):
+        return None
+    return _ones_sum(buf, offset, end) == 0
+
+def _check_upper(buf, offset, end, pseudo):
+    if end > len(buf) or end <= offset:
+        return None
+    return (_ones_sum(buf, offset, end) + pseudo) % 0xffff == 0
+
+def crc32(buf, offset=0, end=None):
+    """CRC-32 (IEEE 802.3) of buf[offset:end]."""
+    if end is None:
+        end = len(buf)
+    return zlib.crc32(memoryview(buf)[offset:end])
+
+def check_fcs(buf, start=0, end=None):
+    """True if the last FCS_SIZE bytes of buf[start:end] are a good Ethernet
+    FCS for the bytes before them."""
+    if end is None:
+        end = len(buf)
+    if end - start <= FCS_SIZE:
+        return None
+    return zlib.crc32(memoryview(buf)[start:end]) == FCS_RESIDUE
+
+def check_fcs_batch(frames, offsets=None, lengths=None):
+    """Check the FCS of many frames at once.  Returns a list of bools.
+    'frames' is either an iterable of frames (bytes-like, no preamble) or,
+    with 'offsets', one flat buffer holding every frame back to back.
+    'lengths' defaults to the distance to the next offset."""
+    crc = zlib.crc32
+    if offsets is None:
+        return [crc(frame) == FCS_RESIDUE for frame in frames]
+    mv = memoryview(frames).cast('B')
+    offsets = list(offsets)
+    if lengths is None:
+        ends = offsets[1:] + [len(mv)]
+    else:
+        ends = [o + l for o, l in zip(offsets, lengths)]
+    return [crc(mv[o:e]) == FCS_RESIDUE for o, e in zip(offsets, ends)]
+
+def verify(pkt, rec=None, fcs=True, trailer=0):
+    """Verify every checksum we know about in packet 'pkt'.
+    'rec' is the record from eth_pkt.decode_record(pkt) (decoded here if None).
+    Set 'fcs' to False for captures without an FCS (e.g. most pcaps), and
+    'trailer' to the number of bytes captured after the FCS.
+    Returns a dict of check name -> True/False/None."""
+    buf = ep.as_buffer(pkt)
+    if rec is None:
+        rec = ep.decode_record(buf)
+    checks = {}
+    end = len(buf) - trailer
+    if fcs:
+        checks['fcs'] = check_fcs(buf, rec['start'], end)
+    ipv4 = rec.get('ipv4')
+    ipv6 = rec.get('ipv6')
+    if ipv4 is not None and ipv4['ihl'] is not None:
+        checks['ipv4_checksum'] = check_ipv4_header(buf, ipv4['offset'], ipv4['ihl'])
+    udp = rec.get('udp')
+    if udp is not None:
+        udp_end = udp['offset'] + udp['length']
+        if ipv4 is not None and udp['checksum'] == 0:
+            # Checksum not computed by the sender
+            checks['udp_checksum'] = None
+        elif ipv4 is not None:
+            checks['udp_checksum'] = _check_upper(buf, udp['offset'], udp_end,
+                    ipv4_pseudo_sum(ipv4['src_ip'], ipv4['dest_ip'], ep.IP_PROTOCOL_UDP, udp['length']))
+        elif ipv6 is not None:
+            checks['udp_checksum'] = _check_upper(buf, udp['offset'], udp_end,
+                    ipv6_pseudo_sum(ipv6['src_ip'], ipv6['dest_ip'], ep.IP_PROTOCOL_UDP, udp['length']))
+    tcp = rec.get('tcp')
+    if tcp is not None:
+        tcp_end = tcp['offset'] + tcp['header_length'] + len(tcp['data'])
+        length = tcp_end - tcp['offset']
+        if ipv4 is not None:
+            checks['tcp_checksum'] = _check_upper(buf, tcp['offset'], tcp_end,
+                    ipv4_pseudo_sum(ipv4['src_ip'], ipv4['dest_ip'], ep.IP_PROTOCOL_TCP, length))
+        elif ipv6 is not None:
+            checks['tcp_checksum'] = _check_upper(buf, tcp['offset'], tcp_end,
+                    ipv6_pseudo_sum(ipv6['src_ip'], ipv6['dest_ip'], ep.IP_PROTOCOL_TCP, length))
+    icmp = rec.get('icmp')
+    if icmp is not None:
+        icmp_end = icmp['offset'] + ep.PAYLOAD_OFFSET_ICMP_REST_OF_HEADER + len(icmp['rest_of_header'])
+        checks['icmp_checksum'] = _check_upper(buf, icmp['offset'], icmp_end, 0)
+    icmpv6 = rec.get('icmpv6')
+    if icmpv6 is not None and ipv6 is not None:
+        icmp_end = icmpv6['offset'] + ep.PAYLOAD_OFFSET_ICMP_REST_OF_HEADER + len(icmpv6['rest_of_header'])
+        length = icmp_end - icmpv6['offset']
+        checks['icmpv6_checksum'] = _check_upper(buf, icmpv6['offset'], icmp_end,
+                ipv6_pseudo_sum(ipv6['src_ip'], ipv6['dest_ip'], ep.IP_PROTOCOL_IPV6_ICMP, length))
+    return checks
+
+def print_checks(checks):
+    for name, ok in checks.items():
+        if ok is None:
+            res = "not checked"
+        elif ok:
+            res = "PASS"
+        else:
+            res = "FAIL"
+        print("{}: {}".format(name.upper(), res))
+    return
+
+if __name__ == "__main__":
+    import sys
+    import pcap
+    nbad = 0
+    nframes = 0
+    for timestamp, pkt in pcap.read_file(sys.argv[1]):
+        checks = verify(pkt, fcs=False)
+        if False in checks.values():
+            print("Packet {} (t = {}): {}".format(nframes, timestamp, checks))
+            nbad += 1
+        nframes += 1
+    print("{} of {} packets failed".format(nbad, nframes))
@@ -0,0 +1,318 @@
+#! /usr/bin/python3
+
+# Compare two captures of the same traffic frame by frame
+#
+# Typically a simulated capture (e.g. a GMII byte stream from eth_extract)
+# against a hardware capture of the same test.  Every frame is reduced to a
+# hash, either of its bytes (after any preamble, minus 'trailer' bytes such
+# as an FCS that only one side captured) or of a subset of its fields.  The
+# two hash sequences are then aligned:
+#   - each frame in A is matched with an unmatched frame in B with the same
+#     hash: the first one after the previous match if there is one, else the
+#     earliest.  Drops, duplicates and reorders then don't derail the rest of
+#     the comparison;
+#   - the longest run of matches that are in the same order in both captures
+#     anchors the alignment, and other matches are reported as reordered;
+#   - unmatched frames that sit between the same two anchors in A and B are
+#     paired up in order and reported as changed, with a field-by-field diff
+#     of their decoded records; the rest are missing from B or extra in B.
+# When matching on fields, frames that match are also compared on their
+# bytes, and those that differ outside the chosen fields are listed (with
+# their field diffs) without counting against the match.
+# Only the hashes are held in memory; the few frames that need a field diff
+# are read again afterwards.
+#
+# Usage:
+#   python3 eth_diff.py sim.gmii hw.pcap --fmt-a gmii --trailer-a 4
+#   python3 eth_diff.py a.pcap b.pcap --fields eth.dst,ip.src,ip.dst,udp.dport
+
+import bisect
+import collections
+from array import array
+
+import eth_pkt as ep
+import eth_render
+
+def _normalize(pkt, trailer=0):
+    buf = ep.as_buffer(pkt)
+    start = 0
+    if len(buf) > 0 and buf[0] in (0x55, 0xaa):
+        start = ep.findStart(buf)
+    return buf[start:max(start, len(buf) - trailer)]
+
+def hash_frames(frames, trailer=0, key=None):
+    """Hash every (timestamp, frame) in iterable 'frames'.
+    Returns (keys, raws): arrays with one hash per frame of, respectively,
+    key(frame) (a function such as one from eth_filter.compile_key) and of
+    the frame's bytes.  If 'key' is None both are the same array.  The preamble and the
+    last 'trailer' bytes of each frame are ignored."""
+    raws = array('q')
+    keys = raws if key is None else array('q')
+    for timestamp, pkt in frames:
+        if type(pkt) is bytes and trailer == 0 and len(pkt) > 0 and pkt[0] not in (0x55, 0xaa):
+            # Nothing to strip
+            mv = pkt
+            raw = hash(pkt)
+        else:
+            mv = _normalize(pkt, trailer)
+            raw = hash(mv.tobytes())
+        raws.append(raw)
+        if key is not None:
+            keys.append(hash(key(mv)))
+    return keys, raws
+
+def _in_order(seq):
+    """Flags (bytearray) marking one longest strictly increasing subsequence of 'seq'."""
+    tails = []      # Smallest last value of an increasing run of each length
+    tail_idx = []
+    prev = array('q', [-1])*len(seq)
+    for i, v in enumerate(seq):
+        j = bisect.bisect_left(tails, v)
+        if j == len(tails):
+            tails.append(v)
+            tail_idx.append(i)
+        else:
+            tails[j] = v
+            tail_idx[j] = i
+        if j > 0:
+            prev[i] = tail_idx[j-1]
+    flags = bytearray(len(seq))
+    i = tail_idx[-1] if len(tail_idx) > 0 else -1
+    while i >= 0:
+        flags[i] = 1
+        i = prev[i]
+    return flags
+
+def align(keys_a, keys_b):
+    """Match frames with equal keys: each frame in A takes the first
+    unmatched frame in B with the same key after the previous match (or the
+    earliest, if there's none after it).
+    Returns a list of (index_a, index_b) in A order."""
+    groups = {}
+    for ib, k in enumerate(keys_b):
+        q = groups.get(k)
+        if q is None:
+            groups[k] = [ib]
+        else:
+            q.append(ib)
+    # Indices in B grouped by key (ascending within a group), each group
+    # followed by a sentinel.  nxt[j] == j while slot j is unmatched; a
+    # matched slot points further along its group (with path halving, so
+    # skipping matched slots stays cheap however many duplicates there are).
+    span = {}
+    pos = array('q')
+    for k, q in groups.items():
+        span[k] = (len(pos), len(pos) + len(q))
+        pos.extend(q)
+        pos.append(-1)
+    del groups
+    nxt = array('q', range(len(pos)))
+
+    def unmatched(j):
+        # First unmatched slot at or after slot j
+        while nxt[j] != j:
+            nxt[j] = nxt[nxt[j]]
+            j = nxt[j]
+        return j
+
+    pairs = []
+    cursor = 0
+    for ia, k in enumerate(keys_a):
+        s = span.get(k)
+        if s is None:
+            continue
+        start, end = s
+        j = unmatched(bisect.bisect_left(pos, cursor, start, end))
+        if j == end:
+            j = unmatched(start)
+            if j == end:
+                continue
+        ib = pos[j]
+        nxt[j] = j + 1
+        pairs.append((ia, ib))
+        cursor = ib + 1
+    return pairs
+
+def diff_hashes(keys_a, raws_a, keys_b, raws_b):
+    """Compare two captures given their hash_frames() arrays.  Frames are
+    matched on their keys, which are their raw hashes unless matching on
+    fields.
+    Returns a dict of:
+        'matched'       number of matching frames in the same order
+        'reordered'     [(index_a, index_b)] matching frames out of order
+        'differ'        [(index_a, index_b)] matching frames (in order or
+                        not) whose bytes differ; only when matching on fields
+        'changed'       [(index_a, index_b)] frames that correspond but don't match
+        'missing'       [index_a] frames only in A
+        'extra'         [index_b] frames only in B
+        'frames_a', 'frames_b'  frame counts"""
+    pairs = align(keys_a, keys_b)
+    in_order = _in_order([ib for ia, ib in pairs])
+    matched = 0
+    reordered = []
+    differ = []
+    anchor_a = []
+    anchor_b = []
+    seen_a = bytearray(len(raws_a))
+    seen_b = bytearray(len(raws_b))
+    for (ia, ib), anchor in zip(pairs, in_order):
+        seen_a[ia] = 1
+        seen_b[ib] = 1
+        if anchor:
+            matched += 1
+            anchor_a.append(ia)
+            anchor_b.append(ib)
+        else:
+            reordered.append((ia, ib))
+        if raws_a[ia] != raws_b[ib]:
+            differ.append((ia, ib))
+    # Group the unmatched frames by the pair of anchors they fall between
+    gaps_a = collections.defaultdict(list)
+    gaps_b = collections.defaultdict(list)
+    for ia in range(len(raws_a)):
+        if not seen_a[ia]:
+            gaps_a[bisect.bisect_left(anchor_a, ia)].append(ia)
+    for ib in range(len(raws_b)):
+        if not seen_b[ib]:
+            gaps_b[bisect.bisect_left(anchor_b, ib)].append(ib)
+    changed = []
+    missing = []
+    extra = []
+    for gap in sorted(set(gaps_a.keys()) | set(gaps_b.keys())):
+        in_a = gaps_a.get(gap, [])
+        in_b = gaps_b.get(gap, [])
+        # Pair them up in order
+        changed.extend(zip(in_a, in_b))
+        missing.extend(in_a[len(in_b):])
+        extra.extend(in_b[len(in_a):])
+    changed.sort()
+    return {
+        'matched': matched,
+        'reordered': reordered,
+        'differ': differ,
+        'changed': changed,
+        'missing': missing,
+        'extra': extra,
+        'frames_a': len(raws_a),
+        'frames_b': len(raws_b),
+    }
+
+def _flat(rec):
+    """{'layer.field': value} for every decoded field of record 'rec'."""
+    out = {}
+    for name in rec['layers']:
+        for key, val in rec[name].items():
+            if key == 'offset':
+                continue
+            if isinstance(val, memoryview):
+                val = val.tobytes()
+            out[name + '.' + key] = val
+    out['errors'] = rec['errors']
+    return out
+
+def field_diff(pkt_a, pkt_b, trailer_a=0, trailer_b=0):
+    """Decode both frames and return [(field, value_a, value_b)] for every
+    field that differs (None where a frame doesn't have the field)."""
+    a = _flat(ep.decode_record(_normalize(pkt_a, trailer_a)))
+    b = _flat(ep.decode_record(_normalize(pkt_b, trailer_b)))
+    diffs = []
+    for key in list(a.keys()) + [k for k in b.keys() if k not in a]:
+        if a.get(key) != b.get(key):
+            diffs.append((key, a.get(key), b.get(key)))
+    return diffs
+
+def _fetch(frames, indices):
+    """{index: frame bytes} for the frames at 'indices' in iterable 'frames'."""
+    want = set(indices)
+    out = {}
+    if len(want) == 0:
+        return out
+    last = max(want)
+    for n, (timestamp, pkt) in enumerate(frames):
+        if n in want:
+            out[n] = bytes(pkt)
+        if n >= last:
+            break
+    return out
+
+def diff_files(file_a, file_b, fmt_a='pcap', fmt_b='pcap', fields=None, trailer_a=0, trailer_b=0, limit=100):
+    """Compare capture files 'file_a' and 'file_b' (formats as for
+    eth_pkt.read_frames).  'fields' is a list of eth_filter field names to
+    match frames on instead of their bytes.  Returns the diff_hashes() dict
+    plus 'field_diffs': {(index_a, index_b): field_diff()} for the first
+    'limit' changed frames and the first 'limit' that differ."""
+    key = None
+    if fields is not None:
+        import eth_filter
+        key = eth_filter.compile_key(fields)
+    keys_a, raws_a = hash_frames(ep.read_frames(file_a, fmt_a), trailer_a, key)
+    keys_b, raws_b = hash_frames(ep.read_frames(file_b, fmt_b), trailer_b, key)
+    result = diff_hashes(keys_a, raws_a, keys_b, raws_b)
+    shown = result['changed'][:limit] + result['differ'][:limit]
+    frames_a = _fetch(ep.read_frames(file_a, fmt_a), [ia for ia, ib in shown])
+    frames_b = _fetch(ep.read_frames(file_b, fmt_b), [ib for ia, ib in shown])
+    result['field_diffs'] = {}
+    for ia, ib in shown:
+        result['field_diffs'][(ia, ib)] = field_diff(frames_a[ia], frames_b[ib], trailer_a, trailer_b)
+    return result
+
+def _fmt_value(key, val):
+    if isinstance(val, bytes):
+        if key.endswith('_mac') or key.endswith('.sha') or key.endswith('.tha'):
+            return eth_render.mac(val)
+        if key.endswith('_ip') or key.endswith('.spa') or key.endswith('.tpa'):
+            return eth_render.ip(val)
+        if len(val) > 32:
+            return eth_render.hexdump(val[:32]) + " ... ({} bytes)".format(len(val))
+        return eth_render.hexdump(val)
+    return str(val)
+
+def print_report(result, limit=100):
+    print("A: {} frames, B: {} frames".format(result['frames_a'], result['frames_b']))
+    print("{} matched, {} reordered, {} changed, {} missing from B, {} extra in B".format(
+        result['matched'], len(result['reordered']), len(result['changed']),
+        len(result['missing']), len(result['extra'])))
+    if len(result['differ']) > 0:
+        print("{} matched or reordered frames differ outside the matched fields".format(len(result['differ'])))
+    for ia, ib in result['reordered'][:limit]:
+        print("REORDERED: A[{}] is B[{}]".format(ia, ib))
+    field_diffs = result.get('field_diffs', {})
+    for ia, ib in result['differ'][:limit]:
+        print("DIFFERS: A[{}] vs B[{}]".format(ia, ib))
+        for key, val_a, val_b in field_diffs.get((ia, ib), ()):
+            print("    {}: {} -> {}".format(key, _fmt_value(key, val_a), _fmt_value(key, val_b)))
+    for ia, ib in result['changed'][:limit]:
+        print("CHANGED: A[{}] vs B[{}]".format(ia, ib))
+        for key, val_a, val_b in field_diffs.get((ia, ib), ()):
+            print("    {}: {} -> {}".format(key, _fmt_value(key, val_a), _fmt_value(key, val_b)))
+    for ia in result['missing'][:limit]:
+        print("MISSING: A[{}]".format(ia))
+    for ib in result['extra'][:limit]:
+        print("EXTRA: B[{}]".format(ib))
+    return
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Compare two ethernet captures frame by frame.")
+    parser.add_argument('file_a', help="First capture")
+    parser.add_argument('file_b', help="Second capture")
+    parser.add_argument('--fmt-a', default='pcap', choices=('pcap', 'gmii', 'hex'), help="Format of the first capture")
+    parser.add_argument('--fmt-b', default='pcap', choices=('pcap', 'gmii', 'hex'), help="Format of the second capture")
+    parser.add_argument('--trailer-a', default=0, type=int, help="Ignore this many bytes at the end of each frame in A (e.g. 4 for an FCS)")
+    parser.add_argument('--trailer-b', default=0, type=int, help="Ignore this many bytes at the end of each frame in B")
+    parser.add_argument('--fields', default=None, help="Match frames on these comma-separated eth_filter fields instead of their bytes")
+    parser.add_argument('--limit', default=100, type=int, help="Report at most this many frames of each kind")
+    args = parser.parse_args()
+    fields = None
+    if args.fields is not None:
+        fields = [f.strip() for f in args.fields.split(',')]
+    result = diff_files(args.file_a, args.file_b, args.fmt_a, args.fmt_b, fields,
+                        args.trailer_a, args.trailer_b, args.limit)
+    print_report(result, args.limit)
+    # Frames that match on the chosen fields count as the same
+    same = result['matched'] == result['frames_a'] == result['frames_b']
+    return 0 if same else 1
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
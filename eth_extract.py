@@ -1,21 +1,114 @@
 #! Extract GMII signals from a VCD file and parse the resulting packet
+#
+# The bus is sampled on its own clock: the data, valid and error nets are
+# read at every rising edge of the clock (the value each held just before
+# the edge, as a flop would see it), so the bytes stay in step however the
+# clock period drifts and whatever gaps the dump has.  Each run of edges with
+# valid (rx_dv/tx_en) high is one frame, preamble and SFD included.
+# Signals come from a wavecache (built from the VCD on the first run).
+#
+# Usage:
+#   python3 eth_extract.py sim.vcd                     # Decode gmii_rx* frames
+#   python3 eth_extract.py sim.vcd --side tx -o tx.gmii
+#   python3 eth_extract.py sim.vcd --signals tb.clk,tb.rxd,tb.rx_dv,tb.rx_er
 
 import os
-import vcdextract as vcde
 import eth_pkt as ethp
 
+def _columns(data, start=0):
+    """(times, values) numpy arrays from a vcdread.Signal (or anything with
+    'times' and 'values' columns) or a list of (time, value) changes,
+    beginning at change 'start'."""
+    import numpy as np
+    if hasattr(data, 'times'):
+        times = np.asarray(data.times)[start:]
+        values = np.asarray(data.values)[start:]
+    else:
+        pairs = data[start:]
+        times = np.array([t for t, d in pairs])
+        values = np.array([d for t, d in pairs])
+    if times.dtype.kind == 'u':
+        # Keep time arithmetic signed
+        times = times.astype(np.int64)
+    return times, values
+
+class Resampler():
+    """resample() over a stream of changes delivered in chunks.
+    Each call to feed() takes the next chunk of change times and values
+    and returns (times, values) numpy arrays of the samples that are now
+    settled; concatenated, they're exactly resample() of the whole stream.
+    The first change fed sets the time of sample 0."""
+    def __init__(self, dt):
+        self.dt = dt
+        self._t = None      # Time of the last sample returned
+        self._value = None  # ... and its value
+
+    def _grid(self, t, count):
+        """Times of the 'count' samples from 't' on.  Each is the one before
+        plus dt (a running sum, like resample()'s loop), so float sample
+        times round the same way."""
+        import numpy as np
+        steps = np.full(count, self.dt, dtype=np.result_type(t, self.dt))
+        steps[0] = t
+        return np.add.accumulate(steps)
+
+    def feed(self, times, values):
+        import numpy as np
+        times = np.asarray(times)
+        values = np.asarray(values)
+        if times.dtype.kind == 'u':
+            times = times.astype(np.int64)
+        if len(times) == 0:
+            return times[:0], values[:0]
+        if self._t is None:
+            # Sample 0 takes the first change
+            self._t = times[0]
+            self._value = values[0]
+            out_times, out_values = times[:1], values[:1]
+            times = times[1:]
+            values = values[1:]
+        else:
+            out_times, out_values = times[:0], values[:0]
+        if len(times) == 0:
+            return out_times, out_values
+        # Sample times from the last one taken, far enough to pass every change
+        count = int((times[-1] - self._t)/self.dt) + 3
+        grid = self._grid(self._t, max(count, 2))
+        # For each change, the first sample (relative to the last taken) at or after it
+        steps = np.searchsorted(grid, times, side='left')
+        # Only one change is taken per sample, so change n lands on
+        # k[n] = max(steps[n], k[n-1] + 1); with u = k - n that's a running max
+        n = np.arange(len(times) + 1)
+        u = np.maximum.accumulate(np.concatenate(([0], steps - n[1:])))
+        k = u + n
+        last = int(k[-1])
+        if last >= len(grid):
+            grid = np.concatenate((grid, self._grid(grid[-1], last - len(grid) + 2)[1:]))
+        v = np.concatenate(([self._value], values))
+        # Each value holds from the sample that takes it up to the next one
+        # (sample 0 here is the last one already returned)
+        counts = np.diff(k)
+        counts[0] -= 1
+        out_values = np.concatenate((out_values, np.repeat(v[:-1], counts), v[-1:]))
+        out_times = np.concatenate((out_times, grid[1:last + 1]))
+        self._t = grid[last]
+        self._value = v[-1]
+        return out_times, out_values
+
+def resample_columns(times, values, dt):
+    """Vectorized resample() of change columns 'times'/'values'.
+    Returns (times, values) numpy arrays of the samples."""
+    return Resampler(dt).feed(times, values)
+
 def resample(data, dt, start=1):
-    rsd = [data[start]]
-    t0, d0 = data[start]
-    n = start + 1
-    while n < len(data):
-        t, d = data[n]
-        t0 += dt
-        if t0 >= t:
-            d0 = d
-            n += 1
-        rsd.append((t0, d0))
-    return rsd
+    """Sample the changes in 'data' (a list of (time, value), or a
+    vcdread.Signal) every 'dt', beginning with change 'start'.  One change
+    is taken per sample: the first sample at or after its time that
+    hasn't already taken one.  Stops at the sample that takes the last
+    change.  Returns a list of (time, value)."""
+    times, values = _columns(data, start)
+    rs_times, rs_values = resample_columns(times, values, dt)
+    return list(zip(rs_times.tolist(), rs_values.tolist()))
 
 # resample by 10ns
 test_data = [
@@ -49,32 +142,127 @@ def testResample():
         print("\nrsd_check = (len {})\n{}".format(len(rsd_check), rsd_check))
     return
 
+# ===== Clock-edge sampling =====
+
+# Default net names (after --prefix) for each side: clock, data, valid, error
+GMII_SIGNALS = {
+    'rx': ('rx_clk', 'rxd', 'rx_dv', 'rx_er'),
+    'tx': ('tx_clk', 'txd', 'tx_en', 'tx_er'),
+}
+
+def rising_edges(times, values):
+    """Times at which a 1-bit signal with change columns 'times'/'values'
+    goes from 0 to 1."""
+    import numpy as np
+    times = np.asarray(times)
+    values = np.asarray(values)
+    rising = (values[1:] == 1) & (values[:-1] == 0)
+    return times[1:][rising]
+
+def sample_at(times, values, edges):
+    """Value of the signal with change columns 'times'/'values' just before
+    each time in 'edges' (0 before its first change)."""
+    import numpy as np
+    values = np.asarray(values)
+    idx = np.searchsorted(times, edges, side='left') - 1
+    if len(values) == 0:
+        return np.zeros(len(edges), dtype=values.dtype)
+    return np.where(idx >= 0, values[np.maximum(idx, 0)], 0).astype(values.dtype)
+
+def gmii_frames(clk, data, valid, error=None):
+    """Rebuild frames from GMII nets given as (times, values) change columns.
+    Yields (time, frame, errored) for each run of clock edges with 'valid'
+    high: 'time' is the first edge, 'frame' the bytes sampled (preamble and
+    SFD included) and 'errored' whether 'error' was high during the frame."""
+    import numpy as np
+    edges = rising_edges(*clk)
+    if len(edges) == 0:
+        return
+    dv = sample_at(valid[0], valid[1], edges) != 0
+    if not dv.any():
+        return
+    d = sample_at(data[0], data[1], edges).astype(np.uint8)
+    if error is not None:
+        er = sample_at(error[0], error[1], edges) != 0
+    # Edges where valid rises and falls
+    change = np.diff(dv.astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(change == 1)
+    ends = np.flatnonzero(change == -1)
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        errored = bool(er[start:end].any()) if error is not None else False
+        yield (edges[start].item(), d[start:end].tobytes(), errored)
+    return
+
+def load_signals(filename, names, cache=True):
+    """({name: (times, values)}, timescale): change columns of signals
+    'names' from VCD file 'filename', through a wavecache (built on first
+    use) unless 'cache' is False, and the dump's seconds per time unit.
+    'filename' may also be a cache directory."""
+    import wavecache
+    if os.path.isdir(filename):
+        wave = wavecache.WaveCache(filename)
+    elif cache:
+        wave = wavecache.load(filename, names)
+    else:
+        import vcdread
+        sigs = vcdread.read(filename, names)
+        return {name: _columns(sig) for name, sig in sigs.items()}, next(iter(sigs.values())).timescale
+    return {name: wave.columns(name) for name in names}, wave.timescale
+
+_TIME_UNITS = (('s', 1.0), ('ms', 1e-3), ('us', 1e-6), ('ns', 1e-9), ('ps', 1e-12), ('fs', 1e-15))
+
+def format_time(t, timescale):
+    """Dump time 't' in the largest unit that keeps it at least 1 (e.g.
+    '12.5 us'), given 'timescale' seconds per time unit."""
+    if timescale is None:
+        return str(t)
+    seconds = t*timescale
+    if seconds == 0:
+        return "0 s"
+    for unit, size in _TIME_UNITS:
+        if abs(seconds) >= size:
+            break
+    return "{:g} {}".format(seconds/size, unit)
+
 def main():
     import argparse
-    parser = vcde.ArgumentParser(description="Extract GMII traces from a VCD file and parse the packets.")
+    parser = argparse.ArgumentParser(description="Extract GMII traces from a VCD file and parse the packets.")
+    parser.add_argument('filename', help="VCD file (or a wavecache directory)")
+    parser.add_argument('--side', default='rx', choices=('rx', 'tx', 'both'), help="Which direction to extract")
+    parser.add_argument('--prefix', default='gmii_', help="Prefix of the default net names (e.g. gmii_rxd)")
+    parser.add_argument('--signals', default=None,
+                        help="Comma-separated clock,data,valid[,error] nets to use instead of the defaults")
+    parser.add_argument('--no-cache', default=False, action='store_true', help="Read the VCD directly without caching")
+    parser.add_argument('-o', '--output', default=None,
+                        help="Write the frames to this file as a GMII byte stream (see eth_pkt --gmii) instead of decoding them")
     args = parser.parse_args()
-    pkt_ratio = int(args.packet_ratio)
-    fname, fext = os.path.splitext(args.filename)
-    if fext == ".pickle":
-        sig_data = vcde.unPickle(args.filename, signals=args.sig_names)
+    if args.signals is not None:
+        buses = {'bus': [name.strip() for name in args.signals.split(',')]}
+        if len(buses['bus']) not in (3, 4):
+            parser.error("--signals takes clock,data,valid[,error]")
     else:
-        sig_data = vcde.extract(args.filename, signals=args.sig_names)
-    if pkt_ratio > 0:
-        for _id, sl in sig_data.items():
-            pkts = sl.splitPackets(pkt_ratio, start=1)
-            print("{} split into {} packets.".format(sl.name, len(pkts)))
-            #for n in range(1):
-            #n = 2
-            #if True:
-            for n in range(len(pkts)):
-                pkt = pkts[n]
-                pkt_span = pkt[-1][0] - pkt[0][0]
-                print("================ Packet {} spans {} ns (starting at {} ns) ================".format(n, pkt_span, pkt[0][0]))
-                # TODO - Why do I need a factor of 2 here?
-                rsd = vcde.resample(pkt, 2*sl.tclk, start=0)
-                #print("len(rsd) = {}, pkt_span/(2*tclk) = {}".format(len(rsd), pkt_span/(2*sl.tclk)))
-                #print([hex(x) for x in rsd])
-                ethp.decode(rsd)
+        sides = ('rx', 'tx') if args.side == 'both' else (args.side,)
+        buses = {side: [args.prefix + name for name in GMII_SIGNALS[side]] for side in sides}
+    names = [name for bus in buses.values() for name in bus]
+    sigs, timescale = load_signals(args.filename, names, cache=not args.no_cache)
+    frames = []
+    for side, bus in buses.items():
+        error = sigs[bus[3]] if len(bus) > 3 else None
+        for t, frame, errored in gmii_frames(sigs[bus[0]], sigs[bus[1]], sigs[bus[2]], error):
+            frames.append((t, side, frame, errored))
+    frames.sort(key=lambda x: x[0])
+    if args.output is not None:
+        with open(args.output, 'wb') as fd:
+            for t, side, frame, errored in frames:
+                fd.write(frame)
+        print("{} frames written to {}".format(len(frames), args.output))
+        return
+    for n, (t, side, frame, errored) in enumerate(frames):
+        print("================ Packet {} ({}) at {} ================".format(n, side, format_time(t, timescale)))
+        if errored:
+            print("=== ERROR: {}_er asserted during the frame".format(side))
+        ethp.decode(frame)
+    return
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,412 @@
+#! /usr/bin/python3
+
+# Pre-decode packet filters
+#
+# A filter expression is compiled into a predicate that reads only the bytes
+# it needs straight out of the frame, so unwanted frames can be dropped before
+# eth_pkt does any real decoding.
+#
+# Usage:
+#   import eth_filter
+#   match = eth_filter.compile_filter("ethertype==ipv4 and udp.dport==50006")
+#   if match(pkt):
+#       rec = eth_pkt.decode_record(pkt)
+#
+# Syntax:
+#   expr    := term (('or' | '||') term)*
+#   term    := factor (('and' | '&&') factor)*
+#   factor  := ('not' | '!') factor | '(' expr ')' | field [op value]
+#   op      := '==' | '!=' | '<' | '<=' | '>' | '>='
+#   value   := integer (decimal or 0x hex) | a.b.c.d | aa:bb:cc:dd:ee:ff | name
+# A bare field is true if the frame has it (e.g. 'udp', 'arp', 'ipv6').
+# Comparisons against a field the frame doesn't have are always false.
+
+import re
+import struct
+import eth_pkt as ep
+
+class FilterError(Exception):
+    pass
+
+class _Missing():
+    """Value of a field the frame doesn't have: every comparison is false."""
+    def __eq__(self, other):
+        return False
+    __ne__ = __lt__ = __le__ = __gt__ = __ge__ = __eq__
+    def __bool__(self):
+        return False
+
+_NA = _Missing()
+
+_u16 = struct.Struct('!H').unpack_from
+_u32 = struct.Struct('!I').unpack_from
+
+# ===== Field accessors =====
+# Each takes (buf, start) where 'start' is the index of the destination MAC,
+# and returns the field value or _NA.
+
+def _ethertype(b, s):
+    if len(b) < s + ep.OFFSET_ETHERTYPE + 2:
+        return _NA
+    return _u16(b, s + ep.OFFSET_ETHERTYPE)[0]
+
+def _eth_dst(b, s):
+    if len(b) < s + ep.OFFSET_DEST_MAC + 6:
+        return _NA
+    return bytes(b[s+ep.OFFSET_DEST_MAC:s+ep.OFFSET_DEST_MAC+6])
+
+def _eth_src(b, s):
+    if len(b) < s + ep.OFFSET_SRC_MAC + 6:
+        return _NA
+    return bytes(b[s+ep.OFFSET_SRC_MAC:s+ep.OFFSET_SRC_MAC+6])
+
+def _is_ipv4(b, s):
+    return _ethertype(b, s) == ep.ETHERTYPE_IPV4 and len(b) >= s + ep.OFFSET_IP_DEST_IP + 4
+
+def _is_ipv6(b, s):
+    return _ethertype(b, s) == ep.ETHERTYPE_IPV6 and len(b) >= s + ep.OFFSET_IPV6_PAYLOAD
+
+def _is_arp(b, s):
+    return _ethertype(b, s) == ep.ETHERTYPE_ARP and len(b) >= s + ep.OFFSET_ARP_TPA + 4
+
+def _ipv4_u8(offset):
+    def _field(b, s):
+        if not _is_ipv4(b, s):
+            return _NA
+        return b[s + offset]
+    return _field
+
+def _ipv4_u16(offset):
+    def _field(b, s):
+        if not _is_ipv4(b, s):
+            return _NA
+        return _u16(b, s + offset)[0]
+    return _field
+
+def _ipv4_u32(offset):
+    def _field(b, s):
+        if not _is_ipv4(b, s):
+            return _NA
+        return _u32(b, s + offset)[0]
+    return _field
+
+def _ipv6_u8(offset):
+    def _field(b, s):
+        if not _is_ipv6(b, s):
+            return _NA
+        return b[s + offset]
+    return _field
+
+def _arp_u16(offset):
+    def _field(b, s):
+        if not _is_arp(b, s):
+            return _NA
+        return _u16(b, s + offset)[0]
+    return _field
+
+def _arp_u32(offset):
+    def _field(b, s):
+        if not _is_arp(b, s):
+            return _NA
+        return _u32(b, s + offset)[0]
+    return _field
+
+# Header decode_record() needs whole before it decodes each upper layer
+_L4_HEADER_SIZE = {
+    ep.IP_PROTOCOL_ICMP: ep._ICMP_HEADER.size,
+    ep.IP_PROTOCOL_UDP: ep._UDP_HEADER.size,
+    ep.IP_PROTOCOL_TCP: ep._TCP_HEADER.size,
+    ep.IP_PROTOCOL_IPV6_ICMP: ep._ICMP_HEADER.size,
+}
+
+def _l4_offset(b, s, protocol):
+    """(offset, end) of the header after IPv4 (any IHL) or IPv6 (after any
+    extension headers) if it carries 'protocol', else (-1, 0).  'end' is
+    where the IP payload stops (its length field or the end of the frame,
+    whichever comes first).  As in eth_pkt.decode_record(), there's no
+    header if the IPv4 IHL is bad or the header doesn't fit before 'end'."""
+    et = _ethertype(b, s)
+    if et == ep.ETHERTYPE_IPV4:
+        if len(b) < s + ep.OFFSET_IP_DEST_IP + 4 or b[s + ep.OFFSET_IP_PROTOCOL] != protocol:
+            return -1, 0
+        ihl = b[s + ep.OFFSET_IP_VERSION_IHL] & 0xf
+        if ihl < 5:
+            # decode_record doesn't parse past a bad header length
+            return -1, 0
+        if _u16(b, s + ep.OFFSET_IP_FLAG_FRAG)[0] & ep.IP_FRAG_OFFSET_MASK:
+            # Not the first fragment, so there's no upper-layer header
+            return -1, 0
+        end = min(len(b), s + ep.OFFSET_IP_VERSION_IHL + _u16(b, s + ep.OFFSET_IP_TOTAL_LENGTH)[0])
+        o = s + ep.OFFSET_IP_VERSION_IHL + 4*ihl
+    elif et == ep.ETHERTYPE_IPV6:
+        if len(b) < s + ep.OFFSET_IPV6_PAYLOAD:
+            return -1, 0
+        end = min(len(b), s + ep.OFFSET_IPV6_PAYLOAD + _u16(b, s + ep.OFFSET_IPV6_PAYLOAD_LENGTH)[0])
+        o, nh, chain, error = ep.ipv6_ext_walk(b, s + ep.OFFSET_IPV6_PAYLOAD, end, b[s + ep.OFFSET_IPV6_NEXT_HEADER])
+        if error is not None or nh != protocol:
+            return -1, 0
+    else:
+        return -1, 0
+    if end < o + _L4_HEADER_SIZE.get(protocol, 0):
+        return -1, 0
+    return o, end
+
+def _l4_u32(protocol, offset):
+    def _field(b, s):
+        o, end = _l4_offset(b, s, protocol)
+        if o < 0 or end < o + offset + 4:
+            return _NA
+        return _u32(b, o + offset)[0]
+    return _field
+
+def _l4_present(protocol, size):
+    def _field(b, s):
+        o, end = _l4_offset(b, s, protocol)
+        return o >= 0 and end >= o + size
+    return _field
+
+def _l4_u8(protocol, offset):
+    def _field(b, s):
+        o, end = _l4_offset(b, s, protocol)
+        if o < 0 or end < o + offset + 1:
+            return _NA
+        return b[o + offset]
+    return _field
+
+def _l4_u16(protocol, offset):
+    def _field(b, s):
+        o, end = _l4_offset(b, s, protocol)
+        if o < 0 or end < o + offset + 2:
+            return _NA
+        return _u16(b, o + offset)[0]
+    return _field
+
+# name -> (accessor, kind of value it compares against)
+_fields = {
+    'ethertype':    (_ethertype, 'int'),
+    'eth.type':     (_ethertype, 'int'),
+    'eth.dst':      (_eth_dst, 'mac'),
+    'eth.src':      (_eth_src, 'mac'),
+    'ipv4':         (_is_ipv4, None),
+    'ipv6':         (_is_ipv6, None),
+    'arp':          (_is_arp, None),
+    'ip.proto':     (_ipv4_u8(ep.OFFSET_IP_PROTOCOL), 'int'),
+    'ip.ttl':       (_ipv4_u8(ep.OFFSET_IP_TTL), 'int'),
+    'ip.len':       (_ipv4_u16(ep.OFFSET_IP_TOTAL_LENGTH), 'int'),
+    'ip.id':        (_ipv4_u16(ep.OFFSET_IP_ID), 'int'),
+    'ip.src':       (_ipv4_u32(ep.OFFSET_IP_SRC_IP), 'ip'),
+    'ip.dst':       (_ipv4_u32(ep.OFFSET_IP_DEST_IP), 'ip'),
+    'ipv6.nxt':     (_ipv6_u8(ep.OFFSET_IPV6_NEXT_HEADER), 'int'),
+    'ipv6.hlim':    (_ipv6_u8(ep.OFFSET_IPV6_HOP_LIMIT), 'int'),
+    'arp.oper':     (_arp_u16(ep.OFFSET_ARP_OPER), 'int'),
+    'arp.spa':      (_arp_u32(ep.OFFSET_ARP_SPA), 'ip'),
+    'arp.tpa':      (_arp_u32(ep.OFFSET_ARP_TPA), 'ip'),
+    'udp':          (_l4_present(ep.IP_PROTOCOL_UDP, 8), None),
+    'udp.sport':    (_l4_u16(ep.IP_PROTOCOL_UDP, ep.PAYLOAD_OFFSET_UDP_SRC_PORT), 'int'),
+    'udp.dport':    (_l4_u16(ep.IP_PROTOCOL_UDP, ep.PAYLOAD_OFFSET_UDP_DEST_PORT), 'int'),
+    'udp.len':      (_l4_u16(ep.IP_PROTOCOL_UDP, ep.PAYLOAD_OFFSET_UDP_LENGTH), 'int'),
+    'tcp':          (_l4_present(ep.IP_PROTOCOL_TCP, 20), None),
+    'tcp.sport':    (_l4_u16(ep.IP_PROTOCOL_TCP, ep.PAYLOAD_OFFSET_TCP_SRC_PORT), 'int'),
+    'tcp.dport':    (_l4_u16(ep.IP_PROTOCOL_TCP, ep.PAYLOAD_OFFSET_TCP_DEST_PORT), 'int'),
+    'tcp.seq':      (_l4_u32(ep.IP_PROTOCOL_TCP, ep.PAYLOAD_OFFSET_TCP_SEQ), 'int'),
+    'tcp.ack':      (_l4_u32(ep.IP_PROTOCOL_TCP, ep.PAYLOAD_OFFSET_TCP_ACK), 'int'),
+    'tcp.flags':    (_l4_u8(ep.IP_PROTOCOL_TCP, ep.PAYLOAD_OFFSET_TCP_FLAGS), 'int'),
+    'tcp.window':   (_l4_u16(ep.IP_PROTOCOL_TCP, ep.PAYLOAD_OFFSET_TCP_WINDOW), 'int'),
+    'icmp':         (_l4_present(ep.IP_PROTOCOL_ICMP, 4), None),
+    'icmp.type':    (_l4_u8(ep.IP_PROTOCOL_ICMP, ep.PAYLOAD_OFFSET_ICMP_TYPE), 'int'),
+    'icmp.code':    (_l4_u8(ep.IP_PROTOCOL_ICMP, ep.PAYLOAD_OFFSET_ICMP_CODE), 'int'),
+    'icmpv6':       (_l4_present(ep.IP_PROTOCOL_IPV6_ICMP, 4), None),
+    'icmpv6.type':  (_l4_u8(ep.IP_PROTOCOL_IPV6_ICMP, ep.PAYLOAD_OFFSET_ICMP_TYPE), 'int'),
+    'icmpv6.code':  (_l4_u8(ep.IP_PROTOCOL_IPV6_ICMP, ep.PAYLOAD_OFFSET_ICMP_CODE), 'int'),
+}
+
+# Alternate spellings
+_aliases = {
+    'eth.dest': 'eth.dst',
+    'ip.protocol': 'ip.proto',
+    'ip.dest': 'ip.dst',
+    'udp.srcport': 'udp.sport',
+    'udp.src_port': 'udp.sport',
+    'udp.dstport': 'udp.dport',
+    'udp.dest_port': 'udp.dport',
+    'udp.length': 'udp.len',
+    'tcp.srcport': 'tcp.sport',
+    'tcp.src_port': 'tcp.sport',
+    'tcp.dstport': 'tcp.dport',
+    'tcp.dest_port': 'tcp.dport',
+}
+
+# Symbolic values
+_names = {
+    'ipv4': ep.ETHERTYPE_IPV4,
+    'arp': ep.ETHERTYPE_ARP,
+    'wol': ep.ETHERTYPE_WOL,
+    'vlan': ep.ETHERTYPE_VLAN,
+    'ipv6': ep.ETHERTYPE_IPV6,
+    'ptp': ep.ETHERTYPE_PTP,
+    'icmp': ep.IP_PROTOCOL_ICMP,
+    'tcp': ep.IP_PROTOCOL_TCP,
+    'udp': ep.IP_PROTOCOL_UDP,
+    'icmpv6': ep.IP_PROTOCOL_IPV6_ICMP,
+}
+
+_ops = ('==', '!=', '<=', '>=', '<', '>')
+
+_token_re = re.compile(r"\s*(==|!=|<=|>=|<|>|&&|\|\||!|\(|\)|[A-Za-z0-9_.:]+)")
+
+def _tokenize(expr):
+    tokens = []
+    pos = 0
+    expr = expr.strip()
+    while pos < len(expr):
+        _match = _token_re.match(expr, pos)
+        if not _match:
+            raise FilterError("Unexpected character at {}: {}".format(pos, expr[pos:]))
+        tokens.append(_match.group(1))
+        pos = _match.end()
+    return tokens
+
+def _parse_value(kind, token):
+    if kind == 'mac':
+        parts = token.split(':')
+        try:
+            if len(parts) != 6:
+                raise ValueError
+            # bytes() rejects octets over 0xff
+            return bytes([int(x, 16) for x in parts])
+        except ValueError:
+            raise FilterError("Invalid MAC address: {}".format(token))
+    if kind == 'ip' and '.' in token:
+        parts = token.split('.')
+        try:
+            if len(parts) != 4:
+                raise ValueError
+            return int.from_bytes(bytes([int(x) for x in parts]), 'big')
+        except ValueError:
+            raise FilterError("Invalid IPv4 address: {}".format(token))
+    val = _names.get(token.lower())
+    if val is not None:
+        return val
+    try:
+        return int(token, 0)
+    except ValueError:
+        raise FilterError("Invalid value: {}".format(token))
+
+class _Parser():
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+        # Accessor functions referenced by the generated code
+        self.env = {}
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None
+
+    def take(self):
+        tok = self.peek()
+        if tok is None:
+            raise FilterError("Unexpected end of filter")
+        self.pos += 1
+        return tok
+
+    def expr(self):
+        terms = [self.term()]
+        while self.peek() in ('or', '||'):
+            self.take()
+            terms.append(self.term())
+        return "(" + " or ".join(terms) + ")"
+
+    def term(self):
+        factors = [self.factor()]
+        while self.peek() in ('and', '&&'):
+            self.take()
+            factors.append(self.factor())
+        return "(" + " and ".join(factors) + ")"
+
+    def factor(self):
+        tok = self.take()
+        if tok in ('not', '!'):
+            return "(not {})".format(self.factor())
+        if tok == '(':
+            inner = self.expr()
+            if self.take() != ')':
+                raise FilterError("Expected ')'")
+            return inner
+        name = _aliases.get(tok.lower(), tok.lower())
+        if name not in _fields:
+            raise FilterError("Unknown field: {}".format(tok))
+        accessor, kind = _fields[name]
+        ident = "_f{}".format(len(self.env))
+        self.env[ident] = accessor
+        if self.peek() in _ops:
+            if kind is None:
+                raise FilterError("'{}' can't be compared".format(tok))
+            op = self.take()
+            value = _parse_value(kind, self.take())
+            return "({}(b, s) {} {!r})".format(ident, op, value)
+        if kind is not None:
+            raise FilterError("'{}' needs a comparison".format(tok))
+        return "{}(b, s)".format(ident)
+
+def compile_filter(expr):
+    """Compile filter expression 'expr' into a predicate match(pkt) -> bool.
+    'pkt' is a frame (bytes-like or a list of ints), with or without a preamble."""
+    parser = _Parser(_tokenize(expr))
+    body = parser.expr()
+    if parser.peek() is not None:
+        raise FilterError("Unexpected '{}'".format(parser.peek()))
+    env = dict(parser.env)
+    env['_findStart'] = ep.findStart
+    env['_as_buffer'] = ep.as_buffer
+    # The generated code only contains our own identifiers, operators and
+    # repr()s of parsed ints/bytes.
+    src = "\n".join([
+        "def match(b):",
+        "    if not isinstance(b, (bytes, bytearray, memoryview)):",
+        "        b = _as_buffer(b)",
+        "    s = 0",
+        "    if len(b) > 0 and b[0] in (0x55, 0xaa):",
+        "        s = _findStart(b)",
+        "    return bool({})".format(body),
+    ])
+    exec(src, env)
+    return env['match']
+
+def field_names():
+    """Names of every field that filters (and compile_key) can use."""
+    return sorted(_fields.keys())
+
+def compile_key(names):
+    """Return key(pkt) -> tuple of the values of filter fields 'names' (e.g.
+    ['ip.src', 'udp.dport']), with None for fields the frame doesn't have.
+    Useful for grouping or matching frames on a subset of their fields."""
+    accessors = []
+    for tok in names:
+        name = _aliases.get(tok.lower(), tok.lower())
+        if name not in _fields:
+            raise FilterError("Unknown field: {}".format(tok))
+        accessors.append(_fields[name][0])
+    findStart = ep.findStart
+    as_buffer = ep.as_buffer
+    def key(b):
+        if not isinstance(b, (bytes, bytearray, memoryview)):
+            b = as_buffer(b)
+        s = 0
+        if len(b) > 0 and b[0] in (0x55, 0xaa):
+            s = findStart(b)
+        return tuple([None if v is _NA else v for v in [f(b, s) for f in accessors]])
+    return key
+
+if __name__ == "__main__":
+    import sys
+    import pcap
+    match = compile_filter(sys.argv[1])
+    nframes = 0
+    nmatch = 0
+    for timestamp, pkt in pcap.read_file(sys.argv[2]):
+        nframes += 1
+        if match(pkt):
+            nmatch += 1
+    print("{} of {} frames match".format(nmatch, nframes))
@@ -0,0 +1,199 @@
+#! /usr/bin/python3
+
+# Flow aggregation over records from eth_pkt.decode_record()
+#
+# Usage:
+#   import eth_pkt, eth_flow, pcap
+#   table = eth_flow.FlowTable(max_flows=100000)
+#   for timestamp, pkt in pcap.read_file("capture.pcap"):
+#       table.add(eth_pkt.decode_record(pkt), timestamp)
+#   for flow in table.flows():
+#       print(flow)
+
+import collections
+from array import array
+
+import eth_render
+
+def flow_key(rec):
+    """Return the flow key for record 'rec':
+        IP with UDP/TCP:    (src_ip, dest_ip, protocol, src_port, dest_port)
+        Other IP:           (src_ip, dest_ip, protocol, 0, 0)
+        Non-IP:             (src_mac, dest_mac, ethertype)
+    or None if the record has no Ethernet header."""
+    ip = rec.get('ipv4')
+    if ip is not None:
+        protocol = ip['protocol']
+    else:
+        ip = rec.get('ipv6')
+        if ip is not None:
+            protocol = ip['next_headers'][-1][0]
+    if ip is not None:
+        l4 = rec.get('udp')
+        if l4 is None:
+            l4 = rec.get('tcp')
+        if l4 is not None:
+            return (ip['src_ip'], ip['dest_ip'], protocol, l4['src_port'], l4['dest_port'])
+        return (ip['src_ip'], ip['dest_ip'], protocol, 0, 0)
+    eth = rec.get('eth')
+    if eth is None:
+        return None
+    return (eth['src_mac'], eth['dest_mac'], eth['ethertype'])
+
+class FlowTable():
+    """Per-flow packet/byte counts, first/last timestamps and inter-arrival
+    statistics.  Stats live in flat arrays indexed by a slot number, so each
+    flow costs a few dozen bytes plus its key.  When 'max_flows' flows are
+    being tracked, the least recently seen flow is evicted to make room and
+    passed to on_evict(key, stats) if given."""
+    def __init__(self, max_flows=65536, on_evict=None):
+        self.max_flows = max_flows
+        self.on_evict = on_evict
+        self.evicted = 0
+        # key -> slot, least recently seen first
+        self._slots = collections.OrderedDict()
+        self._free = []
+        self._packets = array('Q')
+        self._bytes = array('Q')
+        self._first = array('d')
+        self._last = array('d')
+        self._iat_min = array('d')
+        self._iat_max = array('d')
+        self._iat_mean = array('d')
+        self._iat_m2 = array('d')   # Sum of squared deviations (Welford)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _new_slot(self):
+        if len(self._free) > 0:
+            return self._free.pop()
+        if len(self._slots) >= self.max_flows:
+            key, slot = self._slots.popitem(last=False)
+            self.evicted += 1
+            if self.on_evict is not None:
+                self.on_evict(key, self._stats(slot))
+            return slot
+        slot = len(self._packets)
+        for col in (self._packets, self._bytes):
+            col.append(0)
+        for col in (self._first, self._last, self._iat_min, self._iat_max, self._iat_mean, self._iat_m2):
+            col.append(0.0)
+        return slot
+
+    def update(self, key, timestamp, length):
+        """Count one packet of 'length' bytes at 'timestamp' (seconds) on flow 'key'."""
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._new_slot()
+            self._slots[key] = slot
+            self._packets[slot] = 1
+            self._bytes[slot] = length
+            self._first[slot] = timestamp
+            self._last[slot] = timestamp
+            self._iat_min[slot] = 0.0
+            self._iat_max[slot] = 0.0
+            self._iat_mean[slot] = 0.0
+            self._iat_m2[slot] = 0.0
+            return
+        self._slots.move_to_end(key)
+        n = self._packets[slot]     # Number of inter-arrival samples after this one
+        iat = timestamp - self._last[slot]
+        if n == 1 or iat < self._iat_min[slot]:
+            self._iat_min[slot] = iat
+        if n == 1 or iat > self._iat_max[slot]:
+            self._iat_max[slot] = iat
+        delta = iat - self._iat_mean[slot]
+        mean = self._iat_mean[slot] + delta/n
+        self._iat_mean[slot] = mean
+        self._iat_m2[slot] += delta*(iat - mean)
+        self._packets[slot] = n + 1
+        self._bytes[slot] += length
+        self._last[slot] = timestamp
+        return
+
+    def add(self, rec, timestamp, length=None):
+        """Count decoded record 'rec' seen at 'timestamp'.  'length' defaults
+        to the frame length in the record."""
+        key = flow_key(rec)
+        if key is None:
+            return
+        if length is None:
+            length = rec['length']
+        self.update(key, timestamp, length)
+        return
+
+    def _stats(self, slot):
+        n = self._packets[slot]
+        if n > 2:
+            iat_var = self._iat_m2[slot]/(n - 2)
+        else:
+            iat_var = 0.0
+        return {
+            'packets': n,
+            'bytes': self._bytes[slot],
+            'first': self._first[slot],
+            'last': self._last[slot],
+            'iat_min': self._iat_min[slot],
+            'iat_max': self._iat_max[slot],
+            'iat_mean': self._iat_mean[slot],
+            'iat_var': iat_var,
+        }
+
+    def get(self, key):
+        """Return the stats dict for flow 'key', or None if it isn't tracked."""
+        slot = self._slots.get(key)
+        if slot is None:
+            return None
+        return self._stats(slot)
+
+    def flows(self):
+        """Yield (key, stats) for every tracked flow, least recently seen first."""
+        for key, slot in self._slots.items():
+            yield (key, self._stats(slot))
+
+    def remove(self, key):
+        """Stop tracking flow 'key'.  Returns its stats (or None)."""
+        slot = self._slots.pop(key, None)
+        if slot is None:
+            return None
+        stats = self._stats(slot)
+        self._free.append(slot)
+        return stats
+
+    def expire(self, now, timeout):
+        """Evict every flow not seen within 'timeout' seconds of 'now'."""
+        while len(self._slots) > 0:
+            key, slot = next(iter(self._slots.items()))
+            if now - self._last[slot] <= timeout:
+                break
+            stats = self.remove(key)
+            self.evicted += 1
+            if self.on_evict is not None:
+                self.on_evict(key, stats)
+        return
+
+def _fmt_key(key):
+    if len(key) == 5:
+        src, dest, protocol, sport, dport = key
+        if len(src) == 16:
+            # Brackets keep the port apart from the address
+            return "[{}]:{} -> [{}]:{} proto {}".format(eth_render.ipv6(src), sport, eth_render.ipv6(dest), dport, protocol)
+        return "{}:{} -> {}:{} proto {}".format(eth_render.ipv4(src), sport, eth_render.ipv4(dest), dport, protocol)
+    src, dest, ethtype = key
+    return "{} -> {} ethertype 0x{:04x}".format(eth_render.mac(src), eth_render.mac(dest), ethtype)
+
+if __name__ == "__main__":
+    import sys
+    import eth_pkt
+    import pcap
+    table = FlowTable()
+    for timestamp, pkt in pcap.read_file(sys.argv[1]):
+        if timestamp is None:
+            timestamp = 0.0
+        table.add(eth_pkt.decode_record(pkt), timestamp)
+    for key, stats in table.flows():
+        print("{}: {} packets, {} bytes, {:.6f} s to {:.6f} s, mean IAT {:.6f} s".format(
+            _fmt_key(key), stats['packets'], stats['bytes'], stats['first'], stats['last'], stats['iat_mean']))
+    if table.evicted > 0:
+        print("({} flows evicted)".format(table.evicted))
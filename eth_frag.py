@@ -0,0 +1,202 @@
+#! /usr/bin/python3
+
+# IPv4 fragment reassembly for eth_pkt
+#
+# Fragments are collected per datagram, keyed by (src_ip, dest_ip, ident,
+# protocol), into fixed-size buffers taken from a pool that never grows past
+# 'max_bytes'.  When every fragment of a datagram has arrived, a single
+# unfragmented frame is rebuilt (the first fragment's Ethernet and IPv4
+# headers, with the length, flags and checksum fixed up, followed by the
+# whole payload) and handed back for decoding.  Incomplete datagrams are
+# dropped after 'timeout' seconds, or oldest first when the pool runs out.
+#
+# Usage:
+#   import eth_pkt, eth_frag, pcap
+#   defrag = eth_frag.Reassembler()
+#   for timestamp, pkt in defrag.stream(pcap.read_file("capture.pcap")):
+#       rec = eth_pkt.decode_record(pkt)
+
+import collections
+import struct
+
+import eth_pkt as ep
+import eth_check
+
+# Largest IPv4 payload (total length is a 16-bit field); less with options
+MAX_IPV4_PAYLOAD = 0xffff - 20
+# Room in front of the payload for the Ethernet and largest IPv4 header
+_HEADROOM = 14 + 60
+SLAB_SIZE = _HEADROOM + 0xffff
+
+_U16 = struct.Struct('!H')
+
+class _Datagram():
+    __slots__ = ('slab', 'header', 'ranges', 'total', 'first_seen')
+
+    def __init__(self, slab, first_seen):
+        self.slab = slab
+        self.header = None          # Ethernet + IPv4 header of the first fragment
+        self.ranges = []            # Sorted, merged [start, end) payload ranges received
+        self.total = None           # Payload length, once the last fragment is seen
+        self.first_seen = first_seen
+
+    def add_range(self, start, end):
+        """Merge payload range [start, end) into self.ranges."""
+        ranges = self.ranges
+        out = []
+        placed = False
+        for r_start, r_end in ranges:
+            if r_end < start:
+                out.append((r_start, r_end))
+            elif end < r_start:
+                if not placed:
+                    out.append((start, end))
+                    placed = True
+                out.append((r_start, r_end))
+            else:
+                start = min(start, r_start)
+                end = max(end, r_end)
+        if not placed:
+            out.append((start, end))
+            out.sort()
+        self.ranges = out
+        return
+
+    def complete(self):
+        return (self.total is not None and self.header is not None
+                and len(self.ranges) == 1 and self.ranges[0] == (0, self.total))
+
+class Reassembler():
+    """Reassemble fragmented IPv4 datagrams.
+    'max_bytes' caps the memory held in reassembly buffers (each datagram in
+    progress holds one SLAB_SIZE buffer); 'timeout' is how long (seconds, in
+    capture time) to wait for the rest of a datagram.
+    Counters: 'completed', 'timed_out', 'evicted' (dropped to stay under
+    'max_bytes') and 'invalid' (fragments that can't be placed, and
+    datagrams too long to rebuild)."""
+    def __init__(self, max_bytes=16*SLAB_SIZE, timeout=30.0):
+        self.max_slabs = max(1, max_bytes // SLAB_SIZE)
+        self.timeout = timeout
+        # key -> _Datagram, oldest first
+        self._pending = collections.OrderedDict()
+        self._free = []
+        self._nslabs = 0
+        self.completed = 0
+        self.timed_out = 0
+        self.evicted = 0
+        self.invalid = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _slab(self):
+        if len(self._free) > 0:
+            return self._free.pop()
+        if self._nslabs < self.max_slabs:
+            self._nslabs += 1
+            return bytearray(SLAB_SIZE)
+        # Out of memory: drop the oldest datagram in progress
+        key, dgram = self._pending.popitem(last=False)
+        self.evicted += 1
+        return dgram.slab
+
+    def _release(self, key):
+        dgram = self._pending.pop(key)
+        self._free.append(dgram.slab)
+        return
+
+    def expire(self, now):
+        """Drop every datagram still incomplete 'timeout' seconds after its
+        first fragment."""
+        while len(self._pending) > 0:
+            key, dgram = next(iter(self._pending.items()))
+            if now - dgram.first_seen <= self.timeout:
+                break
+            self._release(key)
+            self.timed_out += 1
+        return
+
+    def feed(self, pkt, timestamp=None):
+        """Offer one frame.  Returns the frame to decode: 'pkt' itself if it
+        isn't an IPv4 fragment, the rebuilt frame (bytes) if it completes a
+        datagram, or None if it was a fragment that's now being held."""
+        if timestamp is not None:
+            self.expire(timestamp)
+        buf = ep.as_buffer(pkt)
+        start = ep.findStart(buf)
+        ip = start + ep._ETH_HEADER.size
+        if (len(buf) < ip + ep._IPV4_HEADER.size
+                or _U16.unpack_from(buf, start + ep.OFFSET_ETHERTYPE)[0] != ep.ETHERTYPE_IPV4):
+            return pkt
+        (version_ihl, dscp_ecn, total_len, ident, flag_frag, ttl, protocol,
+         checksum, src_ip, dest_ip) = ep._IPV4_HEADER.unpack_from(buf, ip)
+        if not (flag_frag & (ep.IP_FLAG_MF | ep.IP_FRAG_OFFSET_MASK)):
+            return pkt
+        hdr_len = 4*(version_ihl & 0xf)
+        payload = ip + hdr_len
+        payload_end = min(ip + total_len, len(buf))
+        frag_start = 8*(flag_frag & ep.IP_FRAG_OFFSET_MASK)
+        frag_end = frag_start + payload_end - payload
+        if (version_ihl >> 4) != 4 or hdr_len < 20 or payload_end < payload or frag_end > 0xffff - hdr_len:
+            self.invalid += 1
+            return None
+        key = (bytes(src_ip), bytes(dest_ip), ident, protocol)
+        dgram = self._pending.get(key)
+        if dgram is None:
+            slab = self._slab()
+            dgram = _Datagram(slab, timestamp if timestamp is not None else 0.0)
+            self._pending[key] = dgram
+        dgram.slab[_HEADROOM + frag_start:_HEADROOM + frag_end] = buf[payload:payload_end]
+        dgram.add_range(frag_start, frag_end)
+        if frag_start == 0:
+            dgram.header = bytes(buf[start:payload])
+        if not (flag_frag & ep.IP_FLAG_MF):
+            dgram.total = frag_end
+        if not dgram.complete():
+            return None
+        if len(dgram.header) - ep.OFFSET_IP_VERSION_IHL + dgram.total > 0xffff:
+            # Fits behind a later fragment's header, but not the first one's
+            self._release(key)
+            self.invalid += 1
+            return None
+        frame = self._rebuild(dgram)
+        self._release(key)
+        self.completed += 1
+        return frame
+
+    def _rebuild(self, dgram):
+        header = dgram.header
+        slab = dgram.slab
+        first = _HEADROOM - len(header)
+        slab[first:_HEADROOM] = header
+        ip = first + ep.OFFSET_IP_VERSION_IHL
+        hdr_len = len(header) - ep.OFFSET_IP_VERSION_IHL
+        # Unfragmented: new length, no MF, offset 0 (DF kept), fresh checksum
+        _U16.pack_into(slab, first + ep.OFFSET_IP_TOTAL_LENGTH, hdr_len + dgram.total)
+        flag_frag = _U16.unpack_from(slab, first + ep.OFFSET_IP_FLAG_FRAG)[0]
+        _U16.pack_into(slab, first + ep.OFFSET_IP_FLAG_FRAG, flag_frag & ep.IP_FLAG_DF)
+        _U16.pack_into(slab, first + ep.OFFSET_IP_CHECKSUM, 0)
+        with memoryview(slab) as mv:
+            checksum = eth_check.internet_checksum(mv[ip:ip + hdr_len])
+        _U16.pack_into(slab, first + ep.OFFSET_IP_CHECKSUM, checksum)
+        return bytes(slab[first:_HEADROOM + dgram.total])
+
+    def stream(self, frames):
+        """Yield (timestamp, frame) from iterable 'frames' of (timestamp,
+        frame) with fragments replaced by their reassembled datagrams.  A
+        reassembled frame takes the timestamp of its last fragment."""
+        for timestamp, pkt in frames:
+            pkt = self.feed(pkt, timestamp)
+            if pkt is not None:
+                yield (timestamp, pkt)
+        return
+
+if __name__ == "__main__":
+    import sys
+    import pcap
+    defrag = Reassembler()
+    nframes = 0
+    for timestamp, pkt in defrag.stream(pcap.read_file(sys.argv[1])):
+        nframes += 1
+    print("{} frames after reassembly: {} datagrams reassembled, {} timed out, {} evicted, {} invalid fragments, {} incomplete".format(
+        nframes, defrag.completed, defrag.timed_out, defrag.evicted, defrag.invalid, len(defrag)))
@@ -0,0 +1,257 @@
+#! /usr/bin/python3
+
+# Build ethernet frames (the inverse of eth_pkt's decoders)
+#
+# Every build_* function writes one complete frame, starting at the
+# destination MAC, into a preallocated bytearray 'buf' at 'offset' and
+# returns the offset just past it.  Headers are written in place with
+# struct.pack_into at the eth_pkt OFFSET_*/PAYLOAD_OFFSET_* positions, IP,
+# UDP, TCP and ICMP checksums are filled in, short frames are zero-padded to
+# eth_pkt.MIN_PKT_SIZE and the FCS is appended (unless fcs=False).
+# Addresses are bytes (6 for MACs, 4 or 16 for IPs).
+#
+# Usage:
+#   import eth_gen
+#   fb = eth_gen.FrameBuffer(1 << 20, preamble=True)
+#   for n in range(1000):
+#       fb.add(eth_gen.build_ipv4_udp, src_mac, dest_mac, src_ip, dest_ip, 5000, 50006, data, ident=n)
+#   with open('stimulus.bin', 'wb') as fd:
+#       fb.write_to(fd)
+
+import struct
+import zlib
+from array import array
+
+import eth_pkt as ep
+import eth_check
+
+class EncodeError(Exception):
+    pass
+
+BROADCAST_MAC = b'\xff'*6
+ZERO_MAC = bytes(6)
+FCS_SIZE = eth_check.FCS_SIZE
+
+_U16 = struct.Struct('!H')
+_FCS = struct.Struct('<I')
+_ZEROS = memoryview(bytes(ep.MIN_PKT_SIZE))
+_PREAMBLE_SFD = ep.PREAMBLE + ep.SFD
+
+# Where each header starts relative to the frame (the eth_pkt offsets are frame-relative)
+_IPV4_START = ep.OFFSET_IP_VERSION_IHL
+_IPV6_START = ep.OFFSET_IPV6_VERSION_TC_FLOWLABEL
+_IPV4_PAYLOAD = _IPV4_START + ep._IPV4_HEADER.size
+_IPV6_PAYLOAD = ep.OFFSET_IPV6_PAYLOAD
+
+def _room(buf, offset, size):
+    """Raise EncodeError unless 'size' bytes fit in 'buf' at 'offset'."""
+    # Padding and FCS may add up to this much
+    need = offset + max(size, ep.MIN_PKT_SIZE) + FCS_SIZE
+    if need > len(buf):
+        raise EncodeError("Frame needs {} bytes at offset {}; buffer holds {}".format(need - offset, offset, len(buf)))
+    return
+
+def _finish(buf, offset, end, fcs):
+    """Pad the frame buf[offset:end] to the minimum size and append the FCS.
+    Returns the offset just past the frame."""
+    if end - offset < ep.MIN_PKT_SIZE:
+        pad = offset + ep.MIN_PKT_SIZE - end
+        buf[end:end+pad] = _ZEROS[:pad]
+        end += pad
+    if fcs:
+        with memoryview(buf) as mv:
+            _FCS.pack_into(buf, end, zlib.crc32(mv[offset:end]))
+        end += FCS_SIZE
+    return end
+
+def _checksum(buf, start, end, pseudo=0):
+    with memoryview(buf) as mv:
+        return eth_check.internet_checksum(mv[start:end], pseudo)
+
+def write_eth(buf, offset, dest_mac, src_mac, ethertype):
+    """Write an Ethernet header at 'offset'.  Returns the payload offset."""
+    ep._ETH_HEADER.pack_into(buf, offset + ep.OFFSET_DEST_MAC, dest_mac, src_mac, ethertype)
+    return offset + ep._ETH_HEADER.size
+
+def write_ipv4(buf, offset, protocol, payload_length, src_ip, dest_ip, ttl=64, ident=0, flags_frag=ep.IP_FLAG_DF):
+    """Write a 20-byte IPv4 header (with checksum) for the frame at 'offset'."""
+    start = offset + _IPV4_START
+    ep._IPV4_HEADER.pack_into(buf, start, 0x45, 0, ep._IPV4_HEADER.size + payload_length,
+                              ident, flags_frag, ttl, protocol, 0, src_ip, dest_ip)
+    _U16.pack_into(buf, offset + ep.OFFSET_IP_CHECKSUM, _checksum(buf, start, start + ep._IPV4_HEADER.size))
+    return
+
+def write_ipv6(buf, offset, next_header, payload_length, src_ip, dest_ip, hop_limit=64, flow_label=0):
+    """Write a 40-byte IPv6 header for the frame at 'offset'."""
+    ep._IPV6_HEADER.pack_into(buf, offset + _IPV6_START, (6 << 28) | (flow_label & 0xfffff),
+                              payload_length, next_header, hop_limit, src_ip, dest_ip)
+    return
+
+def _write_udp(buf, l4, src_port, dest_port, data, pseudo):
+    length = ep._UDP_HEADER.size + len(data)
+    buf[l4+ep.PAYLOAD_OFFSET_UDP_DATA:l4+length] = data
+    ep._UDP_HEADER.pack_into(buf, l4, src_port, dest_port, length, 0)
+    # A computed checksum of zero is sent as all ones (zero means "none")
+    checksum = _checksum(buf, l4, l4 + length, pseudo) or 0xffff
+    _U16.pack_into(buf, l4 + ep.PAYLOAD_OFFSET_UDP_CHECKSUM, checksum)
+    return l4 + length
+
+def _write_tcp(buf, l4, src_port, dest_port, seq, ack, flags, window, data, pseudo):
+    length = ep._TCP_HEADER.size + len(data)
+    buf[l4+ep.PAYLOAD_OFFSET_TCP_OPTIONS:l4+length] = data
+    # No options: data offset is 5 words
+    ep._TCP_HEADER.pack_into(buf, l4, src_port, dest_port, seq & 0xffffffff, ack & 0xffffffff,
+                             (5 << 12) | flags, window, 0, 0)
+    _U16.pack_into(buf, l4 + ep.PAYLOAD_OFFSET_TCP_CHECKSUM, _checksum(buf, l4, l4 + length, pseudo))
+    return l4 + length
+
+def _write_icmp(buf, l4, icmp_type, code, rest, pseudo):
+    end = l4 + ep.PAYLOAD_OFFSET_ICMP_REST_OF_HEADER + len(rest)
+    buf[l4+ep.PAYLOAD_OFFSET_ICMP_REST_OF_HEADER:end] = rest
+    ep._ICMP_HEADER.pack_into(buf, l4, icmp_type, code, 0)
+    _U16.pack_into(buf, l4 + ep.PAYLOAD_OFFSET_ICMP_CHECKSUM, _checksum(buf, l4, end, pseudo))
+    return end
+
+def build_arp(buf, offset, src_mac, src_ip, target_ip, oper=1, dest_mac=BROADCAST_MAC, target_mac=ZERO_MAC, fcs=True):
+    """ARP request (oper=1) or reply (oper=2) from src_mac/src_ip for target_ip."""
+    _room(buf, offset, ep.OFFSET_ARP_TPA + 4)
+    write_eth(buf, offset, dest_mac, src_mac, ep.ETHERTYPE_ARP)
+    ep._ARP_HEADER.pack_into(buf, offset + ep.OFFSET_ARP_HTYPE, 0x0001, ep.ETHERTYPE_IPV4, 6, 4, oper,
+                             src_mac, src_ip, target_mac, target_ip)
+    return _finish(buf, offset, offset + ep.OFFSET_ARP_TPA + 4, fcs)
+
+def build_ipv4_udp(buf, offset, src_mac, dest_mac, src_ip, dest_ip, src_port, dest_port, data=b'',
+                   ttl=64, ident=0, fcs=True):
+    """IPv4/UDP frame carrying 'data' (bytes-like)."""
+    udp_length = ep._UDP_HEADER.size + len(data)
+    _room(buf, offset, _IPV4_PAYLOAD + udp_length)
+    write_eth(buf, offset, dest_mac, src_mac, ep.ETHERTYPE_IPV4)
+    write_ipv4(buf, offset, ep.IP_PROTOCOL_UDP, udp_length, src_ip, dest_ip, ttl, ident)
+    pseudo = eth_check.ipv4_pseudo_sum(src_ip, dest_ip, ep.IP_PROTOCOL_UDP, udp_length)
+    end = _write_udp(buf, offset + _IPV4_PAYLOAD, src_port, dest_port, data, pseudo)
+    return _finish(buf, offset, end, fcs)
+
+def build_ipv4_tcp(buf, offset, src_mac, dest_mac, src_ip, dest_ip, src_port, dest_port, seq, ack=0,
+                   flags=ep.TCP_FLAG_ACK, data=b'', window=0xffff, ttl=64, ident=0, fcs=True):
+    """IPv4/TCP segment carrying 'data' (bytes-like).  'flags' is a sum of
+    eth_pkt.TCP_FLAG_*."""
+    tcp_length = ep._TCP_HEADER.size + len(data)
+    _room(buf, offset, _IPV4_PAYLOAD + tcp_length)
+    write_eth(buf, offset, dest_mac, src_mac, ep.ETHERTYPE_IPV4)
+    write_ipv4(buf, offset, ep.IP_PROTOCOL_TCP, tcp_length, src_ip, dest_ip, ttl, ident)
+    pseudo = eth_check.ipv4_pseudo_sum(src_ip, dest_ip, ep.IP_PROTOCOL_TCP, tcp_length)
+    end = _write_tcp(buf, offset + _IPV4_PAYLOAD, src_port, dest_port, seq, ack, flags, window, data, pseudo)
+    return _finish(buf, offset, end, fcs)
+
+def build_ipv4_icmp(buf, offset, src_mac, dest_mac, src_ip, dest_ip, icmp_type=8, code=0, rest=b'',
+                    ttl=64, ident=0, fcs=True):
+    """IPv4/ICMP frame.  'rest' is everything after the checksum (for an echo
+    request: identifier, sequence number and data)."""
+    icmp_length = ep.PAYLOAD_OFFSET_ICMP_REST_OF_HEADER + len(rest)
+    _room(buf, offset, _IPV4_PAYLOAD + icmp_length)
+    write_eth(buf, offset, dest_mac, src_mac, ep.ETHERTYPE_IPV4)
+    write_ipv4(buf, offset, ep.IP_PROTOCOL_ICMP, icmp_length, src_ip, dest_ip, ttl, ident)
+    end = _write_icmp(buf, offset + _IPV4_PAYLOAD, icmp_type, code, rest, 0)
+    return _finish(buf, offset, end, fcs)
+
+def build_ipv6_udp(buf, offset, src_mac, dest_mac, src_ip, dest_ip, src_port, dest_port, data=b'',
+                   hop_limit=64, fcs=True):
+    """IPv6/UDP frame carrying 'data' (bytes-like)."""
+    udp_length = ep._UDP_HEADER.size + len(data)
+    _room(buf, offset, _IPV6_PAYLOAD + udp_length)
+    write_eth(buf, offset, dest_mac, src_mac, ep.ETHERTYPE_IPV6)
+    write_ipv6(buf, offset, ep.IP_PROTOCOL_UDP, udp_length, src_ip, dest_ip, hop_limit)
+    pseudo = eth_check.ipv6_pseudo_sum(src_ip, dest_ip, ep.IP_PROTOCOL_UDP, udp_length)
+    end = _write_udp(buf, offset + _IPV6_PAYLOAD, src_port, dest_port, data, pseudo)
+    return _finish(buf, offset, end, fcs)
+
+def build_ipv6_tcp(buf, offset, src_mac, dest_mac, src_ip, dest_ip, src_port, dest_port, seq, ack=0,
+                   flags=ep.TCP_FLAG_ACK, data=b'', window=0xffff, hop_limit=64, fcs=True):
+    """IPv6/TCP segment carrying 'data' (bytes-like)."""
+    tcp_length = ep._TCP_HEADER.size + len(data)
+    _room(buf, offset, _IPV6_PAYLOAD + tcp_length)
+    write_eth(buf, offset, dest_mac, src_mac, ep.ETHERTYPE_IPV6)
+    write_ipv6(buf, offset, ep.IP_PROTOCOL_TCP, tcp_length, src_ip, dest_ip, hop_limit)
+    pseudo = eth_check.ipv6_pseudo_sum(src_ip, dest_ip, ep.IP_PROTOCOL_TCP, tcp_length)
+    end = _write_tcp(buf, offset + _IPV6_PAYLOAD, src_port, dest_port, seq, ack, flags, window, data, pseudo)
+    return _finish(buf, offset, end, fcs)
+
+def build_ipv6_icmp(buf, offset, src_mac, dest_mac, src_ip, dest_ip, icmp_type=128, code=0, rest=b'',
+                    hop_limit=64, fcs=True):
+    """IPv6/ICMPv6 frame (default: echo request).  'rest' is everything after
+    the checksum."""
+    icmp_length = ep.PAYLOAD_OFFSET_ICMP_REST_OF_HEADER + len(rest)
+    _room(buf, offset, _IPV6_PAYLOAD + icmp_length)
+    write_eth(buf, offset, dest_mac, src_mac, ep.ETHERTYPE_IPV6)
+    write_ipv6(buf, offset, ep.IP_PROTOCOL_IPV6_ICMP, icmp_length, src_ip, dest_ip, hop_limit)
+    pseudo = eth_check.ipv6_pseudo_sum(src_ip, dest_ip, ep.IP_PROTOCOL_IPV6_ICMP, icmp_length)
+    end = _write_icmp(buf, offset + _IPV6_PAYLOAD, icmp_type, code, rest, pseudo)
+    return _finish(buf, offset, end, fcs)
+
+class FrameBuffer():
+    """Preallocated buffer of 'size' bytes that frames are built into back
+    to back, optionally each behind a preamble and SFD (as on GMII).
+    'offsets' and 'lengths' locate every frame (excluding its preamble), so
+    the buffer can go straight to eth_pkt.decode_batch() or
+    eth_check.check_fcs_batch().  Call clear() to reuse the buffer."""
+    def __init__(self, size, preamble=False):
+        self.buf = bytearray(size)
+        self.preamble = preamble
+        self.pos = 0
+        self.offsets = array('Q')
+        self.lengths = array('I')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def add(self, builder, *args, **kwargs):
+        """Build one frame with builder(buf, offset, *args, **kwargs) (one of
+        the build_* functions).  Returns the frame's offset."""
+        offset = self.pos
+        if self.preamble:
+            _room(self.buf, offset, len(_PREAMBLE_SFD))
+            self.buf[offset:offset+len(_PREAMBLE_SFD)] = _PREAMBLE_SFD
+            offset += len(_PREAMBLE_SFD)
+        end = builder(self.buf, offset, *args, **kwargs)
+        self.offsets.append(offset)
+        self.lengths.append(end - offset)
+        self.pos = end
+        return offset
+
+    def frames(self):
+        """Yield a memoryview of every frame."""
+        mv = memoryview(self.buf)
+        for offset, length in zip(self.offsets, self.lengths):
+            yield mv[offset:offset+length]
+
+    def getvalue(self):
+        """Everything written so far (as a memoryview)."""
+        return memoryview(self.buf)[:self.pos]
+
+    def write_to(self, fd):
+        """Write everything built so far to binary file 'fd'."""
+        with memoryview(self.buf) as mv:
+            fd.write(mv[:self.pos])
+        return
+
+    def clear(self):
+        self.pos = 0
+        self.offsets = array('Q')
+        self.lengths = array('I')
+        return
+
+if __name__ == "__main__":
+    import sys
+    import time
+    # Throughput check: build N IPv4/UDP frames with 64 bytes of data
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    data = bytes(range(64))
+    src_mac = bytes.fromhex('26acddd71ebe')
+    dest_mac = bytes.fromhex('02000000cafe')
+    fb = FrameBuffer(n*(128 + 8), preamble=True)
+    t0 = time.perf_counter()
+    for k in range(n):
+        fb.add(build_ipv4_udp, src_mac, dest_mac, b'\xc0\xa8\x07\x01', b'\xc0\xa8\x07\x04', 5000, 50006, data, ident=k & 0xffff)
+    elapsed = time.perf_counter() - t0
+    nbad = eth_check.check_fcs_batch(fb.buf, fb.offsets, fb.lengths).count(False)
+    print("{} frames in {:.3f} s ({:.0f} frames/sec), {} bad FCS".format(n, elapsed, n/elapsed, nbad))
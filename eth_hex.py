@@ -0,0 +1,166 @@
+#! /usr/bin/python3
+
+# Streaming reader for text hex dumps of ethernet frames.
+# Each line is converted with a single bytes.fromhex() call.
+#
+# Supported formats ('fmt'):
+#   'k12'     Wireshark K12 text ("|0   |ff|ff|...|" rows under a timestamp line)
+#   'offset'  Offset-prefixed dumps: Wireshark/text2pcap hexdump, 'od -A x -t x1z -v',
+#             'hexdump -C'.  An offset of 0 starts a new frame.
+#   'xxd'     xxd output ("00000000: ffff ffff ...  ascii").  An offset of 0 starts a new frame.
+#   'line'    One frame per line, e.g. "ffffffffffff0011..." or "ff ff ff ..."
+#   'auto'    Guess from the first non-blank line
+# Blank lines also end a frame.
+#
+# Usage:
+#   import eth_hex
+#   for timestamp, frame in eth_hex.read_file("sim_frames.txt"):
+#       ...
+
+import itertools
+import re
+
+class HexDumpError(Exception):
+    pass
+
+_k12_time_re = re.compile(r"^(\d+):(\d+):(\d+),(\d+),(\d+)")
+_xxd_re = re.compile(r"^([0-9a-fA-F]+):\s")
+_offset_re = re.compile(r"^([0-9a-fA-F]{4,})\s+[0-9a-fA-F]{2}(\s|$)")
+# Text between the hex bytes and the ASCII column
+_ascii_sep_re = re.compile(r"\s{3,}|\s+\||\s+>")
+
+def guess_format(line):
+    """Guess the dump format from one (non-blank) line."""
+    line = line.strip()
+    if line.startswith('|') or line.startswith('+-'):
+        return 'k12'
+    if _xxd_re.match(line):
+        return 'xxd'
+    if _offset_re.match(line):
+        return 'offset'
+    return 'line'
+
+def _fromhex(text, lineno):
+    try:
+        return bytes.fromhex(text)
+    except ValueError:
+        pass
+    # Tolerate single-digit or 0x-prefixed tokens (slow path)
+    try:
+        return bytes([int(x, 16) for x in text.split()])
+    except ValueError:
+        raise HexDumpError("Line {}: can't parse hex: {}".format(lineno, text.strip()))
+
+def _read_lines(lines):
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if len(line) == 0 or line.startswith('#'):
+            yield (lineno, None)
+        else:
+            yield (lineno, line)
+
+def _read_line_format(lines):
+    for lineno, line in _read_lines(lines):
+        if line is not None:
+            yield (None, _fromhex(line, lineno))
+    return
+
+def _read_offset_format(lines, xxd):
+    frame = []
+    for lineno, line in _read_lines(lines):
+        if line is None:
+            if len(frame) > 0:
+                yield (None, b''.join(frame))
+                frame = []
+            continue
+        if line == '*':
+            raise HexDumpError("Line {}: repeated lines were suppressed; regenerate the dump with 'od -v' or 'hexdump -v'".format(lineno))
+        if xxd:
+            offset, _, rest = line.partition(':')
+        else:
+            parts = line.split(None, 1)
+            offset = parts[0]
+            rest = parts[1] if len(parts) > 1 else ''
+        try:
+            offset = int(offset, 16)
+        except ValueError:
+            raise HexDumpError("Line {}: bad offset: {}".format(lineno, line))
+        # Drop the ASCII column
+        if xxd:
+            rest = rest.strip().split('  ', 1)[0]
+        else:
+            rest = _ascii_sep_re.split(rest.strip(), 1)[0]
+        if offset == 0 and len(frame) > 0:
+            yield (None, b''.join(frame))
+            frame = []
+        if len(rest) > 0:
+            frame.append(_fromhex(rest, lineno))
+    if len(frame) > 0:
+        yield (None, b''.join(frame))
+    return
+
+def _read_k12_format(lines):
+    timestamp = None
+    frame = []
+    for lineno, line in _read_lines(lines):
+        if line is None or line.startswith('+-'):
+            if len(frame) > 0:
+                yield (timestamp, b''.join(frame))
+                frame = []
+            continue
+        if line.startswith('|'):
+            # |offset |ff|ff|...|
+            parts = line.split('|')
+            frame.append(_fromhex(''.join(parts[2:]), lineno))
+            continue
+        _match = _k12_time_re.match(line)
+        if _match:
+            if len(frame) > 0:
+                yield (timestamp, b''.join(frame))
+                frame = []
+            h, m, sec, ms, us = [int(x) for x in _match.groups()]
+            timestamp = 3600*h + 60*m + sec + ms/1e3 + us/1e6
+    if len(frame) > 0:
+        yield (timestamp, b''.join(frame))
+    return
+
+def read(lines, fmt='auto'):
+    """Yield (timestamp, frame) tuples from an iterable of text lines (e.g. an
+    open text file).  'timestamp' is None unless the dump records one."""
+    lines = iter(lines)
+    if fmt == 'auto':
+        # Peek at the first non-blank line without losing it
+        first = []
+        for line in lines:
+            first.append(line)
+            if len(line.strip()) > 0 and not line.strip().startswith('#'):
+                fmt = guess_format(line)
+                break
+        if fmt == 'auto':
+            return
+        lines = itertools.chain(first, lines)
+    if fmt == 'line':
+        yield from _read_line_format(lines)
+    elif fmt == 'offset':
+        yield from _read_offset_format(lines, xxd=False)
+    elif fmt == 'xxd':
+        yield from _read_offset_format(lines, xxd=True)
+    elif fmt == 'k12':
+        yield from _read_k12_format(lines)
+    else:
+        raise ValueError("Unknown hex dump format '{}'".format(fmt))
+    return
+
+def read_file(filename, fmt='auto'):
+    """Yield (timestamp, frame) tuples from hex dump file 'filename'."""
+    with open(filename, 'r') as fd:
+        yield from read(fd, fmt)
+
+if __name__ == "__main__":
+    import sys
+    nframes = 0
+    nbytes = 0
+    for ts, frame in read_file(sys.argv[1]):
+        nframes += 1
+        nbytes += len(frame)
+    print("{} frames, {} bytes".format(nframes, nbytes))
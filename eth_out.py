@@ -0,0 +1,275 @@
+#! /usr/bin/python3
+
+# Machine-readable output sinks for records from eth_pkt.decode_record()
+#
+# Every sink takes batches of (timestamp, record) and writes each batch with a
+# single buffered write per file.
+#   'jsonl'     One JSON object per frame (every decoded layer)
+#   'csv'       Fixed columns (see COLUMNS), with addresses written as text
+#   'columnar'  A directory holding one flat binary file per numeric column
+#               plus 'columns.json' describing them (load with numpy.fromfile
+#               or numpy.memmap)
+#
+# Usage:
+#   import eth_pkt, eth_out
+#   with eth_out.open_sink('jsonl', 'frames.jsonl') as sink:
+#       eth_out.write_all(sink, eth_pkt.decode_file('capture.pcap'))
+
+import csv
+import io
+import json
+import os
+import struct
+import sys
+from array import array
+
+import eth_render
+
+# (name, array typecode) for the fixed column set; empty fields are 0.
+# '16s' (16 raw bytes; array has no typecode for it) holds an IPv6 address,
+# or an IPv4 one mapped into IPv6 (::ffff:a.b.c.d).
+COLUMNS = (
+    ('timestamp',   'd'),
+    ('length',      'I'),
+    ('dest_mac',    'Q'),
+    ('src_mac',     'Q'),
+    ('ethertype',   'H'),
+    ('protocol',    'B'),   # IPv4 protocol / IPv6 upper-layer next header
+    ('ttl',         'B'),   # IPv4 TTL / IPv6 hop limit
+    ('src_ip',      '16s'), # IPv4 or IPv6
+    ('dest_ip',     '16s'), # IPv4 or IPv6
+    ('src_port',    'H'),   # UDP or TCP
+    ('dest_port',   'H'),   # UDP or TCP
+    ('udp_length',  'H'),
+    ('errors',      'H'),   # Number of errors in the record
+)
+COLUMN_NAMES = tuple([name for name, typecode in COLUMNS])
+
+_NO_IP = bytes(16)
+_IPV4_MAPPED = bytes(10) + b'\xff\xff'
+
+def flatten(timestamp, rec):
+    """Return a tuple of the COLUMNS values for record 'rec'."""
+    eth = rec.get('eth')
+    ipv4 = rec.get('ipv4')
+    ipv6 = rec.get('ipv6')
+    udp = rec.get('udp')
+    protocol = ttl = 0
+    src_ip = dest_ip = _NO_IP
+    src_port = dest_port = udp_length = 0
+    if ipv4 is not None:
+        protocol = ipv4['protocol']
+        ttl = ipv4['ttl']
+        src_ip = _IPV4_MAPPED + bytes(ipv4['src_ip'])
+        dest_ip = _IPV4_MAPPED + bytes(ipv4['dest_ip'])
+    elif ipv6 is not None:
+        protocol = ipv6['next_headers'][-1][0]
+        ttl = ipv6['hop_limit']
+        src_ip = bytes(ipv6['src_ip'])
+        dest_ip = bytes(ipv6['dest_ip'])
+    if udp is not None:
+        src_port = udp['src_port']
+        dest_port = udp['dest_port']
+        udp_length = udp['length']
+    else:
+        tcp = rec.get('tcp')
+        if tcp is not None:
+            src_port = tcp['src_port']
+            dest_port = tcp['dest_port']
+    nerrors = len(rec['errors'])
+    for name in rec['layers']:
+        nerrors += len(rec[name].get('errors', ()))
+    if eth is None:
+        return (timestamp or 0.0, rec['length'], 0, 0, 0, 0, 0, _NO_IP, _NO_IP, 0, 0, 0, nerrors)
+    return (timestamp or 0.0, rec['length'],
+            int.from_bytes(eth['dest_mac'], 'big'), int.from_bytes(eth['src_mac'], 'big'), eth['ethertype'],
+            protocol, ttl, src_ip, dest_ip, src_port, dest_port, udp_length, nerrors)
+
+# Layer fields holding addresses, by how they should be written
+_mac_keys = ('dest_mac', 'src_mac', 'sha', 'tha')
+_ip_keys = ('src_ip', 'dest_ip', 'spa', 'tpa')
+
+def ip_text(addr):
+    """Text form of a src_ip/dest_ip column value ('' if there's no address)."""
+    # numpy 'S16' items drop trailing zero bytes
+    addr = bytes(addr).ljust(16, b'\0')
+    if addr == _NO_IP:
+        return ''
+    if addr.startswith(_IPV4_MAPPED):
+        return eth_render.ipv4(addr[12:])
+    return eth_render.ipv6(addr)
+
+_MAC_COLUMNS = (COLUMN_NAMES.index('dest_mac'), COLUMN_NAMES.index('src_mac'))
+_IP_COLUMNS = (COLUMN_NAMES.index('src_ip'), COLUMN_NAMES.index('dest_ip'))
+
+def _csv_row(row):
+    row = list(row)
+    for n in _MAC_COLUMNS:
+        row[n] = eth_render.mac_int(row[n])
+    for n in _IP_COLUMNS:
+        row[n] = ip_text(row[n])
+    return row
+
+def _jsonable(timestamp, rec):
+    out = {'timestamp': timestamp, 'length': rec['length'], 'errors': rec['errors'], 'layers': rec['layers']}
+    for name in rec['layers']:
+        layer = {}
+        for key, val in rec[name].items():
+            if isinstance(val, (bytes, bytearray, memoryview)):
+                if key in _mac_keys:
+                    val = eth_render.mac(val)
+                elif key in _ip_keys:
+                    val = eth_render.ip(val)
+                else:
+                    val = val.hex()
+            layer[key] = val
+        out[name] = layer
+    return out
+
+class JsonlSink():
+    def __init__(self, fd):
+        self.fd = fd
+
+    def write_batch(self, items):
+        """Write every (timestamp, record) in 'items'."""
+        dumps = json.dumps
+        lines = [dumps(_jsonable(timestamp, rec)) for timestamp, rec in items]
+        if len(lines) > 0:
+            self.fd.write('\n'.join(lines) + '\n')
+        return
+
+    def flush(self):
+        self.fd.flush()
+
+    def close(self):
+        self.fd.flush()
+
+class CsvSink():
+    def __init__(self, fd, header=True):
+        self.fd = fd
+        if header:
+            self.fd.write(','.join(COLUMN_NAMES) + '\n')
+
+    def write_batch(self, items):
+        """Write every (timestamp, record) in 'items'."""
+        sio = io.StringIO()
+        csv.writer(sio, lineterminator='\n').writerows([_csv_row(flatten(timestamp, rec)) for timestamp, rec in items])
+        self.fd.write(sio.getvalue())
+        return
+
+    def flush(self):
+        self.fd.flush()
+
+    def close(self):
+        self.fd.flush()
+
+class ColumnarSink():
+    """Append COLUMNS to '<dirname>/<column>.bin' as raw native-endian arrays.
+    'columns.json' (written on close) gives each column's typecode, item
+    size and the number of rows."""
+    def __init__(self, dirname):
+        self.dirname = dirname
+        os.makedirs(dirname, exist_ok=True)
+        self.rows = 0
+        self._fds = [open(os.path.join(dirname, name + '.bin'), 'wb') for name in COLUMN_NAMES]
+
+    def write_batch(self, items):
+        """Write every (timestamp, record) in 'items'."""
+        rows = [flatten(timestamp, rec) for timestamp, rec in items]
+        if len(rows) == 0:
+            return
+        for (name, typecode), values, fd in zip(COLUMNS, zip(*rows), self._fds):
+            if typecode.endswith('s'):
+                fd.write(b''.join(values))
+            else:
+                array(typecode, values).tofile(fd)
+        self.rows += len(rows)
+        return
+
+    def flush(self):
+        # 'columns.json' is only written by close()
+        for fd in self._fds:
+            fd.flush()
+
+    def close(self):
+        for fd in self._fds:
+            fd.close()
+        header = {
+            'rows': self.rows,
+            'byteorder': sys.byteorder,
+            'columns': [{'name': name, 'typecode': typecode, 'itemsize': struct.calcsize('=' + typecode)}
+                        for name, typecode in COLUMNS],
+        }
+        with open(os.path.join(self.dirname, 'columns.json'), 'w') as fd:
+            json.dump(header, fd, indent=2)
+        return
+
+class _Sink():
+    """Context manager that closes the sink and the file it writes to."""
+    def __init__(self, sink, fd=None):
+        self.sink = sink
+        self.fd = fd
+
+    def __enter__(self):
+        return self.sink
+
+    def __exit__(self, *exc):
+        self.sink.close()
+        if self.fd is not None and self.fd is not sys.stdout:
+            self.fd.close()
+        return False
+
+SINK_FORMATS = ('jsonl', 'csv', 'columnar')
+
+def open_sink(fmt, path=None):
+    """Open an output sink of format 'fmt' (one of SINK_FORMATS) writing to
+    'path' (stdout if None; a directory for 'columnar').  Use as a context
+    manager."""
+    if fmt == 'columnar':
+        if path is None:
+            raise ValueError("The columnar format needs an output directory")
+        return _Sink(ColumnarSink(path))
+    if path is None:
+        fd = sys.stdout
+    else:
+        fd = open(path, 'w', newline='', buffering=1 << 20)
+    if fmt == 'jsonl':
+        return _Sink(JsonlSink(fd), fd)
+    if fmt == 'csv':
+        return _Sink(CsvSink(fd), fd)
+    if fd is not sys.stdout:
+        fd.close()
+    raise ValueError("Unknown output format '{}'. Must be one of {}".format(fmt, SINK_FORMATS))
+
+def write_all(sink, items, batch_size=4096):
+    """Write (timestamp, record) tuples from iterable 'items' to 'sink' in
+    batches of 'batch_size'."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            sink.write_batch(batch)
+            batch = []
+    if len(batch) > 0:
+        sink.write_batch(batch)
+    return
+
+def load_columns(dirname):
+    """Load a 'columnar' dump as a dict of numpy arrays (memory-mapped).
+    Address columns are 'S16' arrays (see ip_text)."""
+    import numpy as np
+    with open(os.path.join(dirname, 'columns.json'), 'r') as fd:
+        header = json.load(fd)
+    endian = '<' if header['byteorder'] == 'little' else '>'
+    cols = {}
+    for col in header['columns']:
+        if col['typecode'].endswith('s'):
+            dtype = np.dtype('S' + col['typecode'][:-1])
+        else:
+            dtype = np.dtype(endian + col['typecode'])
+        if header['rows'] == 0:
+            cols[col['name']] = np.zeros(0, dtype=dtype)
+        else:
+            cols[col['name']] = np.memmap(os.path.join(dirname, col['name'] + '.bin'),
+                                          dtype=dtype, mode='r', shape=(header['rows'],))
+    return cols
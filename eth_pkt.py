@@ -1,5 +1,11 @@
 # Decode an ethernet packet by bytes
 
+import os
+import struct
+import sys
+
+import eth_render
+
 MIN_PKT_SIZE = 60
 
 # == Eth ==
@@ -46,11 +52,23 @@ PAYLOAD_OFFSET_ICMP_CHECKSUM = 2
 PAYLOAD_OFFSET_ICMP_REST_OF_HEADER = 4
 
 # == UDP ==
-PAYLOAD_OFFSET_UDP_SRC_PORT = 14
-PAYLOAD_OFFSET_UDP_DEST_PORT = 16
-PAYLOAD_OFFSET_UDP_LENGTH   = 18
-PAYLOAD_OFFSET_UDP_CHECKSUM = 20
-PAYLOAD_OFFSET_UDP_DATA     = 22
+PAYLOAD_OFFSET_UDP_SRC_PORT = 0
+PAYLOAD_OFFSET_UDP_DEST_PORT = 2
+PAYLOAD_OFFSET_UDP_LENGTH   = 4
+PAYLOAD_OFFSET_UDP_CHECKSUM = 6
+PAYLOAD_OFFSET_UDP_DATA     = 8
+
+# == TCP ==
+PAYLOAD_OFFSET_TCP_SRC_PORT = 0
+PAYLOAD_OFFSET_TCP_DEST_PORT = 2
+PAYLOAD_OFFSET_TCP_SEQ      = 4
+PAYLOAD_OFFSET_TCP_ACK      = 8
+PAYLOAD_OFFSET_TCP_DATA_OFFSET = 12
+PAYLOAD_OFFSET_TCP_FLAGS    = 13
+PAYLOAD_OFFSET_TCP_WINDOW   = 14
+PAYLOAD_OFFSET_TCP_CHECKSUM = 16
+PAYLOAD_OFFSET_TCP_URGENT   = 18
+PAYLOAD_OFFSET_TCP_OPTIONS  = 20
 
 # ===== Ethertypes =====
 ETHERTYPE_IPV4      = 0x0800
@@ -97,258 +115,380 @@ EXTENSION_HEADER_RESERVED0          = 253
 EXTENSION_HEADER_RESERVED1          = 254
 EXTENSION_HEADER_NOTHING            = 59
 
+# ===== IPv4 flags/fragment offset field =====
+IP_FLAG_DF          = 0x4000    # Don't fragment
+IP_FLAG_MF          = 0x2000    # More fragments
+IP_FRAG_OFFSET_MASK = 0x1fff    # In units of 8 bytes
+
+# ===== TCP flags =====
+TCP_FLAG_FIN = 0x001
+TCP_FLAG_SYN = 0x002
+TCP_FLAG_RST = 0x004
+TCP_FLAG_PSH = 0x008
+TCP_FLAG_ACK = 0x010
+TCP_FLAG_URG = 0x020
+TCP_FLAG_ECE = 0x040
+TCP_FLAG_CWR = 0x080
+TCP_FLAG_NS  = 0x100
+# Lowest bit first
+TCP_FLAG_NAMES = ('FIN', 'SYN', 'RST', 'PSH', 'ACK', 'URG', 'ECE', 'CWR', 'NS')
+
 def print_mac(pkt, offset):
-    print(':'.join(["{:x}".format(x) for x in pkt[offset:offset+6]]))
+    print(eth_render.mac(as_buffer(pkt)[offset:offset+6]))
     return
 
 def print_ip(pkt, offset):
-    print('.'.join([str(x) for x in pkt[offset:offset+4]]))
+    print(eth_render.ipv4(as_buffer(pkt)[offset:offset+4]))
     return
 
+# ===== Name tables =====
+ETHERTYPE_NAMES = {
+    ETHERTYPE_IPV4: "IPv4",
+    ETHERTYPE_ARP: "ARP",
+    ETHERTYPE_WOL: "Wake-on-LAN",
+    ETHERTYPE_VLAN: "VLAN-tagged frame (IEEE 802.1Q)",
+    ETHERTYPE_IPV6: "IPv6",
+    ETHERTYPE_STAG: "Service VLAN tag identifier (S-Tag) on Q-in-Q Tunnel",
+    ETHERTYPE_PTP: "Precision Time Protocol (PTP) over IEEE 802.3 Ethernet",
+}
+
+IP_PROTOCOL_NAMES = {
+    IP_PROTOCOL_IP: "IP  # internet protocol, pseudo protocol number",
+    IP_PROTOCOL_ICMP: "ICMP  # internet control message protocol",
+    IP_PROTOCOL_IPENCAP: "IP-ENCAP # IP encapsulated in IP (officially ``IP'')",
+    IP_PROTOCOL_TCP: "TCP  # transmission control protocol",
+    IP_PROTOCOL_EGP: "EGP  # exterior gateway protocol",
+    IP_PROTOCOL_UDP: "UDP  # user datagram protocol",
+    IP_PROTOCOL_HMP: "HMP  # host monitoring protocol",
+    IP_PROTOCOL_RDP: "RDP  # \"reliable datagram\" protocol",
+    IP_PROTOCOL_DDP: "DDP  # Datagram Delivery Protocol",
+    IP_PROTOCOL_IPV6: "IPv6  # Internet Protocol, version 6",
+    IP_PROTOCOL_IPV6_ROUTE: "IPv6-Route # Routing Header for IPv6",
+    IP_PROTOCOL_IPV6_FRAG: "IPv6-Frag # Fragment Header for IPv6",
+    IP_PROTOCOL_IDRP: "IDRP  # Inter-Domain Routing Protocol",
+    IP_PROTOCOL_IPV6_ICMP: "IPv6-ICMP # ICMP for IPv6",
+    IP_PROTOCOL_IPV6_NONXT: "IPv6-NoNxt # No Next Header for IPv6",
+    IP_PROTOCOL_IPV6_OPTS: "IPv6-Opts # Destination Options for IPv6",
+    IP_PROTOCOL_PIM : "PIM  # Protocol Independent Multicast",
+    IP_PROTOCOL_L2TP: "L2TP  # Layer Two Tunneling Protocol [RFC2661]",
+    IP_PROTOCOL_SCTP: "SCTP  # Stream Control Transmission Protocol",
+    IP_PROTOCOL_UDPLITE: "UDPLite  # UDP-Lite [RFC3828]",
+}
+
+# Every IPv6 next-header value in this table is an extension header
+IPV6_EXT_HEADER_NAMES = {
+    EXTENSION_HEADER_HOP_BY_HOP_OPTIONS: "IPv6 Ext: Hop-by-Hop Options",
+    EXTENSION_HEADER_ROUTING: "IPv6 Ext: Routing",
+    EXTENSION_HEADER_FRAGMENT: "IPv6 Ext: Fragment",
+    EXTENSION_HEADER_ESP: "IPv6 Ext: Encapsulating Security Payload",
+    EXTENSION_HEADER_AUTHENTICATION: "IPv6 Ext: Authentication Header",
+    EXTENSION_HEADER_DESTINATION_OPTIONS: "IPv6 Ext: Destination Options",
+    EXTENSION_HEADER_MOBILITY: "IPv6 Ext: Mobility",
+    EXTENSION_HEADER_HOST_ID_PROTOCOL: "IPv6 Ext: Host Identity Protocol",
+    EXTENSION_HEADER_SHIM6_PROTOCOL: "IPv6 Ext: Shim6 Protocol",
+    EXTENSION_HEADER_RESERVED0: "IPv6 Ext: Reserved for future use: {}".format(EXTENSION_HEADER_RESERVED0),
+    EXTENSION_HEADER_RESERVED1: "IPv6 Ext: Reserved for future use: {}".format(EXTENSION_HEADER_RESERVED1),
+    EXTENSION_HEADER_NOTHING: "IPv6 Ext: {}: Ignore anything following this header.".format(EXTENSION_HEADER_NOTHING),
+}
+
+def _ethertype_name(ethtype):
+    name = ETHERTYPE_NAMES.get(ethtype)
+    if name is None:
+        return "Unknown 0x{:x}".format(ethtype)
+    return name
+
+def _ip_protocol_name(protocol):
+    name = IP_PROTOCOL_NAMES.get(protocol)
+    if name is None:
+        return "Unknown 0x{:x}".format(protocol)
+    return name
+
 def ethertype(pkt, offset):
     ethtype = (pkt[offset] << 8) + pkt[offset+1]
-    types = {
-        ETHERTYPE_IPV4: "IPv4",
-        ETHERTYPE_ARP: "ARP",
-        ETHERTYPE_WOL: "Wake-on-LAN",
-        ETHERTYPE_VLAN: "VLAN-tagged frame (IEEE 802.1Q)",
-        ETHERTYPE_IPV6: "IPv6",
-        ETHERTYPE_STAG: "Service VLAN tag identifier (S-Tag) on Q-in-Q Tunnel",
-        ETHERTYPE_PTP: "Precision Time Protocol (PTP) over IEEE 802.3 Ethernet",
-    }
-    return (ethtype, types.get(ethtype, "Unknown 0x{:x}".format(ethtype)))
+    return (ethtype, _ethertype_name(ethtype))
 
 def _ipv4_protocol(pkt, offset):
     protocol = pkt[offset]
-    protos = {
-        IP_PROTOCOL_IP: "IP  # internet protocol, pseudo protocol number",
-        IP_PROTOCOL_ICMP: "ICMP  # internet control message protocol",
-        IP_PROTOCOL_IPENCAP: "IP-ENCAP # IP encapsulated in IP (officially ``IP'')",
-        IP_PROTOCOL_TCP: "TCP  # transmission control protocol",
-        IP_PROTOCOL_EGP: "EGP  # exterior gateway protocol",
-        IP_PROTOCOL_UDP: "UDP  # user datagram protocol",
-        IP_PROTOCOL_HMP: "HMP  # host monitoring protocol",
-        IP_PROTOCOL_RDP: "RDP  # \"reliable datagram\" protocol",
-        IP_PROTOCOL_DDP: "DDP  # Datagram Delivery Protocol",
-        IP_PROTOCOL_IPV6: "IPv6  # Internet Protocol, version 6",
-        IP_PROTOCOL_IPV6_ROUTE: "IPv6-Route # Routing Header for IPv6",
-        IP_PROTOCOL_IPV6_FRAG: "IPv6-Frag # Fragment Header for IPv6",
-        IP_PROTOCOL_IDRP: "IDRP  # Inter-Domain Routing Protocol",
-        IP_PROTOCOL_IPV6_ICMP: "IPv6-ICMP # ICMP for IPv6",
-        IP_PROTOCOL_IPV6_NONXT: "IPv6-NoNxt # No Next Header for IPv6",
-        IP_PROTOCOL_IPV6_OPTS: "IPv6-Opts # Destination Options for IPv6",
-        IP_PROTOCOL_PIM : "PIM  # Protocol Independent Multicast",
-        IP_PROTOCOL_L2TP: "L2TP  # Layer Two Tunneling Protocol [RFC2661]",
-        IP_PROTOCOL_SCTP: "SCTP  # Stream Control Transmission Protocol",
-        IP_PROTOCOL_UDPLITE: "UDPLite  # UDP-Lite [RFC3828]",
-    }
-    return (protocol, protos.get(protocol, "Unknown 0x{:x}".format(protocol)))
+    return (protocol, _ip_protocol_name(protocol))
+
+# ===== Header layouts =====
+_ETH_HEADER  = struct.Struct('!6s6sH')                # dest, src, ethertype
+_ARP_HEADER  = struct.Struct('!HHBBH6s4s6s4s')        # htype .. tpa
+_IPV4_HEADER = struct.Struct('!BBHHHBBH4s4s')         # version/ihl .. dest
+_IPV6_HEADER = struct.Struct('!IHBB16s16s')           # version/tc/flow .. dest
+_ICMP_HEADER = struct.Struct('!BBH')                  # type, code, checksum
+_UDP_HEADER  = struct.Struct('!HHHH')                 # src, dest, length, checksum
+_TCP_HEADER  = struct.Struct('!HHIIHHHH')             # src, dest, seq, ack, offset/flags .. urgent
+
+# ===== Record decoders =====
+# Each decoder below fills in one layer of a packet record (see decode_record)
+# and hands the remainder of the packet to the decoder for the next layer.
+# Decoders work on offsets into a single buffer; 'offset' is where the
+# layer's header starts and 'end' is one past the last byte that belongs to
+# it.  Nothing is formatted or printed here; see print_record for that.
+
+def add_layer(rec, name, layer):
+    """Append layer dict 'layer' to record 'rec' under 'name'.  Returns 'layer'.
+    For use by decoders added with register_decoder()."""
+    rec['layers'].append(name)
+    rec[name] = layer
+    return layer
+
+def _no_decoder(rec, parent, _type, name, data):
+    """Record a payload that we don't know how to decode."""
+    add_layer(rec, 'raw', {
+        'parent': parent,
+        'type': _type,
+        'name': name,
+        'data': data,
+    })
+    return
+
+def _truncated(rec, name, header, offset, end):
+    """Record an error and return True if there isn't room for 'header' at 'offset'."""
+    if end - offset < header.size:
+        rec['errors'].append("{} header truncated ({} < {} bytes)".format(name, max(end - offset, 0), header.size))
+        return True
+    return False
 
-def _ipv4_decoder(pkt):
-    version = pkt[OFFSET_IP_VERSION_IHL] >> 4
+def _ipv4_decoder(buf, offset, end, rec):
+    if _truncated(rec, 'IPv4', _IPV4_HEADER, offset, end):
+        return
+    (version_ihl, dscp_ecn, total_len, _id, flag_frag, ttl, protocol,
+     checksum, src_ip, dest_ip) = _IPV4_HEADER.unpack_from(buf, offset)
+    errors = []
+    version = version_ihl >> 4
     if version != 4:
-        print("=== ERROR: IPv4 Version is {}. Should be 4".format(version))
-    ihl = pkt[OFFSET_IP_VERSION_IHL] & 0xf
+        errors.append("IPv4 Version is {}. Should be 4".format(version))
+    ihl = version_ihl & 0xf
     _len = 4*ihl
     if (ihl < 5) or (ihl > 15):
-        print("=== ERROR: Invalid IPv4 header length. IHL = {} (len = {})".format(ihl, _len))
+        errors.append("Invalid IPv4 header length. IHL = {} (len = {})".format(ihl, _len))
         ihl = None # Suppress further parsing
-    total_len = (pkt[OFFSET_IP_TOTAL_LENGTH] << 8) + pkt[OFFSET_IP_TOTAL_LENGTH+1]
-    print("TOTAL_LEN: {}".format(total_len))
-    ttl = pkt[OFFSET_IP_TTL]
-    print("TTL: {}".format(ttl))
-    protocol, _protostr = _ipv4_protocol(pkt, OFFSET_IP_PROTOCOL)
-    print("PROTOCOL: {}".format(_protostr))
-    checksum = (pkt[OFFSET_IP_CHECKSUM] << 8) + pkt[OFFSET_IP_CHECKSUM+1]
-    print("CHECKSUM: 0x{:04x}".format(checksum))
-    print("SOURCE_IP: ", end="")
-    print_ip(pkt, OFFSET_IP_SRC_IP)
-    print("DEST_IP: ", end="")
-    print_ip(pkt, OFFSET_IP_DEST_IP)
-    if len(pkt) >= 14+total_len:
-        payload = pkt[14+(4*ihl):14+total_len]
-    else:
-        payload = pkt[14+(4*ihl):]
+    _protostr = _ip_protocol_name(protocol)
+    frag_offset = 8*(flag_frag & IP_FRAG_OFFSET_MASK)
+    add_layer(rec, 'ipv4', {
+        'errors': errors,
+        'offset': offset,
+        'version': version,
+        'ihl': ihl,
+        'total_length': total_len,
+        'ident': _id,
+        'flags': flag_frag >> 13,
+        'frag_offset': frag_offset,
+        'ttl': ttl,
+        'protocol': protocol,
+        'protocol_name': _protostr,
+        'checksum': checksum,
+        'src_ip': src_ip,
+        'dest_ip': dest_ip,
+    })
+    ip_end = offset + total_len
     if ihl is not None:
-        if (protocol == IP_PROTOCOL_ICMP):
-            _ipv4_icmp_decoder(payload)
-        elif (protocol == IP_PROTOCOL_UDP):
-            _ipv4_udp_decoder(payload)
+        payload_end = min(ip_end, end)
+        _decoder = _ip_protocol_decoders.get(protocol)
+        if frag_offset != 0:
+            # Only the first fragment holds the upper-layer header (see eth_frag)
+            _no_decoder(rec, 'ipv4', protocol, "{} fragment".format(_protostr), buf[offset + _len:payload_end])
+        elif _decoder is not None:
+            _decoder(buf, offset + _len, payload_end, rec)
         else:
-            print("No decoder for {}".format(_protostr))
-    if (len(pkt) > 14+total_len):
-        crc32 = "0x" + ''.join(["{:02x}".format(x) for x in pkt[14+total_len:]])
-        print("CRC32: {}".format(crc32))
+            _no_decoder(rec, 'ipv4', protocol, _protostr, buf[offset + _len:payload_end])
+    if (end > ip_end):
+        fcs = bytes(buf[ip_end:end])
     else:
-        print("CRC32: (truncated)")
+        fcs = None
+    add_layer(rec, 'fcs', {'fcs': fcs})
     return
 
-def _ipv4_icmp_decoder(payload):
-    _type = payload[PAYLOAD_OFFSET_ICMP_TYPE]
-    _code = payload[PAYLOAD_OFFSET_ICMP_CODE]
-    if (_type == 8) and (_code == 0):
-        print("TYPE/CODE: ICMP Request")
-    elif (_type == 0) and (_code == 0):
-        print("TYPE/CODE: ICMP Reply")
-    else:
-        print("TYPE/CODE: Unknown ({}/{})".format(_type, _code))
-    checksum = (payload[PAYLOAD_OFFSET_ICMP_CHECKSUM] << 8) + payload[PAYLOAD_OFFSET_ICMP_CHECKSUM+1]
-    print("ICMP_CHECKSUM: 0x{:04x}".format(checksum))
-    roh = payload[PAYLOAD_OFFSET_ICMP_REST_OF_HEADER:]
-    print("REST_OF_HEADER: {}".format([hex(x) for x in roh]))
-    return
-
-def _ipv4_udp_decoder(payload):
-    src_port = (payload[PAYLOAD_OFFSET_UDP_SRC_PORT] << 8) + payload[PAYLOAD_OFFSET_UDP_SRC_PORT +1]
-    print("SRC_PORT: {}".format(src_port))
-    dest_port = (payload[PAYLOAD_OFFSET_UDP_DEST_PORT] << 8) + payload[PAYLOAD_OFFSET_UDP_DEST_PORT +1]
-    print("DEST_PORT: {}".format(dest_port))
-    length = (payload[PAYLOAD_OFFSET_UDP_LENGTH] << 8) + payload[PAYLOAD_OFFSET_UDP_LENGTH +1]
-    print("UDP_LENGTH: {}".format(length))
-    checksum = (payload[PAYLOAD_OFFSET_UDP_CHECKSUM] << 8) + payload[PAYLOAD_OFFSET_UDP_CHECKSUM +1]
-    print("UDP_CHECKSUM: 0x{:04x}".format(checksum))
-    data = payload[PAYLOAD_OFFSET_UDP_DATA:]
-    print("UDP_DATA: {}".format([hex(x) for x in data]))
-    return
-
-def _arp_decoder(pkt):
-    # HTYPE (ethernet = 0x0001)
-    htype = (pkt[OFFSET_ARP_HTYPE] << 8) + pkt[OFFSET_ARP_HTYPE + 1]
-    if htype == 0x0001:
-        print("HTYPE: Ethernet")
-    else:
-        print("HTYPE: Unknown 0x{:x}".format(htype))
-    # PTYPE (protocol type)
-    ptype = (pkt[OFFSET_ARP_PTYPE] << 8) + pkt[OFFSET_ARP_PTYPE + 1]
-    if ptype == 0x0800:
-        print("PTYPE: IPv4")
-    else:
-        print("PTYPE: Unknown 0x{:x}".format(ptype))
+def _ipv4_icmp_decoder(buf, offset, end, rec):
+    if _truncated(rec, 'ICMP', _ICMP_HEADER, offset, end):
+        return
+    _type, _code, checksum = _ICMP_HEADER.unpack_from(buf, offset)
+    add_layer(rec, 'icmp', {
+        'offset': offset,
+        'type': _type,
+        'code': _code,
+        'checksum': checksum,
+        'rest_of_header': buf[offset+PAYLOAD_OFFSET_ICMP_REST_OF_HEADER:end],
+    })
+    return
+
+def _ipv4_udp_decoder(buf, offset, end, rec):
+    if _truncated(rec, 'UDP', _UDP_HEADER, offset, end):
+        return
+    src_port, dest_port, length, checksum = _UDP_HEADER.unpack_from(buf, offset)
+    add_layer(rec, 'udp', {
+        'offset': offset,
+        'src_port': src_port,
+        'dest_port': dest_port,
+        'length': length,
+        'checksum': checksum,
+        'data': buf[offset+PAYLOAD_OFFSET_UDP_DATA:end],
+    })
+    _decoder = _udp_port_decoders.get(dest_port)
+    if _decoder is None:
+        _decoder = _udp_port_decoders.get(src_port)
+    if _decoder is not None:
+        _decoder(buf, offset+PAYLOAD_OFFSET_UDP_DATA, end, rec)
+    return
+
+def _tcp_decoder(buf, offset, end, rec):
+    if _truncated(rec, 'TCP', _TCP_HEADER, offset, end):
+        return
+    src_port, dest_port, seq, ack, offset_flags, window, checksum, urgent = _TCP_HEADER.unpack_from(buf, offset)
+    errors = []
+    hdr_len = 4*(offset_flags >> 12)
+    if hdr_len < _TCP_HEADER.size:
+        errors.append("Invalid TCP data offset {} (header must be at least {} bytes)".format(hdr_len, _TCP_HEADER.size))
+        hdr_len = _TCP_HEADER.size
+    elif hdr_len > end - offset:
+        errors.append("TCP options truncated ({} < {} bytes)".format(end - offset, hdr_len))
+        hdr_len = end - offset
+    add_layer(rec, 'tcp', {
+        'errors': errors,
+        'offset': offset,
+        'src_port': src_port,
+        'dest_port': dest_port,
+        'seq': seq,
+        'ack': ack,
+        'header_length': hdr_len,
+        'flags': offset_flags & 0x1ff,
+        'window': window,
+        'checksum': checksum,
+        'urgent': urgent,
+        'options': buf[offset+PAYLOAD_OFFSET_TCP_OPTIONS:offset+hdr_len],
+        'data': buf[offset+hdr_len:end],
+    })
+    _decoder = _tcp_port_decoders.get(dest_port)
+    if _decoder is None:
+        _decoder = _tcp_port_decoders.get(src_port)
+    if _decoder is not None:
+        _decoder(buf, offset+hdr_len, end, rec)
+    return
+
+def _arp_decoder(buf, offset, end, rec):
+    if _truncated(rec, 'ARP', _ARP_HEADER, offset, end):
+        return
+    htype, ptype, hlen, plen, oper, sha, spa, tha, tpa = _ARP_HEADER.unpack_from(buf, offset)
+    errors = []
     # Hardware address length
-    hlen = pkt[OFFSET_ARP_HLEN]
     if hlen != 6:
-        print("=== ERROR: HLEN is {}. Should be 6".format(hlen))
+        errors.append("HLEN is {}. Should be 6".format(hlen))
     # IP address length
-    plen = pkt[OFFSET_ARP_PLEN]
     if plen != 4:
-        print("=== ERROR: PLEN is {}. Should be 4".format(plen))
+        errors.append("PLEN is {}. Should be 4".format(plen))
     # Operation
-    oper = (pkt[OFFSET_ARP_OPER] << 8) + pkt[OFFSET_ARP_OPER + 1]
-    if oper == 1:
-        print("OPER: request")
-    elif oper == 2:
-        print("OPER: reply")
-    else:
-        print("=== ERROR: Unknown OPER 0x{:x}".format(OPER))
-    # SHA/SPA
-    print("SHA: ", end="")
-    print_mac(pkt, OFFSET_ARP_SHA)
-    print("SPA: ", end="")
-    print_ip(pkt, OFFSET_ARP_SPA)
-    # THA/TPA
-    print("THA: ", end="")
-    print_mac(pkt, OFFSET_ARP_THA)
-    print("TPA: ", end="")
-    print_ip(pkt, OFFSET_ARP_TPA)
+    if oper not in (1, 2):
+        errors.append("Unknown OPER 0x{:x}".format(oper))
+    add_layer(rec, 'arp', {
+        'errors': errors,
+        # HTYPE (ethernet = 0x0001)
+        'htype': htype,
+        # PTYPE (protocol type)
+        'ptype': ptype,
+        'hlen': hlen,
+        'plen': plen,
+        'oper': oper,
+        'sha': sha,
+        'spa': spa,
+        'tha': tha,
+        'tpa': tpa,
+    })
     return
 
 def get_pkt_docoder(ethtype):
-    if ethtype == ETHERTYPE_IPV4:
-        return _ipv4_decoder
-    elif ethtype == ETHERTYPE_ARP:
-        return _arp_decoder
-    elif ethtype == ETHERTYPE_WOL:
-        print("TODO: WOL decoder")
-    elif ethtype == ETHERTYPE_IPV6:
-        return _ipv6_decoder
-    else:
-        print("I'm not writing a decoder for this")
-    return None
-
-def _ipv6_next_header(pkt, offset):
-    next_header = pkt[offset]
-    next_headers = {
-        EXTENSION_HEADER_HOP_BY_HOP_OPTIONS: "Hop-by-Hop Options",
-        EXTENSION_HEADER_ROUTING: "Routing",
-        EXTENSION_HEADER_FRAGMENT: "Fragment",
-        EXTENSION_HEADER_ESP: "Encapsulating Security Payload",
-        EXTENSION_HEADER_AUTHENTICATION: "Authentication Header",
-        EXTENSION_HEADER_DESTINATION_OPTIONS: "Destination Options",
-        EXTENSION_HEADER_MOBILITY: "Mobility",
-        EXTENSION_HEADER_HOST_ID_PROTOCOL: "Host Identity Protocol",
-        EXTENSION_HEADER_SHIM6_PROTOCOL: "Shim6 Protocol",
-        EXTENSION_HEADER_RESERVED0: "Reserved for future use: {}".format(EXTENSION_HEADER_RESERVED0),
-        EXTENSION_HEADER_RESERVED1: "Reserved for future use: {}".format(EXTENSION_HEADER_RESERVED1),
-        EXTENSION_HEADER_NOTHING: "{}: Ignore anything following this header.".format(EXTENSION_HEADER_NOTHING),
-    }
-    nhstr = next_headers.get(next_header, None)
-    if nhstr is None:
-        protocol, protostr = _ipv4_protocol(pkt, offset)
-        return (False, protocol, protostr)
-    return (True, next_header, "IPv6 Ext: " + nhstr)
+    return _ethertype_decoders.get(ethtype)
 
 def _ipv6_ip(pkt, offset):
-    l = []
-    for n in range(8):
-        # Group as 16-bit hex numbers
-        _b = (pkt[offset+(2*n)] << 8) + pkt[offset+(2*n + 1)]
-        if _b == 0:
-            # IPv6 address notation allows zeros to be skipped
-            l.append("")
+    return eth_render.ipv6(as_buffer(pkt)[offset:offset+16])
+
+# Longest extension header chain we'll follow before giving up
+MAX_IPV6_EXT_HEADERS = 16
+
+def ipv6_ext_walk(buf, offset, end, next_header):
+    """Follow the IPv6 extension header chain starting at buf[offset] whose
+    type is 'next_header', without reading past 'end'.
+    Returns (offset, protocol, chain, error) where 'offset' and 'protocol'
+    locate the upper-layer header, 'chain' lists the extension header types
+    that were skipped and 'error' is None or a string.  Stops early at ESP,
+    No Next Header, or a non-first fragment (whose payload can't be decoded
+    on its own); 'protocol' is then that extension header's type."""
+    chain = []
+    for n in range(MAX_IPV6_EXT_HEADERS):
+        if next_header not in IPV6_EXT_HEADER_NAMES:
+            return (offset, next_header, chain, None)
+        if next_header in (EXTENSION_HEADER_ESP, EXTENSION_HEADER_NOTHING):
+            return (offset, next_header, chain, None)
+        if offset + 8 > end:
+            return (offset, next_header, chain, "IPv6 extension header truncated at offset {}".format(offset))
+        if next_header == EXTENSION_HEADER_FRAGMENT:
+            if (buf[offset+2] << 8 | buf[offset+3]) & 0xfff8:
+                # Not the first fragment
+                return (offset, next_header, chain, None)
+            ext_length = 8
+        elif next_header == EXTENSION_HEADER_AUTHENTICATION:
+            ext_length = (buf[offset+1] + 2)*4
         else:
-            l.append("{:04x}".format(_b))
-    return ":".join(l)
+            ext_length = (buf[offset+1] + 1)*8
+        chain.append(next_header)
+        next_header = buf[offset]
+        offset += ext_length
+    return (offset, next_header, chain, "More than {} IPv6 extension headers".format(MAX_IPV6_EXT_HEADERS))
 
-def _ipv6_ext_header_decoder(pkt, offset, header_type):
-    if header_type == EXTENSION_HEADER_FRAGMENT:
-        ext_length = 8
-    else:
-        ext_length = pkt[offset+1]
-    is_ext, next_header, nhstr = _ipv6_next_header(pkt, offset)
-    print("NEXT_HEADER: {}".format(nhstr))
-    if is_ext:
-        return _ipv6_ext_header_decoder(pkt, offset + ext_length, next_header)
+def _ipv6_payload_decoder(buf, offset, end, next_header, nhstr, rec):
+    _decoder = _ip_protocol_decoders.get(next_header)
+    if _decoder is not None:
+        _decoder(buf, offset, end, rec)
     else:
-        payload = pkt[offset+ext_length:]
-        if (next_header == IP_PROTOCOL_ICMP):
-            _ipv4_icmp_decoder(payload)
-        elif (next_header == IP_PROTOCOL_UDP):
-            _ipv4_udp_decoder(payload)
-        if (next_header == IP_PROTOCOL_IPV6_ICMP):
-            _ipv6_icmp_decoder(payload)
-        else:
-            print("No decoder for {}".format(nhstr))
+        _no_decoder(rec, 'ipv6', next_header, nhstr, buf[offset:end])
     return
 
-def _ipv6_icmp_decoder(payload):
-    print("TODO IPv6_ICMP decoder")
+def _ipv6_icmp_decoder(buf, offset, end, rec):
+    # ICMPv6 shares the type/code/checksum layout of ICMP
+    if _truncated(rec, 'ICMPv6', _ICMP_HEADER, offset, end):
+        return
+    _type, _code, checksum = _ICMP_HEADER.unpack_from(buf, offset)
+    add_layer(rec, 'icmpv6', {
+        'offset': offset,
+        'type': _type,
+        'code': _code,
+        'checksum': checksum,
+        'rest_of_header': buf[offset+PAYLOAD_OFFSET_ICMP_REST_OF_HEADER:end],
+    })
     return
 
-def _ipv6_decoder(pkt):
-    version = pkt[OFFSET_IPV6_VERSION_TC_FLOWLABEL] >> 4
+def _ipv6_decoder(buf, offset, end, rec):
+    if _truncated(rec, 'IPv6', _IPV6_HEADER, offset, end):
+        return
+    vtcfl, payload_len, _next_header, hop_limit, src_ip, dest_ip = _IPV6_HEADER.unpack_from(buf, offset)
+    errors = []
+    version = vtcfl >> 28
     if version != 6:
-        print("=== ERROR: IPv6 Version is {}. Should be 6".format(version))
-    payload_len = (pkt[OFFSET_IPV6_PAYLOAD_LENGTH] << 8) + pkt[OFFSET_IPV6_PAYLOAD_LENGTH+1]
-    print("PAYLOAD_LENGTH: {}".format(payload_len))
-    is_ext, next_header, nhstr = _ipv6_next_header(pkt, OFFSET_IPV6_NEXT_HEADER)
-    print("NEXT_HEADER: {}".format(nhstr))
-    print("HOP_LIMIT: {}".format(pkt[OFFSET_IPV6_HOP_LIMIT]))
-    ipv6_src_ip = _ipv6_ip(pkt, OFFSET_IPV6_SRC_IP)
-    print("SOURCE_IP: {}".format(ipv6_src_ip))
-    ipv6_dest_ip = _ipv6_ip(pkt, OFFSET_IPV6_DEST_IP   )
-    print("DEST_IP: {}".format(ipv6_dest_ip))
-    if is_ext:
-        return _ipv6_ext_header_decoder(pkt, OFFSET_IPV6_PAYLOAD, next_header)
-    else:
-        payload = pkt[OFFSET_IPV6_PAYLOAD:]
-        if (next_header == IP_PROTOCOL_ICMP):
-            _ipv4_icmp_decoder(payload)
-        elif (next_header == IP_PROTOCOL_UDP):
-            _ipv4_udp_decoder(payload)
-        if (next_header == IP_PROTOCOL_IPV6_ICMP):
-            _ipv6_icmp_decoder(payload)
-        else:
-            print("No decoder for {}".format(nhstr))
+        errors.append("IPv6 Version is {}. Should be 6".format(version))
+    payload_offset = offset + OFFSET_IPV6_PAYLOAD - OFFSET_IPV6_VERSION_TC_FLOWLABEL
+    end = min(end, payload_offset + payload_len)
+    upper_offset, protocol, chain, error = ipv6_ext_walk(buf, payload_offset, end, _next_header)
+    if error is not None:
+        errors.append(error)
+    # Every header in the chain as (type, name); the last is the upper-layer protocol
+    next_headers = [(nh, IPV6_EXT_HEADER_NAMES[nh]) for nh in chain]
+    nhstr = IPV6_EXT_HEADER_NAMES.get(protocol)
+    if nhstr is None:
+        nhstr = _ip_protocol_name(protocol)
+    next_headers.append((protocol, nhstr))
+    add_layer(rec, 'ipv6', {
+        'errors': errors,
+        'offset': offset,
+        'version': version,
+        'payload_length': payload_len,
+        'next_headers': next_headers,
+        'hop_limit': hop_limit,
+        'src_ip': src_ip,
+        'dest_ip': dest_ip,
+    })
+    if error is None:
+        _ipv6_payload_decoder(buf, upper_offset, end, protocol, nhstr, rec)
     return
 
 def findStart(pkt):
@@ -356,7 +496,7 @@ def findStart(pkt):
     finding the beginning of packet data and returning that index."""
     preamble_detected = False
     # Just look at the first 8 bytes
-    for n in range(8):
+    for n in range(min(8, len(pkt))):
         _b = pkt[n]
         if preamble_detected:
             if _b not in (0x55, 0xaa, 0xd5, 0xab):
@@ -370,34 +510,778 @@ def findStart(pkt):
                 preamble_detected = True
     return 0
 
-def decode(pkt):
+# ===== Dispatch registries =====
+# Decoders are called as decoder(buf, offset, end, rec); see register_decoder
+
+# Keyed by ethertype
+_ethertype_decoders = {
+    ETHERTYPE_IPV4: _ipv4_decoder,
+    ETHERTYPE_ARP: _arp_decoder,
+    ETHERTYPE_IPV6: _ipv6_decoder,
+}
+
+# Keyed by IPv4 protocol / IPv6 upper-layer next header (same number space)
+_ip_protocol_decoders = {
+    IP_PROTOCOL_ICMP: _ipv4_icmp_decoder,
+    IP_PROTOCOL_TCP: _tcp_decoder,
+    IP_PROTOCOL_UDP: _ipv4_udp_decoder,
+    IP_PROTOCOL_IPV6_ICMP: _ipv6_icmp_decoder,
+}
+
+# Keyed by UDP port (destination port is tried before source port)
+_udp_port_decoders = {}
+
+# Keyed by TCP port, likewise.  Decoders get one segment's data; see eth_tcp
+# for the reassembled byte stream
+_tcp_port_decoders = {}
+
+_registries = {
+    'ethertype': (_ethertype_decoders, ETHERTYPE_NAMES),
+    'ip': (_ip_protocol_decoders, IP_PROTOCOL_NAMES),
+    'udp': (_udp_port_decoders, None),
+    'tcp': (_tcp_port_decoders, None),
+}
+
+def register_decoder(kind, key, decoder, name=None):
+    """Add (or replace) a decoder.
+    'kind' selects the dispatch table:
+        'ethertype':  'key' is an ethertype; decoder gets the Ethernet payload
+        'ip':         'key' is an IPv4 protocol / IPv6 next header; decoder gets the IP payload
+        'udp':        'key' is a UDP port; decoder gets the UDP data
+        'tcp':        'key' is a TCP port; decoder gets the segment's data
+    'decoder' is called as decoder(buf, offset, end, rec) where buf[offset:end]
+    holds its bytes, and should add its results to 'rec' with add_layer().
+    'name' optionally sets the human-readable name for ethertypes and IP protocols.
+    Pass decoder=None to remove a decoder."""
+    if kind not in _registries:
+        raise ValueError("Unknown decoder kind '{}'. Must be one of {}".format(kind, list(_registries.keys())))
+    decoders, names = _registries[kind]
+    if decoder is None:
+        decoders.pop(key, None)
+    else:
+        decoders[key] = decoder
+    if name is not None and names is not None:
+        names[key] = name
+    return
+
+def as_buffer(pkt):
+    """Return a byte-indexable view of 'pkt' without copying it if possible.
+    Anything that isn't already a bytes-like object (e.g. a list of ints) is
+    converted to bytes once."""
+    if isinstance(pkt, (bytes, bytearray)):
+        return memoryview(pkt)
+    if isinstance(pkt, memoryview):
+        if pkt.format != 'B' or pkt.ndim != 1:
+            return pkt.cast('B')
+        return pkt
+    try:
+        return memoryview(pkt).cast('B')
+    except TypeError:
+        pass
     # Sanitize input
-    pkt = [int(x) for x in pkt]
-    start = findStart(pkt)
-    # Discard the preamble & SOF
-    pkt = pkt[start:]
-    _len = len(pkt)
+    return memoryview(bytes([int(x) for x in pkt]))
+
+# ===== Continuous stream framing =====
+PREAMBLE = b'\x55'*7
+SFD = b'\xd5'
+
+def find_frames(stream, delimiter=PREAMBLE+SFD):
+    """Yield a memoryview of every frame in 'stream', one continuous run of
+    MAC-side bytes (e.g. a whole GMII capture) in which each frame is
+    preceded by 'delimiter' (the preamble and SFD by default).  Each frame
+    runs from just after its SFD to the start of the next delimiter (or the
+    end of the stream), so it includes the FCS and any bytes captured
+    between frames.  'stream' may be bytes, bytearray or an mmap; the
+    frames are views into it, not copies.  A memoryview (which has no
+    find()) is copied to bytes first."""
+    if isinstance(stream, memoryview):
+        stream = stream.tobytes()
+    find = stream.find
+    mv = memoryview(stream)
+    step = len(delimiter)
+    pos = find(delimiter)
+    while pos >= 0:
+        start = pos + step
+        pos = find(delimiter, start)
+        if pos < 0:
+            yield mv[start:]
+        else:
+            yield mv[start:pos]
+    return
+
+def find_frames_file(filename, delimiter=PREAMBLE+SFD):
+    """Yield a memoryview of every frame in raw byte stream file 'filename'
+    (see find_frames).  The file is memory-mapped rather than read."""
+    import mmap
+    with open(filename, 'rb') as fd:
+        if os.fstat(fd.fileno()).st_size == 0:
+            return
+        # The map stays open as long as any frame view refers to it
+        mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    yield from find_frames(mm, delimiter)
+    return
+
+def decode_record(pkt):
+    """Decode packet 'pkt' without printing anything.
+    'pkt' may be bytes, bytearray, memoryview (decoded in place) or any
+    iterable of ints (converted to bytes once).
+    Returns a record (dict) with:
+        'start':  index of the first byte after any preamble/SFD
+        'length': length of the packet (after the preamble)
+        'errors': list of packet-level error strings
+        'layers': list of layer names in the order they were decoded
+    plus one dict per decoded layer keyed by the layer name ('eth', 'arp',
+    'ipv4', 'ipv6', 'icmp', 'icmpv6', 'udp', 'tcp', 'fcs', or 'raw' for a payload
+    that has no decoder).  Each layer dict may hold its own 'errors' list.
+    Addresses are kept as raw bytes and payloads as memoryview slices of
+    'pkt'.  IP, ICMP, UDP and TCP layers also record the 'offset' of their header
+    in the buffer.  Use print_record() to format a record."""
+    buf = as_buffer(pkt)
+    start = findStart(buf)
+    end = len(buf)
+    _len = end - start
+    rec = {
+        'start': start,
+        'length': _len,
+        'errors': [],
+        'layers': [],
+    }
     if _len < MIN_PKT_SIZE:
-        print("Pkt too small ({} < {})".format(len(pkt), MIN_PKT_SIZE))
-    print("DEST_MAC: ", end="")
-    print_mac(pkt, OFFSET_DEST_MAC)
-    print("SRC_MAC: ", end="")
-    print_mac(pkt, OFFSET_SRC_MAC)
-    _ethtype, _etstr = ethertype(pkt, OFFSET_ETHERTYPE)
-    print("ETHERTYPE: {}".format(_etstr))
-    _decoder = get_pkt_docoder(_ethtype)
+        rec['errors'].append("Pkt too small ({} < {})".format(_len, MIN_PKT_SIZE))
+    if _truncated(rec, 'Ethernet', _ETH_HEADER, start, end):
+        return rec
+    dest_mac, src_mac, _ethtype = _ETH_HEADER.unpack_from(buf, start)
+    _etstr = _ethertype_name(_ethtype)
+    add_layer(rec, 'eth', {
+        'dest_mac': dest_mac,
+        'src_mac': src_mac,
+        'ethertype': _ethtype,
+        'ethertype_name': _etstr,
+    })
+    _decoder = _ethertype_decoders.get(_ethtype)
     if _decoder is not None:
-        _decoder(pkt)
+        # Ethernet offsets (OFFSET_*) are relative to the start of the frame
+        _decoder(buf, start + _ETH_HEADER.size, end, rec)
+    else:
+        _no_decoder(rec, 'eth', _ethtype, _etstr, buf[start + _ETH_HEADER.size:end])
+    return rec
+
+# ===== Lazy field access =====
+
+# Marks a cached header that was looked for but isn't in the packet
+_ABSENT = ()
+
+class PacketView():
+    """Read-only view of one packet that decodes a header only when one of
+    its fields is first read, and caches the unpacked header on the view.
+    Use this when only a few fields of each frame are needed; decode_record()
+    decodes every layer up front.
+    'pkt' is anything decode_record() accepts.  Fields of a header that isn't
+    in the packet (e.g. 'src_port' of an ARP frame) read as None.
+        dest_mac, src_mac, ethertype        Ethernet
+        ip_version                          4, 6 or None
+        src_ip, dest_ip, ttl, protocol      IPv4, or IPv6 (ttl is the hop
+                                            limit; protocol is the upper-layer
+                                            header after any extension headers)
+        l4_offset                           Offset of the upper-layer header
+                                            (None in a non-first IPv4 fragment)
+        src_port, dest_port                 UDP or TCP
+        udp_length                          UDP
+        tcp_seq, tcp_ack, tcp_flags         TCP
+        icmp_type, icmp_code                ICMP or ICMPv6
+        payload                             UDP or TCP data, or ICMP rest-of-header
+    A view can be pointed at the next frame with reset() instead of making
+    a new one."""
+    __slots__ = ('buf', 'start', 'end', '_eth', '_ip', '_l4')
+
+    def __init__(self, pkt):
+        self.reset(pkt)
+
+    def reset(self, pkt):
+        """Point this view at packet 'pkt' and drop everything cached."""
+        buf = as_buffer(pkt)
+        self.buf = buf
+        self.start = findStart(buf)
+        self.end = len(buf)
+        self._eth = None
+        self._ip = None
+        self._l4 = None
+        return self
+
+    def __len__(self):
+        return self.end - self.start
+
+    def record(self):
+        """Fully decode the packet (see decode_record)."""
+        return decode_record(self.buf)
+
+    # Each _decode_* fills in one cached header (or _ABSENT) and returns it
+    def _decode_eth(self):
+        if self.end - self.start < _ETH_HEADER.size:
+            self._eth = _ABSENT
+        else:
+            self._eth = _ETH_HEADER.unpack_from(self.buf, self.start)
+        return self._eth
+
+    def _decode_ip(self):
+        # (version, src_ip, dest_ip, ttl, protocol, l4_offset, l4_end)
+        eth = self._eth
+        if eth is None:
+            eth = self._decode_eth()
+        self._ip = _ABSENT
+        if eth is _ABSENT:
+            return self._ip
+        buf = self.buf
+        offset = self.start + _ETH_HEADER.size
+        end = self.end
+        if eth[2] == ETHERTYPE_IPV4:
+            if end - offset < _IPV4_HEADER.size:
+                return self._ip
+            (version_ihl, dscp_ecn, total_len, _id, flag_frag, ttl, protocol,
+             checksum, src_ip, dest_ip) = _IPV4_HEADER.unpack_from(buf, offset)
+            ihl = version_ihl & 0xf
+            if (version_ihl >> 4) != 4 or ihl < 5:
+                return self._ip
+            l4_offset = offset + 4*ihl
+            if flag_frag & IP_FRAG_OFFSET_MASK:
+                l4_offset = None
+            self._ip = (4, src_ip, dest_ip, ttl, protocol, l4_offset, min(offset + total_len, end))
+        elif eth[2] == ETHERTYPE_IPV6:
+            if end - offset < _IPV6_HEADER.size:
+                return self._ip
+            vtcfl, payload_len, next_header, hop_limit, src_ip, dest_ip = _IPV6_HEADER.unpack_from(buf, offset)
+            if (vtcfl >> 28) != 6:
+                return self._ip
+            payload_offset = offset + _IPV6_HEADER.size
+            end = min(end, payload_offset + payload_len)
+            upper_offset, protocol, chain, error = ipv6_ext_walk(buf, payload_offset, end, next_header)
+            if error is not None:
+                upper_offset = None
+            self._ip = (6, src_ip, dest_ip, hop_limit, protocol, upper_offset, end)
+        return self._ip
+
+    def _decode_l4(self):
+        # ('udp', src_port, dest_port, length),
+        # ('tcp', src_port, dest_port, seq, ack, offset/flags) or ('icmp', type, code, checksum)
+        ip = self._ip
+        if ip is None:
+            ip = self._decode_ip()
+        self._l4 = _ABSENT
+        if ip is _ABSENT or ip[5] is None:
+            return self._l4
+        protocol, offset, end = ip[4], ip[5], ip[6]
+        if protocol == IP_PROTOCOL_UDP:
+            if end - offset >= _UDP_HEADER.size:
+                self._l4 = ('udp',) + _UDP_HEADER.unpack_from(self.buf, offset)[:3]
+        elif protocol == IP_PROTOCOL_TCP:
+            if end - offset >= _TCP_HEADER.size:
+                self._l4 = ('tcp',) + _TCP_HEADER.unpack_from(self.buf, offset)[:5]
+        elif protocol in (IP_PROTOCOL_ICMP, IP_PROTOCOL_IPV6_ICMP):
+            if end - offset >= _ICMP_HEADER.size:
+                self._l4 = ('icmp',) + _ICMP_HEADER.unpack_from(self.buf, offset)
+        return self._l4
+
+    def _eth_field(self, n):
+        eth = self._eth
+        if eth is None:
+            eth = self._decode_eth()
+        if eth is _ABSENT:
+            return None
+        return eth[n]
+
+    def _ip_field(self, n):
+        ip = self._ip
+        if ip is None:
+            ip = self._decode_ip()
+        if ip is _ABSENT:
+            return None
+        return ip[n]
+
+    def _l4_field(self, kind, n):
+        l4 = self._l4
+        if l4 is None:
+            l4 = self._decode_l4()
+        if l4 is _ABSENT or l4[0] != kind:
+            return None
+        return l4[n]
+
+    def _port_field(self, n):
+        l4 = self._l4
+        if l4 is None:
+            l4 = self._decode_l4()
+        if l4 is _ABSENT or l4[0] == 'icmp':
+            return None
+        return l4[n]
+
+    dest_mac = property(lambda self: self._eth_field(0))
+    src_mac = property(lambda self: self._eth_field(1))
+    ethertype = property(lambda self: self._eth_field(2))
+    ip_version = property(lambda self: self._ip_field(0))
+    src_ip = property(lambda self: self._ip_field(1))
+    dest_ip = property(lambda self: self._ip_field(2))
+    ttl = property(lambda self: self._ip_field(3))
+    protocol = property(lambda self: self._ip_field(4))
+    l4_offset = property(lambda self: self._ip_field(5))
+    src_port = property(lambda self: self._port_field(1))
+    dest_port = property(lambda self: self._port_field(2))
+    udp_length = property(lambda self: self._l4_field('udp', 3))
+    tcp_seq = property(lambda self: self._l4_field('tcp', 3))
+    tcp_ack = property(lambda self: self._l4_field('tcp', 4))
+    icmp_type = property(lambda self: self._l4_field('icmp', 1))
+    icmp_code = property(lambda self: self._l4_field('icmp', 2))
+
+    @property
+    def tcp_flags(self):
+        offset_flags = self._l4_field('tcp', 5)
+        if offset_flags is None:
+            return None
+        return offset_flags & 0x1ff
+
+    @property
+    def payload(self):
+        l4 = self._l4
+        if l4 is None:
+            l4 = self._decode_l4()
+        if l4 is _ABSENT:
+            return None
+        offset = self._ip[5]
+        if l4[0] == 'udp':
+            return self.buf[offset+PAYLOAD_OFFSET_UDP_DATA:self._ip[6]]
+        if l4[0] == 'tcp':
+            return self.buf[offset+4*(l4[5] >> 12):self._ip[6]]
+        return self.buf[offset+PAYLOAD_OFFSET_ICMP_REST_OF_HEADER:self._ip[6]]
+
+    def __repr__(self):
+        return "PacketView(ethertype={}, protocol={}, src_port={}, dest_port={}, length={})".format(
+            self.ethertype, self.protocol, self.src_port, self.dest_port, len(self))
+
+# ===== Batch (columnar) decoding =====
+# Enough of the frame to cover Ethernet + the largest IPv4 header + UDP
+_BATCH_HEADER_WIDTH = 14 + 4*15 + 8
+
+def _batch_uint(hdr, col, nbytes, dtype):
+    """Big-endian unsigned integer column from 'nbytes' columns of 'hdr' starting at 'col'."""
+    import numpy as np
+    out = np.zeros(hdr.shape[0], dtype=dtype)
+    for n in range(nbytes):
+        out = (out << 8) | hdr[:, col+n].astype(dtype)
+    return out
+
+def decode_batch(frames, offsets=None, lengths=None):
+    """Extract header fields from many frames at once using NumPy.
+    'frames' is either a 2-D uint8 array with one (zero-padded) frame per row,
+    or a flat 1-D uint8 buffer with 'offsets' giving the start of each frame.
+    Frames must start at the destination MAC (no preamble).  'lengths' gives
+    the true length of each frame; it defaults to the row width for 2-D input
+    and to the distance to the next offset for flat input.
+    Returns a dict of 1-D arrays (one entry per frame):
+        'dest_mac', 'src_mac'       MAC address as uint64
+        'ethertype'                 uint16
+        'is_ipv4', 'is_udp'         bool masks for rows where the fields below are valid
+        'ttl', 'protocol'           uint8 (IPv4)
+        'src_ip', 'dest_ip'         uint32 (IPv4)
+        'src_port', 'dest_port', 'udp_length'   uint16 (UDP over IPv4)
+    Fields that don't apply to a frame are zero.  As in decode_record(), a
+    fragment other than the first has no UDP header, and the UDP header must
+    fit within the IPv4 total length."""
+    import numpy as np
+    frames = np.asarray(frames, dtype=np.uint8)
+    if frames.ndim == 2:
+        nframes, width = frames.shape
+        if lengths is None:
+            lengths = np.full(nframes, width, dtype=np.int64)
+        hdr = frames[:, :_BATCH_HEADER_WIDTH]
+        if hdr.shape[1] < _BATCH_HEADER_WIDTH:
+            hdr = np.pad(hdr, ((0, 0), (0, _BATCH_HEADER_WIDTH - hdr.shape[1])))
+    else:
+        if offsets is None:
+            raise ValueError("offsets are required with a flat frame buffer")
+        offsets = np.asarray(offsets, dtype=np.int64)
+        nframes = len(offsets)
+        if lengths is None:
+            lengths = np.diff(np.append(offsets, len(frames)))
+        # Gather just the header window of every frame into one 2-D array
+        idx = offsets[:, None] + np.arange(_BATCH_HEADER_WIDTH)
+        if len(frames) == 0:
+            hdr = np.zeros((nframes, _BATCH_HEADER_WIDTH), dtype=np.uint8)
+        else:
+            hdr = np.where(idx < len(frames), frames[np.minimum(idx, len(frames) - 1)], 0).astype(np.uint8)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    # Zero anything past the end of each frame so short frames decode as zeros
+    hdr = np.where(np.arange(_BATCH_HEADER_WIDTH) < lengths[:, None], hdr, 0).astype(np.uint8)
+    cols = {
+        'dest_mac': _batch_uint(hdr, OFFSET_DEST_MAC, 6, np.uint64),
+        'src_mac': _batch_uint(hdr, OFFSET_SRC_MAC, 6, np.uint64),
+        'ethertype': _batch_uint(hdr, OFFSET_ETHERTYPE, 2, np.uint16),
+    }
+    ihl = (hdr[:, OFFSET_IP_VERSION_IHL] & 0xf).astype(np.int64)
+    is_ipv4 = ((cols['ethertype'] == ETHERTYPE_IPV4)
+               & ((hdr[:, OFFSET_IP_VERSION_IHL] >> 4) == 4)
+               & (ihl >= 5)
+               & (lengths >= OFFSET_IP_DEST_IP + 4))
+    protocol = np.where(is_ipv4, hdr[:, OFFSET_IP_PROTOCOL], 0).astype(np.uint8)
+    cols['is_ipv4'] = is_ipv4
+    cols['ttl'] = np.where(is_ipv4, hdr[:, OFFSET_IP_TTL], 0).astype(np.uint8)
+    cols['protocol'] = protocol
+    cols['src_ip'] = np.where(is_ipv4, _batch_uint(hdr, OFFSET_IP_SRC_IP, 4, np.uint32), 0).astype(np.uint32)
+    cols['dest_ip'] = np.where(is_ipv4, _batch_uint(hdr, OFFSET_IP_DEST_IP, 4, np.uint32), 0).astype(np.uint32)
+    # The UDP header moves with IHL, so gather it per row
+    udp_off = OFFSET_IP_VERSION_IHL + 4*ihl
+    ip_end = np.minimum(lengths, OFFSET_IP_VERSION_IHL + _batch_uint(hdr, OFFSET_IP_TOTAL_LENGTH, 2, np.int64))
+    first_frag = (_batch_uint(hdr, OFFSET_IP_FLAG_FRAG, 2, np.uint16) & IP_FRAG_OFFSET_MASK) == 0
+    is_udp = (is_ipv4 & (protocol == IP_PROTOCOL_UDP) & first_frag
+              & (ip_end >= udp_off + _UDP_HEADER.size))
+    rows = np.arange(nframes)
+    udp_idx = np.minimum(udp_off, _BATCH_HEADER_WIDTH - _UDP_HEADER.size)
+    def _udp16(field):
+        b = (hdr[rows, udp_idx + field].astype(np.uint16) << 8) | hdr[rows, udp_idx + field + 1]
+        return np.where(is_udp, b, 0).astype(np.uint16)
+    cols['is_udp'] = is_udp
+    cols['src_port'] = _udp16(PAYLOAD_OFFSET_UDP_SRC_PORT)
+    cols['dest_port'] = _udp16(PAYLOAD_OFFSET_UDP_DEST_PORT)
+    cols['udp_length'] = _udp16(PAYLOAD_OFFSET_UDP_LENGTH)
+    return cols
+
+# ===== Record renderers =====
+
+def _print_errors(layer):
+    for err in layer.get('errors', ()):
+        print("=== ERROR: {}".format(err))
     return
 
-def doPktDecode(argv):
-    pktHex = argv[1:]
+def _eth_printer(layer):
+    print("DEST_MAC: {}".format(eth_render.mac(layer['dest_mac'])))
+    print("SRC_MAC: {}".format(eth_render.mac(layer['src_mac'])))
+    print("ETHERTYPE: {}".format(layer['ethertype_name']))
+    return
+
+def _ipv4_printer(layer):
+    print("TOTAL_LEN: {}".format(layer['total_length']))
+    if (layer['flags'] << 13) & IP_FLAG_MF or layer['frag_offset'] != 0:
+        print("FRAGMENT: ID 0x{:04x}, offset {}{}".format(layer['ident'], layer['frag_offset'],
+              ", more fragments" if (layer['flags'] << 13) & IP_FLAG_MF else ""))
+    print("TTL: {}".format(layer['ttl']))
+    print("PROTOCOL: {}".format(layer['protocol_name']))
+    print("CHECKSUM: 0x{:04x}".format(layer['checksum']))
+    print("SOURCE_IP: {}".format(eth_render.ipv4(layer['src_ip'])))
+    print("DEST_IP: {}".format(eth_render.ipv4(layer['dest_ip'])))
+    return
+
+def _icmp_printer(layer):
+    _type = layer['type']
+    _code = layer['code']
+    if (_type == 8) and (_code == 0):
+        print("TYPE/CODE: ICMP Request")
+    elif (_type == 0) and (_code == 0):
+        print("TYPE/CODE: ICMP Reply")
+    else:
+        print("TYPE/CODE: Unknown ({}/{})".format(_type, _code))
+    print("ICMP_CHECKSUM: 0x{:04x}".format(layer['checksum']))
+    print("REST_OF_HEADER: {}".format(eth_render.hexdump(layer['rest_of_header'])))
+    return
+
+def _icmpv6_printer(layer):
+    print("TYPE/CODE: {}/{}".format(layer['type'], layer['code']))
+    print("ICMP_CHECKSUM: 0x{:04x}".format(layer['checksum']))
+    return
+
+def _udp_printer(layer):
+    print("SRC_PORT: {}".format(layer['src_port']))
+    print("DEST_PORT: {}".format(layer['dest_port']))
+    print("UDP_LENGTH: {}".format(layer['length']))
+    print("UDP_CHECKSUM: 0x{:04x}".format(layer['checksum']))
+    print("UDP_DATA: {}".format(eth_render.hexdump(layer['data'])))
+    return
+
+def tcp_flag_names(flags):
+    """'SYN,ACK' for the TCP flags bits in 'flags'."""
+    return ','.join([name for n, name in enumerate(TCP_FLAG_NAMES) if flags & (1 << n)])
+
+def _tcp_printer(layer):
+    print("SRC_PORT: {}".format(layer['src_port']))
+    print("DEST_PORT: {}".format(layer['dest_port']))
+    print("SEQ: {}".format(layer['seq']))
+    print("ACK: {}".format(layer['ack']))
+    print("FLAGS: {}".format(tcp_flag_names(layer['flags']) or "(none)"))
+    print("WINDOW: {}".format(layer['window']))
+    print("TCP_CHECKSUM: 0x{:04x}".format(layer['checksum']))
+    if len(layer['options']) > 0:
+        print("TCP_OPTIONS: {}".format(eth_render.hexdump(layer['options'])))
+    print("TCP_DATA: {}".format(eth_render.hexdump(layer['data'])))
+    return
+
+def _arp_printer(layer):
+    if layer['htype'] == 0x0001:
+        print("HTYPE: Ethernet")
+    else:
+        print("HTYPE: Unknown 0x{:x}".format(layer['htype']))
+    if layer['ptype'] == 0x0800:
+        print("PTYPE: IPv4")
+    else:
+        print("PTYPE: Unknown 0x{:x}".format(layer['ptype']))
+    if layer['oper'] == 1:
+        print("OPER: request")
+    elif layer['oper'] == 2:
+        print("OPER: reply")
+    print("SHA: {}".format(eth_render.mac(layer['sha'])))
+    print("SPA: {}".format(eth_render.ipv4(layer['spa'])))
+    print("THA: {}".format(eth_render.mac(layer['tha'])))
+    print("TPA: {}".format(eth_render.ipv4(layer['tpa'])))
+    return
+
+def _ipv6_printer(layer):
+    next_headers = layer['next_headers']
+    print("PAYLOAD_LENGTH: {}".format(layer['payload_length']))
+    print("NEXT_HEADER: {}".format(next_headers[0][1]))
+    print("HOP_LIMIT: {}".format(layer['hop_limit']))
+    print("SOURCE_IP: {}".format(eth_render.ipv6(layer['src_ip'])))
+    print("DEST_IP: {}".format(eth_render.ipv6(layer['dest_ip'])))
+    for _type, nhstr in next_headers[1:]:
+        print("NEXT_HEADER: {}".format(nhstr))
+    return
+
+def _fcs_printer(layer):
+    if layer['fcs'] is not None:
+        print("CRC32: 0x{}".format(layer['fcs'].hex()))
+    else:
+        print("CRC32: (truncated)")
+    return
+
+def _raw_printer(layer):
+    if layer['parent'] == 'ipv4' and layer['name'].endswith(' fragment'):
+        print("IPv4 fragment, {} bytes (not reassembled)".format(len(layer['data'])))
+    elif layer['parent'] != 'eth':
+        print("No decoder for {}".format(layer['name']))
+    elif layer['type'] == ETHERTYPE_WOL:
+        print("TODO: WOL decoder")
+    else:
+        print("I'm not writing a decoder for this")
+    return
+
+_printers = {
+    'eth': _eth_printer,
+    'arp': _arp_printer,
+    'ipv4': _ipv4_printer,
+    'ipv6': _ipv6_printer,
+    'icmp': _icmp_printer,
+    'icmpv6': _icmpv6_printer,
+    'udp': _udp_printer,
+    'tcp': _tcp_printer,
+    'fcs': _fcs_printer,
+    'raw': _raw_printer,
+}
+
+def _generic_printer(layer):
+    for key, val in layer.items():
+        if key == 'errors':
+            continue
+        if isinstance(val, (bytes, bytearray, memoryview)):
+            val = eth_render.hexdump(val)
+        print("{}: {}".format(key.upper(), val))
+    return
+
+def register_printer(name, printer):
+    """Use printer(layer) to print layers named 'name' in print_record().
+    Layers without a registered printer are printed field by field."""
+    _printers[name] = printer
+    return
+
+def print_record(rec):
+    """Print a record returned by decode_record() in human-readable form."""
+    for err in rec['errors']:
+        print(err)
+    for name in rec['layers']:
+        layer = rec[name]
+        _print_errors(layer)
+        _printers.get(name, _generic_printer)(layer)
+    return
+
+def decode(pkt, verify=False, fcs=False):
+    """Decode and print packet 'pkt'.  If 'verify', also check its checksums
+    (and its Ethernet FCS if 'fcs') with eth_check."""
+    rec = decode_record(pkt)
+    print_record(rec)
+    if verify:
+        import eth_check
+        eth_check.print_checks(eth_check.verify(pkt, rec, fcs=fcs))
+    return
+
+def freeze_record(rec):
+    """Replace the memoryview slices in record 'rec' with bytes so the record
+    no longer refers to the packet buffer (e.g. to pickle or keep it).
+    Returns 'rec'."""
+    for name in rec['layers']:
+        layer = rec[name]
+        for key, val in layer.items():
+            if isinstance(val, memoryview):
+                layer[key] = val.tobytes()
+    return rec
+
+def _decode_chunk(chunk, render, verify, fcs):
+    """Process pool worker: decode a list of (timestamp, pkt)."""
+    out = []
+    if render:
+        import io
+        import contextlib
+        for timestamp, pkt in chunk:
+            sio = io.StringIO()
+            with contextlib.redirect_stdout(sio):
+                decode(pkt, verify=verify, fcs=fcs)
+            out.append((timestamp, sio.getvalue()))
+    else:
+        for timestamp, pkt in chunk:
+            out.append((timestamp, freeze_record(decode_record(pkt))))
+    return out
+
+def _chunks(frames, chunk_size):
+    chunk = []
+    for frame in frames:
+        chunk.append(frame)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+    return
+
+def read_frames(filename, fmt='pcap'):
+    """Yield (timestamp, frame) for every frame in 'filename'.
+    'fmt' is one of:
+        'pcap'  pcap or pcapng capture (see pcap.read)
+        'gmii'  raw MAC-side byte stream split on the preamble/SFD
+                (see find_frames); timestamps are None
+        'hex'   text hex dump (see eth_hex.read)"""
+    if fmt == 'pcap':
+        import pcap
+        yield from pcap.read_file(filename)
+    elif fmt == 'gmii':
+        for frame in find_frames_file(filename):
+            yield (None, frame)
+    elif fmt == 'hex':
+        import eth_hex
+        yield from eth_hex.read_file(filename)
+    else:
+        raise ValueError("Unknown frame file format '{}'".format(fmt))
+    return
+
+def decode_file(filename, workers=None, chunk_size=1024, render=False, verify=False, fcs=False, pkt_filter=None, fmt='pcap',
+                defrag=False):
+    """Decode every frame in file 'filename' (in format 'fmt'; see
+    read_frames) across 'workers' processes (default: one per CPU).  Frames are read here and sent to the
+    workers in chunks of 'chunk_size'; at most two chunks per worker are in
+    flight at once so memory stays bounded.
+    Yields (timestamp, record) in capture order, or (timestamp, text) with
+    the printed decode (see decode()) if 'render' is True.  Records are
+    frozen (see freeze_record).
+    'pkt_filter' is an eth_filter expression (or a predicate on the raw
+    frame); frames that don't match are dropped before decoding.
+    If 'defrag', IPv4 fragments are reassembled (see eth_frag) before
+    filtering and decoding."""
+    import collections
+    import concurrent.futures
+    if workers is None:
+        workers = os.cpu_count() or 1
+    frames = read_frames(filename, fmt)
+    if defrag:
+        import eth_frag
+        frames = eth_frag.Reassembler().stream(frames)
+    if pkt_filter is not None:
+        if isinstance(pkt_filter, str):
+            import eth_filter
+            pkt_filter = eth_filter.compile_filter(pkt_filter)
+        frames = (frame for frame in frames if pkt_filter(frame[1]))
+    if workers <= 1:
+        for chunk in _chunks(frames, chunk_size):
+            yield from _decode_chunk(chunk, render, verify, fcs)
+        return
+    max_pending = 2*workers
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+        for chunk in _chunks(frames, chunk_size):
+            # Views into a memory-mapped file can't be pickled
+            chunk = [(timestamp, bytes(pkt)) if isinstance(pkt, memoryview) else (timestamp, pkt) for timestamp, pkt in chunk]
+            pending.append(pool.submit(_decode_chunk, chunk, render, verify, fcs))
+            if len(pending) >= max_pending:
+                # Wait for the oldest chunk before reading any more
+                yield from pending.popleft().result()
+        while len(pending) > 0:
+            yield from pending.popleft().result()
+    return
+
+def parse_hex_args(args):
+    """Bytes from command-line hex tokens, one byte per token ('08', '8' or
+    '0x08'); an argument may hold several space-separated tokens."""
     lhex = []
-    for arg in argv[1:]:
+    for arg in args:
         lhex.extend(arg.split())
-    pkt = [int(x, 16) for x in lhex]
-    decode(pkt)
+    try:
+        # Keep the tokens apart so unpadded ones can't run into each other
+        return bytes.fromhex(' '.join(lhex))
+    except ValueError:
+        # Single-digit or 0x-prefixed bytes
+        return bytes([int(x, 16) for x in lhex])
+
+def doPktDecode(argv, verify=False, fcs=False):
+    pkt = parse_hex_args(argv[1:])
+    decode(pkt, verify=verify, fcs=fcs)
+
+def doFileDecode(filename, fmt='pcap', verify=False, fcs=False, workers=1, pkt_filter=None, out_fmt='text', output=None,
+                 defrag=False):
+    try:
+        if out_fmt != 'text':
+            import eth_out
+            with eth_out.open_sink(out_fmt, output) as sink:
+                eth_out.write_all(sink, decode_file(filename, workers=workers, pkt_filter=pkt_filter, fmt=fmt, defrag=defrag))
+            return
+        n = 0
+        for timestamp, text in decode_file(filename, workers=workers, render=True, verify=verify, fcs=fcs, pkt_filter=pkt_filter,
+                                           fmt=fmt, defrag=defrag):
+            print("================ Packet {} (t = {}) ================".format(n, timestamp))
+            print(text, end="")
+            n += 1
+    except BrokenPipeError:
+        # Reader went away (e.g. '| head'); stop quietly
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    return
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Decode ethernet packets from hex bytes or a capture file.")
+    parser.add_argument('--pcap', default=None, help="Decode every frame in this pcap/pcapng file")
+    parser.add_argument('--gmii', default=None, help="Decode every frame in this raw GMII byte stream (frames delimited by preamble/SFD)")
+    parser.add_argument('--hex', default=None, help="Decode every frame in this text hex dump (one frame per line, hexdump/od/xxd or K12 text)")
+    parser.add_argument('--stream', default=None, nargs='?', const='-', metavar='PATH',
+                        help="Decode frames streamed on stdin (or this named pipe) as they arrive")
+    parser.add_argument('--stream-format', default='auto', choices=('auto', 'pcap', 'len'),
+                        help="Stream framing: pcap/pcapng, or 32-bit big-endian length prefixes")
+    parser.add_argument('-j', '--workers', default=1, type=int, help="Decode a capture file across this many processes")
+    parser.add_argument('-f', '--filter', default=None, help="Only decode frames matching this eth_filter expression (e.g. 'udp.dport==50006')")
+    parser.add_argument('--format', default='text', choices=('text', 'jsonl', 'csv', 'columnar'), help="Output format for capture files")
+    parser.add_argument('-o', '--output', default=None, help="Output file (directory for --format columnar); default stdout")
+    parser.add_argument('--defrag', default=False, action='store_true', help="Reassemble fragmented IPv4 datagrams before decoding")
+    parser.add_argument('--verify', default=False, action='store_true', help="Verify IP/UDP/ICMP checksums (text output only)")
+    parser.add_argument('--fcs', default=False, action='store_true', help="Frames end with an Ethernet FCS; verify it too (text output only)")
+    parser.add_argument('bytes', default=None, help="Packet bytes in hex", nargs='*')
+    args = parser.parse_args()
+    if args.format != 'text' and (args.verify or args.fcs):
+        # The records written by the other formats don't carry check results
+        parser.error("--verify and --fcs only apply to --format text")
+    if args.pcap is not None:
+        doFileDecode(args.pcap, 'pcap', verify=args.verify, fcs=args.fcs, workers=args.workers, pkt_filter=args.filter,
+                     out_fmt=args.format, output=args.output, defrag=args.defrag)
+    elif args.gmii is not None:
+        doFileDecode(args.gmii, 'gmii', verify=args.verify, fcs=args.fcs, workers=args.workers, pkt_filter=args.filter,
+                     out_fmt=args.format, output=args.output, defrag=args.defrag)
+    elif args.hex is not None:
+        doFileDecode(args.hex, 'hex', verify=args.verify, fcs=args.fcs, workers=args.workers, pkt_filter=args.filter,
+                     out_fmt=args.format, output=args.output, defrag=args.defrag)
+    elif args.stream is not None:
+        import eth_stream
+        eth_stream.decode_stream(args.stream, args.stream_format, out_fmt=args.format, output=args.output,
+                                 verify=args.verify, fcs=args.fcs, pkt_filter=args.filter, defrag=args.defrag)
+    else:
+        doPktDecode([None] + args.bytes, verify=args.verify, fcs=args.fcs)
+    return
 
 if __name__ == "__main__":
-    import sys
-    doPktDecode(sys.argv)
+    main()
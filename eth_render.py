@@ -0,0 +1,85 @@
+#! /usr/bin/python3
+
+# Text formatting of packet fields (addresses, payloads)
+#
+# Shared by the eth_pkt printers and by bulk export (eth_out, eth_flow).
+# Everything here takes bytes-like input (bytes, bytearray, memoryview) and
+# formats it with table lookups or bytes.hex() instead of one str.format()
+# per byte.
+
+# '00'..'ff', '0'..'ff' and '0'..'255' for every byte value
+HEX = tuple(["{:02x}".format(n) for n in range(256)])
+HEX_NOPAD = tuple(["{:x}".format(n) for n in range(256)])
+DEC = tuple([str(n) for n in range(256)])
+
+_IPV6_BYTES = 16
+
+def mac(addr, sep=':'):
+    """'02:00:00:00:ca:fe'"""
+    return addr.hex(sep)
+
+def ipv4(addr):
+    """'192.168.7.1'"""
+    return '.'.join([DEC[x] for x in addr])
+
+def _ipv6_group(hi, lo):
+    if hi == 0:
+        return HEX_NOPAD[lo]
+    return HEX_NOPAD[hi] + HEX[lo]
+
+def ipv6(addr):
+    """Compressed IPv6 text form (RFC 5952): lower case, no leading zeros,
+    the longest run of two or more zero groups (the first, on a tie)
+    replaced by '::', and IPv4-mapped addresses as '::ffff:a.b.c.d'."""
+    b = bytes(addr)
+    if len(b) != _IPV6_BYTES:
+        raise ValueError("IPv6 address must be {} bytes (got {})".format(_IPV6_BYTES, len(b)))
+    if b[:10] == b'\x00'*10 and b[10:12] == b'\xff\xff':
+        return '::ffff:' + ipv4(b[12:])
+    groups = [_ipv6_group(b[n], b[n+1]) for n in range(0, _IPV6_BYTES, 2)]
+    # Find the longest run of '0' groups
+    best_start = -1
+    best_len = 1
+    run_start = -1
+    for n, group in enumerate(groups):
+        if group == '0':
+            if run_start < 0:
+                run_start = n
+            if n - run_start + 1 > best_len:
+                best_start = run_start
+                best_len = n - run_start + 1
+        else:
+            run_start = -1
+    if best_start < 0:
+        return ':'.join(groups)
+    return ':'.join(groups[:best_start]) + '::' + ':'.join(groups[best_start + best_len:])
+
+def ip(addr):
+    """IPv4 or IPv6 address, by its length."""
+    if len(addr) == 4:
+        return ipv4(addr)
+    return ipv6(addr)
+
+def hexdump(data, sep=' ', group=1):
+    """Bytes as hex, e.g. '00 01 02'.  'group' bytes are written together
+    between separators; sep='' gives one unbroken string."""
+    if len(sep) == 0:
+        return data.hex()
+    return data.hex(sep, group)
+
+def mac_int(value):
+    """MAC address from an integer (e.g. an eth_out/decode_batch column)."""
+    return mac(int(value).to_bytes(6, 'big'))
+
+def ipv4_int(value):
+    """IPv4 address from an integer (e.g. a decode_batch column)."""
+    return ipv4(int(value).to_bytes(4, 'big'))
+
+if __name__ == "__main__":
+    import sys
+    for arg in sys.argv[1:]:
+        addr = bytes.fromhex(arg.replace(':', ''))
+        if len(addr) == 6:
+            print(mac(addr))
+        else:
+            print(ip(addr))
@@ -0,0 +1,138 @@
+#! /usr/bin/python3
+
+# Live decoding of frames streamed over stdin or a named pipe
+#
+# Lets eth_pkt run as one long-lived filter process instead of being started
+# once per frame.  Two stream formats are accepted:
+#   'pcap'  A classic pcap or pcapng stream (e.g. 'tcpdump -w -')
+#   'len'   Each frame as a 32-bit big-endian byte count followed by the
+#           frame's bytes (see write_length_prefixed)
+#   'auto'  Decide from the first byte of the stream (pcap magic numbers never
+#           start with 0x00; a length prefix always does)
+# Frames are read one at a time into a fixed buffer, so memory use is bounded
+# by 'max_frame' however fast the producer is, and each decoded frame is
+# flushed to the output as soon as it's done.
+#
+# Usage:
+#   capture_helper | python3 eth_pkt.py --stream
+#   mkfifo /tmp/frames; python3 eth_pkt.py --stream /tmp/frames --format jsonl
+
+import struct
+import sys
+
+import eth_pkt as ep
+
+class StreamError(Exception):
+    pass
+
+LEN_PREFIX = struct.Struct('!I')
+# Bigger than any Ethernet frame, jumbo or not
+MAX_FRAME_SIZE = 0x40000
+
+def _read_into(fd, mv, n):
+    """Fill mv[:n] from 'fd'.  Returns False at a clean end of stream."""
+    got = 0
+    while got < n:
+        count = fd.readinto(mv[got:n])
+        if not count:
+            if got == 0:
+                return False
+            raise StreamError("Stream ended {} bytes into a {} byte read".format(got, n))
+        got += count
+    return True
+
+def read_length_prefixed(fd, max_frame=MAX_FRAME_SIZE):
+    """Yield (None, frame) for every length-prefixed frame in binary stream
+    'fd'.  Frames are read into one preallocated buffer of 'max_frame'
+    bytes and yielded as bytes; a longer frame raises StreamError."""
+    buf = bytearray(max(max_frame, LEN_PREFIX.size))
+    mv = memoryview(buf)
+    while True:
+        if not _read_into(fd, mv, LEN_PREFIX.size):
+            return
+        length = LEN_PREFIX.unpack_from(buf)[0]
+        if length > max_frame:
+            raise StreamError("Frame length {} exceeds the {} byte limit".format(length, max_frame))
+        if length > 0 and not _read_into(fd, mv, length):
+            raise StreamError("Stream ended before a {} byte frame".format(length))
+        yield (None, bytes(mv[:length]))
+
+def write_length_prefixed(fd, frame):
+    """Write one frame to binary stream 'fd' in the 'len' stream format."""
+    fd.write(LEN_PREFIX.pack(len(frame)))
+    fd.write(frame)
+    return
+
+def guess_format(fd):
+    """Peek at the first byte of buffered binary stream 'fd' (without
+    consuming it) and return 'len' or 'pcap'."""
+    first = fd.peek(1)[:1]
+    if first == b'\x00':
+        return 'len'
+    return 'pcap'
+
+def read(fd, fmt='auto', max_frame=MAX_FRAME_SIZE):
+    """Yield (timestamp, frame) from binary stream 'fd' in format 'fmt'."""
+    if fmt == 'auto':
+        fmt = guess_format(fd)
+    if fmt == 'len':
+        yield from read_length_prefixed(fd, max_frame)
+    elif fmt == 'pcap':
+        import pcap
+        yield from pcap.read(fd)
+    else:
+        raise ValueError("Unknown stream format '{}'".format(fmt))
+    return
+
+def _open(path):
+    if path is None or path == '-':
+        return sys.stdin.buffer
+    # A named pipe blocks here until a writer opens it
+    return open(path, 'rb')
+
+def decode_stream(path=None, fmt='auto', out_fmt='text', output=None, verify=False, fcs=False,
+                  pkt_filter=None, defrag=False):
+    """Decode every frame streamed on 'path' (stdin if None or '-') until
+    the stream ends, writing each one to 'output' as soon as it's decoded.
+    The other arguments are as for eth_pkt.decode_file and
+    eth_pkt.doFileDecode."""
+    fd = _open(path)
+    frames = read(fd, fmt)
+    if defrag:
+        import eth_frag
+        frames = eth_frag.Reassembler().stream(frames)
+    if pkt_filter is not None:
+        if isinstance(pkt_filter, str):
+            import eth_filter
+            pkt_filter = eth_filter.compile_filter(pkt_filter)
+        frames = (frame for frame in frames if pkt_filter(frame[1]))
+    try:
+        if out_fmt == 'text':
+            for n, (timestamp, pkt) in enumerate(frames):
+                print("================ Packet {} (t = {}) ================".format(n, timestamp))
+                ep.decode(pkt, verify=verify, fcs=fcs)
+                sys.stdout.flush()
+        else:
+            import eth_out
+            with eth_out.open_sink(out_fmt, output) as sink:
+                for timestamp, pkt in frames:
+                    sink.write_batch([(timestamp, ep.decode_record(pkt))])
+                    sink.flush()
+    except KeyboardInterrupt:
+        # Ctrl-C is the usual way to stop a live decode
+        pass
+    except BrokenPipeError:
+        # Reader went away (e.g. '| head'); stop quietly
+        import os
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        if fd is not sys.stdin.buffer:
+            fd.close()
+    return
+
+if __name__ == "__main__":
+    # Convert a capture file to the length-prefixed stream format on stdout
+    out = sys.stdout.buffer
+    for timestamp, frame in ep.read_frames(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else 'pcap'):
+        write_length_prefixed(out, frame)
+    out.flush()
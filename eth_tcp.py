@@ -0,0 +1,381 @@
+#! /usr/bin/python3
+
+# TCP byte-stream reassembly for eth_pkt
+#
+# Each direction of a connection is a stream, keyed like eth_flow.flow_key:
+# (src_ip, dest_ip, IP_PROTOCOL_TCP, src_port, dest_port).  Segment data that
+# arrives in sequence is handed straight back; data that arrives early is
+# parked in a fixed-size ring buffer (one per stream, 'window' bytes, taken
+# from a pool that never grows past 'max_bytes') until the gap in front of it
+# fills.  Retransmitted bytes are dropped.  A gap that never fills (a frame
+# the capture missed) is skipped once the ring is full, the pool runs dry or
+# the stream ends, so a lossy capture costs bytes, not memory; the skipped
+# byte count is reported.  Streams end on FIN (once every byte before it has
+# arrived) or RST, after 'timeout' seconds idle, or least recently seen first
+# when more than 'max_streams' are open.
+#
+# Usage:
+#   import eth_tcp, pcap
+#   tcp = eth_tcp.Reassembler(on_close=lambda key, stats: print(key, stats))
+#   for timestamp, key, offset, data in tcp.stream(pcap.read_file("capture.pcap")):
+#       consume(key, offset, data)      # 'offset' is the byte's position in the stream
+#
+#   python3 eth_tcp.py capture.pcap [-o outdir]
+
+import collections
+
+import eth_pkt as ep
+import eth_render
+
+# Sequence numbers are 32 bits and wrap
+_SEQ_MOD = 1 << 32
+_SEQ_HALF = 1 << 31
+
+def _merge_range(ranges, start, end):
+    """Merge [start, end) into sorted, non-overlapping list 'ranges'."""
+    out = []
+    placed = False
+    for r_start, r_end in ranges:
+        if r_end < start:
+            out.append((r_start, r_end))
+        elif end < r_start:
+            if not placed:
+                out.append((start, end))
+                placed = True
+            out.append((r_start, r_end))
+        else:
+            start = min(start, r_start)
+            end = max(end, r_end)
+    if not placed:
+        out.append((start, end))
+        out.sort()
+    return out
+
+class _Stream():
+    __slots__ = ('next_seq', 'offset', 'ring', 'head', 'ranges', 'fin_seq',
+                 'first_seen', 'last_seen', 'packets', 'gap_bytes', 'dup_bytes')
+
+    def __init__(self, next_seq, timestamp):
+        self.next_seq = next_seq    # Sequence number of the next byte to deliver
+        self.offset = 0             # Stream offset of next_seq
+        self.ring = None            # Early data, once there is some
+        self.head = 0               # Ring index of next_seq
+        self.ranges = []            # Sorted [start, end) of early data, relative to next_seq
+        self.fin_seq = None
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.packets = 0
+        self.gap_bytes = 0          # Never seen (skipped)
+        self.dup_bytes = 0          # Seen more than once (dropped)
+
+class Reassembler():
+    """Reassemble the byte streams of TCP connections.
+    'window' is the size of each stream's ring buffer for data that arrives
+    ahead of a gap; 'max_bytes' caps the memory held in ring buffers across
+    all streams; 'timeout' is how long (seconds, in capture time) a stream
+    may sit idle before it's closed; 'max_streams' caps the number of open
+    streams.  on_close(key, stats) is called when a stream ends, with
+    stats['end'] one of 'fin', 'rst', 'idle', 'evicted' or 'flush'.
+    Counters: 'closed', 'timed_out', 'evicted' (streams closed to stay under
+    'max_streams') and 'forced' (gaps skipped to free a ring buffer)."""
+    def __init__(self, window=0x10000, max_bytes=64*0x10000, timeout=60.0, max_streams=65536, on_close=None):
+        self.window = window
+        self.max_rings = max(1, max_bytes // window)
+        self.timeout = timeout
+        self.max_streams = max_streams
+        self.on_close = on_close
+        # key -> _Stream, least recently seen first
+        self._streams = collections.OrderedDict()
+        self._free = []
+        self._nrings = 0
+        self.closed = 0
+        self.timed_out = 0
+        self.evicted = 0
+        self.forced = 0
+
+    def __len__(self):
+        return len(self._streams)
+
+    # ===== Ring buffer =====
+
+    def _ring(self, out):
+        """A free ring buffer.  When the pool is used up, the least recently
+        seen stream holding one gives it up (skipping its gaps)."""
+        if len(self._free) > 0:
+            return self._free.pop()
+        if self._nrings < self.max_rings:
+            self._nrings += 1
+            return bytearray(self.window)
+        for key, st in self._streams.items():
+            if st.ring is not None:
+                self.forced += 1
+                self._drain(key, st, out)
+                return self._free.pop()
+        raise RuntimeError("No TCP ring buffer to reuse")
+
+    def _park(self, st, rel, data):
+        """Copy 'data' into the ring at 'rel' bytes past next_seq."""
+        window = self.window
+        pos = (st.head + rel) % window
+        n = len(data)
+        first = min(n, window - pos)
+        st.ring[pos:pos+first] = data[:first]
+        if n > first:
+            st.ring[:n-first] = data[first:]
+        st.ranges = _merge_range(st.ranges, rel, rel + n)
+        return
+
+    def _unpark(self, st, n):
+        """Bytes [0, n) past next_seq from the ring."""
+        window = self.window
+        pos = st.head
+        first = min(n, window - pos)
+        if n > first:
+            return bytes(st.ring[pos:]) + bytes(st.ring[:n-first])
+        return bytes(st.ring[pos:pos+n])
+
+    def _advance(self, st, n):
+        st.next_seq = (st.next_seq + n) % _SEQ_MOD
+        st.offset += n
+        st.head = (st.head + n) % self.window
+        if len(st.ranges) > 0:
+            ranges = []
+            for start, end in st.ranges:
+                if end > n:
+                    ranges.append((max(start - n, 0), end - n))
+            st.ranges = ranges
+        return
+
+    def _release(self, st):
+        if st.ring is not None and len(st.ranges) == 0:
+            self._free.append(st.ring)
+            st.ring = None
+        return
+
+    # ===== Delivery =====
+
+    def _deliver_parked(self, key, st, out):
+        """Deliver early data that's now in sequence."""
+        while len(st.ranges) > 0 and st.ranges[0][0] == 0:
+            n = st.ranges[0][1]
+            out.append((key, st.offset, self._unpark(st, n)))
+            self._advance(st, n)
+        self._release(st)
+        return
+
+    def _skip_gap(self, st):
+        """Give up on the bytes missing in front of the first parked range."""
+        gap = st.ranges[0][0]
+        st.gap_bytes += gap
+        self._advance(st, gap)
+        return
+
+    def _drain(self, key, st, out):
+        """Deliver everything parked, skipping any gaps."""
+        while len(st.ranges) > 0:
+            self._skip_gap(st)
+            self._deliver_parked(key, st, out)
+        self._release(st)
+        return
+
+    def _close(self, key, st, end, out):
+        self._drain(key, st, out)
+        del self._streams[key]
+        self.closed += 1
+        if self.on_close is not None:
+            self.on_close(key, {
+                'end': end,
+                'packets': st.packets,
+                'bytes': st.offset - st.gap_bytes,
+                'gap_bytes': st.gap_bytes,
+                'dup_bytes': st.dup_bytes,
+                'first': st.first_seen,
+                'last': st.last_seen,
+            })
+        return
+
+    def expire(self, now, out=None):
+        """Close every stream idle for more than 'timeout' seconds before
+        'now'.  Returns the data delivered as (key, offset, data)."""
+        if out is None:
+            out = []
+        while len(self._streams) > 0:
+            key, st = next(iter(self._streams.items()))
+            if now - st.last_seen <= self.timeout:
+                break
+            self.timed_out += 1
+            self._close(key, st, 'idle', out)
+        return out
+
+    def flush(self):
+        """Close every open stream (e.g. at the end of a capture).  Returns
+        the data delivered as (key, offset, data)."""
+        out = []
+        while len(self._streams) > 0:
+            key, st = next(iter(self._streams.items()))
+            self._close(key, st, 'flush', out)
+        return out
+
+    # ===== Input =====
+
+    def feed_record(self, rec, timestamp=None):
+        """Offer one decoded record (see eth_pkt.decode_record).  Returns a
+        list of (key, offset, data) for the stream bytes now in sequence,
+        usually none or one entry.  'data' is bytes; 'offset' is the
+        position of its first byte in the stream."""
+        out = []
+        if timestamp is not None:
+            self.expire(timestamp, out)
+        else:
+            timestamp = 0.0
+        tcp = rec.get('tcp')
+        if tcp is None:
+            return out
+        ip = rec.get('ipv4')
+        if ip is None:
+            ip = rec.get('ipv6')
+        key = (bytes(ip['src_ip']), bytes(ip['dest_ip']), ep.IP_PROTOCOL_TCP, tcp['src_port'], tcp['dest_port'])
+        flags = tcp['flags']
+        seq = tcp['seq']
+        data = tcp['data']
+        st = self._streams.get(key)
+        if st is not None and flags & ep.TCP_FLAG_SYN and st.offset == 0 and len(st.ranges) == 0:
+            # Repeated SYN before any data; start over from it
+            st.next_seq = (seq + 1) % _SEQ_MOD
+        if st is None:
+            if flags & ep.TCP_FLAG_RST or (len(data) == 0 and not flags & ep.TCP_FLAG_SYN):
+                # Nothing to start a stream with (e.g. a bare ACK, or a
+                # retransmitted FIN after the stream closed)
+                return out
+            if len(self._streams) >= self.max_streams:
+                old_key, old = next(iter(self._streams.items()))
+                self.evicted += 1
+                self._close(old_key, old, 'evicted', out)
+            # The SYN takes up one sequence number; without one, pick the
+            # stream up wherever the capture joined it
+            st = _Stream((seq + 1) % _SEQ_MOD if flags & ep.TCP_FLAG_SYN else seq, timestamp)
+            self._streams[key] = st
+        else:
+            self._streams.move_to_end(key)
+        st.packets += 1
+        st.last_seen = timestamp
+        if flags & ep.TCP_FLAG_SYN:
+            seq = (seq + 1) % _SEQ_MOD
+        if flags & ep.TCP_FLAG_FIN:
+            st.fin_seq = (seq + len(data)) % _SEQ_MOD
+        rel = (seq - st.next_seq) % _SEQ_MOD
+        if rel >= _SEQ_HALF:
+            # Starts before next_seq: drop what we've already had
+            skip = _SEQ_MOD - rel
+            st.dup_bytes += min(skip, len(data))
+            data = data[skip:]
+            rel = 0
+        if len(data) > 0:
+            if rel == 0:
+                out.append((key, st.offset, bytes(data)))
+                self._advance(st, len(data))
+                self._deliver_parked(key, st, out)
+            else:
+                self._early(key, st, rel, data, out)
+        if flags & ep.TCP_FLAG_RST:
+            self._close(key, st, 'rst', out)
+        elif st.fin_seq is not None and st.fin_seq == st.next_seq:
+            self._close(key, st, 'fin', out)
+        return out
+
+    def _early(self, key, st, rel, data, out):
+        """Handle data that starts 'rel' bytes past next_seq."""
+        # Make room: give up on gaps until the data fits in the window
+        start = st.offset + rel
+        while start + len(data) > st.offset + self.window and len(st.ranges) > 0:
+            self._skip_gap(st)
+            self._deliver_parked(key, st, out)
+        rel = start - st.offset
+        if rel < 0:
+            # Partly delivered from the ring on the way
+            st.dup_bytes += min(-rel, len(data))
+            data = data[-rel:]
+            rel = 0
+        elif rel + len(data) > self.window:
+            # Still doesn't fit: give up on everything in front of it
+            st.gap_bytes += rel
+            self._advance(st, rel)
+            rel = 0
+        if len(data) == 0:
+            return
+        if rel == 0:
+            out.append((key, st.offset, bytes(data)))
+            self._advance(st, len(data))
+            self._deliver_parked(key, st, out)
+            return
+        if st.ring is None:
+            st.ring = self._ring(out)
+        self._park(st, rel, data)
+        return
+
+    def feed(self, pkt, timestamp=None):
+        """Offer one frame; see feed_record."""
+        return self.feed_record(ep.decode_record(pkt), timestamp)
+
+    def stream(self, frames):
+        """Yield (timestamp, key, offset, data) for the stream bytes in
+        iterable 'frames' of (timestamp, frame), in the order they come into
+        sequence, then everything left when 'frames' runs out."""
+        for timestamp, pkt in frames:
+            for key, offset, data in self.feed(pkt, timestamp):
+                yield (timestamp, key, offset, data)
+        for key, offset, data in self.flush():
+            yield (None, key, offset, data)
+        return
+
+def _stream_name(key):
+    src, dest, protocol, sport, dport = key
+    return "{}.{}-{}.{}".format(eth_render.ip(src), sport, eth_render.ip(dest), dport)
+
+def main():
+    import argparse
+    import os
+    parser = argparse.ArgumentParser(description="Reassemble the TCP streams in a capture.")
+    parser.add_argument('filename', help="Capture file")
+    parser.add_argument('--fmt', default='pcap', choices=('pcap', 'gmii', 'hex'), help="Capture file format")
+    parser.add_argument('-o', '--outdir', default=None, help="Write each stream's bytes to a file in this directory")
+    parser.add_argument('--max-bytes', default=64*0x10000, type=int, help="Memory budget for out-of-order data")
+    parser.add_argument('--timeout', default=60.0, type=float, help="Close streams idle for this many seconds")
+    args = parser.parse_args()
+    files = {}
+    ended = []
+    def on_close(key, stats):
+        print("{}: {} packets, {} bytes, {} bytes missing, {} bytes repeated, ended by {}".format(
+            _stream_name(key), stats['packets'], stats['bytes'], stats['gap_bytes'], stats['dup_bytes'], stats['end']))
+        ended.append(key)
+        return
+    def write(chunks):
+        # A stream's last bytes come back in the same batch as its on_close()
+        for key, offset, data in chunks:
+            if args.outdir is None:
+                continue
+            fd = files.get(key)
+            if fd is None:
+                fd = open(os.path.join(args.outdir, _stream_name(key) + ".bin"), 'wb')
+                files[key] = fd
+            # Leave skipped bytes as zeros so offsets line up
+            fd.seek(offset)
+            fd.write(data)
+        for key in ended:
+            fd = files.pop(key, None)
+            if fd is not None:
+                fd.close()
+        del ended[:]
+        return
+    tcp = Reassembler(max_bytes=args.max_bytes, timeout=args.timeout, on_close=on_close)
+    if args.outdir is not None:
+        os.makedirs(args.outdir, exist_ok=True)
+    for timestamp, pkt in ep.read_frames(args.filename, args.fmt):
+        write(tcp.feed(pkt, timestamp))
+    write(tcp.flush())
+    print("{} streams: {} timed out, {} evicted, {} forced past a gap".format(
+        tcp.closed, tcp.timed_out, tcp.evicted, tcp.forced))
+    return
+
+if __name__ == "__main__":
+    main()
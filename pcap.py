@@ -0,0 +1,205 @@
+#! /usr/bin/python3
+
+# Streaming reader for classic pcap and pcapng capture files.
+# Frames are read one record at a time so memory use does not depend on the
+# size of the capture.
+#
+# Usage:
+#   import pcap
+#   for timestamp, frame in pcap.read_file("capture.pcapng"):
+#       ...
+
+import struct
+
+# == Classic pcap ==
+PCAP_MAGIC_US       = 0xa1b2c3d4
+PCAP_MAGIC_NS       = 0xa1b23c4d
+PCAP_GLOBAL_HEADER_SIZE = 24
+PCAP_RECORD_HEADER_SIZE = 16
+
+# == pcapng ==
+PCAPNG_BLOCK_SHB    = 0x0a0d0d0a    # Section Header Block
+PCAPNG_BLOCK_IDB    = 0x00000001    # Interface Description Block
+PCAPNG_BLOCK_PB     = 0x00000002    # Packet Block (obsolete)
+PCAPNG_BLOCK_SPB    = 0x00000003    # Simple Packet Block
+PCAPNG_BLOCK_EPB    = 0x00000006    # Enhanced Packet Block
+PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+PCAPNG_OPTION_END   = 0
+PCAPNG_OPTION_IF_TSRESOL = 9
+
+# Largest record or block we'll read (libpcap's maximum snapshot length is
+# 256 KiB), so a corrupt length can't make us buffer an arbitrary amount
+MAX_RECORD_SIZE     = 0x40000 + 64
+
+# ===== Link types =====
+LINKTYPE_ETHERNET   = 1
+
+class PcapError(Exception):
+    pass
+
+def _read_exact(fd, n):
+    """Read exactly 'n' bytes from 'fd'.  Returns None at a clean end of file."""
+    data = fd.read(n)
+    if len(data) == n:
+        return data
+    if len(data) == 0:
+        return None
+    # Short reads are legal on pipes; keep going until we have it all
+    chunks = [data]
+    remaining = n - len(data)
+    while remaining > 0:
+        chunk = fd.read(remaining)
+        if len(chunk) == 0:
+            raise PcapError("Truncated capture: wanted {} bytes, got {}".format(n, n - remaining))
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+def _read_pcap(fd, header):
+    """Yield (timestamp, frame) from a classic pcap stream whose 4-byte magic
+    has already been consumed into 'header'."""
+    header += _read_exact(fd, PCAP_GLOBAL_HEADER_SIZE - 4) or b''
+    if len(header) < PCAP_GLOBAL_HEADER_SIZE:
+        raise PcapError("Truncated pcap global header")
+    magic = struct.unpack('<I', header[:4])[0]
+    if magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+        endian = '<'
+    else:
+        endian = '>'
+        magic = struct.unpack('>I', header[:4])[0]
+    if magic == PCAP_MAGIC_NS:
+        tsunits = 1000000000
+    else:
+        tsunits = 1000000
+    linktype = struct.unpack(endian + 'I', header[20:24])[0] & 0x0fffffff
+    if linktype != LINKTYPE_ETHERNET:
+        raise PcapError("Unsupported link type {}".format(linktype))
+    record = struct.Struct(endian + 'IIII')
+    while True:
+        rhdr = _read_exact(fd, PCAP_RECORD_HEADER_SIZE)
+        if rhdr is None:
+            return
+        ts_sec, ts_frac, incl_len, orig_len = record.unpack(rhdr)
+        if incl_len > MAX_RECORD_SIZE:
+            raise PcapError("Bad pcap record length {}".format(incl_len))
+        data = _read_exact(fd, incl_len)
+        if data is None:
+            raise PcapError("Truncated capture: missing {} byte frame".format(incl_len))
+        yield (ts_sec + ts_frac/tsunits, data)
+
+def _tsunits(options, endian):
+    """Return the timestamp resolution (in ticks per second) from IDB options."""
+    offset = 0
+    while offset + 4 <= len(options):
+        code, length = struct.unpack(endian + 'HH', options[offset:offset+4])
+        if code == PCAPNG_OPTION_END:
+            break
+        if code == PCAPNG_OPTION_IF_TSRESOL and length >= 1:
+            val = options[offset+4]
+            if val & 0x80:
+                return 2**(val & 0x7f)
+            return 10**val
+        offset += 4 + ((length + 3) & ~3)
+    return 1000000
+
+def _interface(interfaces, ifid):
+    """The (linktype, snaplen, tsunits) of interface 'ifid' in this section."""
+    if ifid >= len(interfaces):
+        raise PcapError("Bad pcapng interface id {} ({} interfaces described)".format(ifid, len(interfaces)))
+    return interfaces[ifid]
+
+def _read_pcapng(fd, btype_raw):
+    """Yield (timestamp, frame) from a pcapng stream whose first 4 bytes (the
+    block type of the initial Section Header Block) are in 'btype_raw'."""
+    endian = '<'
+    # Per-interface (linktype, snaplen, tsunits); reset by every section header
+    interfaces = []
+    while True:
+        if btype_raw is None:
+            btype_raw = _read_exact(fd, 4)
+            if btype_raw is None:
+                return
+        hdr = _read_exact(fd, 4)
+        if hdr is None:
+            raise PcapError("Truncated pcapng block header")
+        if struct.unpack('<I', btype_raw)[0] == PCAPNG_BLOCK_SHB:
+            # The byte-order magic follows the length and decides the endianness
+            bom = _read_exact(fd, 4)
+            if bom is None:
+                raise PcapError("Truncated pcapng section header")
+            if struct.unpack('<I', bom)[0] == PCAPNG_BYTE_ORDER_MAGIC:
+                endian = '<'
+            elif struct.unpack('>I', bom)[0] == PCAPNG_BYTE_ORDER_MAGIC:
+                endian = '>'
+            else:
+                raise PcapError("Bad pcapng byte-order magic")
+            blen = struct.unpack(endian + 'I', hdr)[0]
+            if blen < 28 or blen > MAX_RECORD_SIZE:
+                raise PcapError("Bad pcapng section header length {}".format(blen))
+            if _read_exact(fd, blen - 12) is None:
+                raise PcapError("Truncated pcapng section header")
+            interfaces = []
+            btype_raw = None
+            continue
+        btype = struct.unpack(endian + 'I', btype_raw)[0]
+        blen = struct.unpack(endian + 'I', hdr)[0]
+        if blen < 12 or blen & 3 or blen > MAX_RECORD_SIZE:
+            raise PcapError("Bad pcapng block length {}".format(blen))
+        body = _read_exact(fd, blen - 8)
+        if body is None:
+            raise PcapError("Truncated pcapng block")
+        btype_raw = None
+        if btype == PCAPNG_BLOCK_IDB:
+            linktype, _reserved, snaplen = struct.unpack(endian + 'HHI', body[:8])
+            interfaces.append((linktype, snaplen, _tsunits(body[8:-4], endian)))
+        elif btype == PCAPNG_BLOCK_EPB:
+            ifid, ts_hi, ts_lo, cap_len, orig_len = struct.unpack(endian + 'IIIII', body[:20])
+            linktype, snaplen, tsunits = _interface(interfaces, ifid)
+            if linktype != LINKTYPE_ETHERNET:
+                continue
+            yield (((ts_hi << 32) | ts_lo)/tsunits, body[20:20+cap_len])
+        elif btype == PCAPNG_BLOCK_SPB:
+            orig_len = struct.unpack(endian + 'I', body[:4])[0]
+            linktype, snaplen, tsunits = _interface(interfaces, 0)
+            if linktype != LINKTYPE_ETHERNET:
+                continue
+            if snaplen:
+                orig_len = min(orig_len, snaplen)
+            # No timestamp in simple packet blocks
+            yield (None, body[4:4+orig_len])
+        elif btype == PCAPNG_BLOCK_PB:
+            ifid, drops, ts_hi, ts_lo, cap_len, orig_len = struct.unpack(endian + 'HHIIII', body[:20])
+            linktype, snaplen, tsunits = _interface(interfaces, ifid)
+            if linktype != LINKTYPE_ETHERNET:
+                continue
+            yield (((ts_hi << 32) | ts_lo)/tsunits, body[20:20+cap_len])
+        # Any other block type is skipped
+
+def read(fd):
+    """Yield (timestamp, frame) tuples from binary file object 'fd' holding a
+    classic pcap or pcapng stream.  'timestamp' is in seconds (None if the
+    capture doesn't record one) and 'frame' is a bytes object."""
+    magic = _read_exact(fd, 4)
+    if magic is None:
+        return
+    if struct.unpack('<I', magic)[0] == PCAPNG_BLOCK_SHB:
+        yield from _read_pcapng(fd, magic)
+    elif (struct.unpack('<I', magic)[0] in (PCAP_MAGIC_US, PCAP_MAGIC_NS)) or \
+         (struct.unpack('>I', magic)[0] in (PCAP_MAGIC_US, PCAP_MAGIC_NS)):
+        yield from _read_pcap(fd, magic)
+    else:
+        raise PcapError("Not a pcap or pcapng file (magic = 0x{})".format(magic.hex()))
+
+def read_file(filename):
+    """Yield (timestamp, frame) tuples from capture file 'filename'."""
+    with open(filename, 'rb') as fd:
+        yield from read(fd)
+
+if __name__ == "__main__":
+    import sys
+    nframes = 0
+    nbytes = 0
+    for ts, frame in read_file(sys.argv[1]):
+        nframes += 1
+        nbytes += len(frame)
+    print("{} frames, {} bytes".format(nframes, nbytes))
@@ -4,9 +4,81 @@ test_ipv6_icmp = [0x55, 0x55, 0x55, 0x55, 0x55, 0x55, 0x55, 0xd5, 0x33, 0x33, 0x
 
 import eth_pkt as ep
 
+def _check(name, result, expected):
+    if result == expected:
+        print("PASS: {}".format(name))
+        return 0
+    print("FAIL: {}".format(name))
+    print("    Target: {}".format(expected))
+    print("    Result: {}".format(result))
+    return 1
+
+def testHexArgs():
+    """Command-line hex tokens as eth_pkt.py takes them."""
+    fails = 0
+    arp = bytes(test_ipv4_arp)
+    # Unpadded tokens, as in the ARP example (one argument or one per byte)
+    fails += _check("single-digit tokens", ep.parse_hex_args([' '.join(['{:x}'.format(x) for x in test_ipv4_arp])]), arp)
+    fails += _check("one token per argument", ep.parse_hex_args(['{:x}'.format(x) for x in test_ipv4_arp]), arp)
+    fails += _check("padded tokens", ep.parse_hex_args([arp.hex(' ')]), arp)
+    fails += _check("0x tokens", ep.parse_hex_args(['0x8', '0x06', '0', '1']), b'\x08\x06\x00\x01')
+    rec = ep.decode_record(ep.parse_hex_args(['{:x}'.format(x) for x in test_ipv4_arp]))
+    fails += _check("ARP from single-digit tokens", rec['eth']['ethertype'], ep.ETHERTYPE_ARP)
+    return fails
+
+def testBatch():
+    """decode_batch() agrees with decode_record() on IPv4 and UDP fields,
+    including for fragments and short IPv4 total lengths."""
+    import eth_gen
+    mac_a = bytes.fromhex('020000000001')
+    mac_b = bytes.fromhex('020000000002')
+    ip_a = bytes([10, 0, 0, 1])
+    ip_b = bytes([10, 0, 0, 2])
+    frames = [bytes(test_ipv4_arp[8:]), bytes(test_ipv6_icmp[8:])]
+    buf = bytearray(256)
+    n = eth_gen.build_ipv4_udp(buf, 0, mac_a, mac_b, ip_a, ip_b, 1234, 5678, b'hello')
+    udp = bytes(buf[:n])
+    frames.append(udp)
+    n = eth_gen.build_ipv4_icmp(buf, 0, mac_a, mac_b, ip_a, ip_b, rest=b'ping')
+    frames.append(bytes(buf[:n]))
+    # First fragment (MF set, offset 0) keeps its UDP header
+    frag = bytearray(udp)
+    eth_gen.write_ipv4(frag, 0, ep.IP_PROTOCOL_UDP, 13, ip_a, ip_b, flags_frag=ep.IP_FLAG_MF)
+    frames.append(bytes(frag))
+    # Later fragments carry only payload, whatever it looks like
+    for frag_offset in (1, 185):
+        eth_gen.write_ipv4(frag, 0, ep.IP_PROTOCOL_UDP, 13, ip_a, ip_b, flags_frag=frag_offset)
+        frames.append(bytes(frag))
+    # Total length too short for the UDP header, though the frame isn't
+    short = bytearray(udp)
+    eth_gen.write_ipv4(short, 0, ep.IP_PROTOCOL_UDP, 4, ip_a, ip_b)
+    frames.append(bytes(short))
+    width = max([len(f) for f in frames])
+    import numpy as np
+    rows = np.zeros((len(frames), width), dtype=np.uint8)
+    for row, f in enumerate(frames):
+        rows[row, :len(f)] = np.frombuffer(f, dtype=np.uint8)
+    cols = ep.decode_batch(rows, lengths=[len(f) for f in frames])
+    result = []
+    expected = []
+    for row, f in enumerate(frames):
+        rec = ep.decode_record(f)
+        udp_rec = rec.get('udp')
+        result.append((bool(cols['is_udp'][row]), int(cols['src_port'][row]), int(cols['dest_port'][row]),
+                       int(cols['udp_length'][row])))
+        if udp_rec is None:
+            expected.append((False, 0, 0, 0))
+        else:
+            expected.append((True, udp_rec['src_port'], udp_rec['dest_port'], udp_rec['length']))
+    return _check("decode_batch matches decode_record", result, expected)
+
 if __name__ == "__main__":
     print("============== IPv4 ARP ================")
     ep.decode(test_ipv4_arp)
     print("============== IPv6 ICMP ===============")
     ep.decode(test_ipv6_icmp)
+    print("============== Hex arguments ===========")
+    testHexArgs()
+    print("============== Batch decoding ==========")
+    testBatch()
     pass
@@ -0,0 +1,272 @@
+#! /usr/bin/python3
+
+# Streaming VCD reader that keeps only the signals you ask for
+#
+# Makes one pass over the dump, a line at a time, and only parses value
+# changes for the requested signals; changes to every other signal are
+# skipped after an identifier lookup.  Memory use is the kept signals'
+# columns and nothing else, however big the dump is or however many signals
+# are in it.  Each kept signal is a pair of columns:
+#   times   array('Q') of change times (in the dump's time units)
+#   values  array('B') (up to 8 bits wide) or array('Q') (up to 64 bits)
+# with one entry per change.  x and z bits read as 0.
+#
+# Signals are asked for by their full dotted name ('tb.dut.rxd') or by any
+# trailing part of it ('dut.rxd', 'rxd'), without any [msb:lsb] suffix.
+#
+# Usage:
+#   import vcdread
+#   sigs = vcdread.read("sim.vcd", ["gmii_rx_clk", "gmii_rxd", "gmii_rx_dv"])
+#   rxd = sigs["gmii_rxd"]
+#   print(rxd.name, rxd.width, len(rxd), rxd.value_at(12345))
+#
+#   python3 vcdread.py sim.vcd               # List the signals in the dump
+#   python3 vcdread.py sim.vcd rxd rx_dv     # Read these and summarize them
+
+import bisect
+import re
+from array import array
+
+class VCDError(Exception):
+    pass
+
+# Widest signal a values column can hold
+MAX_WIDTH = 64
+
+_TIMESCALE_UNITS = {
+    's': 1.0,
+    'ms': 1e-3,
+    'us': 1e-6,
+    'ns': 1e-9,
+    'ps': 1e-12,
+    'fs': 1e-15,
+}
+
+# Map x/z bits to 0 so a vector can go through int(_, 2)
+_XZ_TO_ZERO = bytes.maketrans(b'xXzZuUwW-', b'000000000')
+_SCALAR_CHARS = frozenset(b'01xXzZ')
+
+class Signal():
+    """Value changes of one signal: times[n] is when it took values[n].
+    Indexing gives (time, value) tuples, like the lists of changes
+    eth_extract works on."""
+    __slots__ = ('name', 'ident', 'width', 'timescale', 'times', 'values')
+
+    def __init__(self, name, ident, width, timescale=1e-12):
+        self.name = name
+        self.ident = ident
+        self.width = width
+        self.timescale = timescale      # Seconds per time unit
+        self.times = array('Q')
+        self.values = array('B') if width <= 8 else array('Q')
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, n):
+        return (self.times[n], self.values[n])
+
+    def __repr__(self):
+        return "Signal({}, width={}, {} changes)".format(self.name, self.width, len(self.times))
+
+    def append(self, t, value):
+        """Record that the signal took 'value' at time 't' (not before the
+        last change)."""
+        times = self.times
+        if len(times) > 0:
+            if self.values[-1] == value:
+                return
+            if times[-1] == t:
+                # Changed again in the same time step; only the last value counts
+                self.values[-1] = value
+                if len(times) > 1 and self.values[-2] == value:
+                    times.pop()
+                    self.values.pop()
+                return
+        times.append(t)
+        self.values.append(value)
+        return
+
+    def value_at(self, t):
+        """The signal's value at time 't' (None before its first change)."""
+        n = bisect.bisect_right(self.times, t)
+        if n == 0:
+            return None
+        return self.values[n-1]
+
+class _Var():
+    # One $var declaration
+    __slots__ = ('name', 'ident', 'width', 'kind')
+
+    def __init__(self, name, ident, width, kind):
+        self.name = name
+        self.ident = ident
+        self.width = width
+        self.kind = kind
+
+def _parse_timescale(tokens):
+    text = ''.join(tokens)
+    _match = re.match(r"^(\d+)\s*([a-z]+)$", text)
+    if _match is None or _match.group(2) not in _TIMESCALE_UNITS:
+        raise VCDError("Can't parse $timescale '{}'".format(' '.join(tokens)))
+    return int(_match.group(1))*_TIMESCALE_UNITS[_match.group(2)]
+
+def read_header(fd):
+    """Read the declarations from binary stream 'fd' up to and including
+    $enddefinitions.  Returns (variables, timescale) where 'variables' is
+    a list of _Var with dotted names and 'timescale' is in seconds."""
+    variables = []
+    scope = []
+    timescale = 1e-12
+    tokens = []
+    while True:
+        line = fd.readline()
+        if len(line) == 0:
+            raise VCDError("No $enddefinitions in VCD header")
+        tokens.extend(line.decode('ascii', 'replace').split())
+        # Handle each complete $keyword ... $end
+        while len(tokens) > 0:
+            if tokens[0] != '$end' and '$end' not in tokens:
+                break
+            end = tokens.index('$end')
+            keyword, args = tokens[0], tokens[1:end]
+            tokens = tokens[end+1:]
+            if keyword == '$scope':
+                scope.append(args[-1] if len(args) > 0 else '')
+            elif keyword == '$upscope':
+                if len(scope) > 0:
+                    scope.pop()
+            elif keyword == '$var':
+                # $var kind width ident name [range] $end
+                if len(args) < 4:
+                    raise VCDError("Bad $var: {}".format(' '.join(args)))
+                kind, width, ident, name = args[0], int(args[1]), args[2], args[3]
+                variables.append(_Var('.'.join(scope + [name]), ident.encode('ascii'), width, kind))
+            elif keyword == '$timescale':
+                timescale = _parse_timescale(args)
+            elif keyword == '$enddefinitions':
+                return variables, timescale
+    return variables, timescale
+
+def _match_vars(variables, names):
+    """{name: _Var} for each requested name."""
+    matched = {}
+    for name in names:
+        hits = [v for v in variables if v.name == name]
+        if len(hits) == 0:
+            hits = [v for v in variables if v.name.endswith('.' + name)]
+        # The same net seen from several scopes shares one identifier
+        idents = set([v.ident for v in hits])
+        if len(idents) == 0:
+            raise VCDError("No signal '{}' in the dump".format(name))
+        if len(idents) > 1:
+            raise VCDError("'{}' is ambiguous: {}".format(name, ', '.join([v.name for v in hits])))
+        var = hits[0]
+        if var.kind == 'real':
+            raise VCDError("'{}' is a real, not a bit vector".format(name))
+        if var.width > MAX_WIDTH:
+            raise VCDError("'{}' is {} bits wide; at most {} are supported".format(name, var.width, MAX_WIDTH))
+        matched[name] = var
+    return matched
+
+def _vector_value(bits):
+    try:
+        return int(bits, 2)
+    except ValueError:
+        return int(bits.translate(_XZ_TO_ZERO), 2)
+
+def read(filename, signals, start=0, end=None):
+    """Read the value changes of every signal named in 'signals' from VCD
+    file 'filename' (a path or a binary stream).  Changes before 'start'
+    are folded into the value at 'start'; reading stops after time 'end'.
+    Returns {name: Signal}."""
+    if isinstance(filename, str):
+        with open(filename, 'rb') as fd:
+            return read(fd, signals, start, end)
+    fd = filename
+    variables, timescale = read_header(fd)
+    matched = _match_vars(variables, signals)
+    # identifier -> Signal; names that resolve to the same identifier share it
+    wanted = {}
+    out = {}
+    for name, var in matched.items():
+        sig = wanted.get(var.ident)
+        if sig is None:
+            sig = Signal(var.name, var.ident, var.width, timescale)
+            wanted[var.ident] = sig
+        out[name] = sig
+    t = 0
+    for line in fd:
+        c = line[0] if len(line) > 0 else 0
+        if c in _SCALAR_CHARS:
+            ident = line[1:].rstrip()
+            sig = wanted.get(ident)
+            if sig is not None:
+                sig.append(max(t, start), 1 if c == 0x31 else 0)
+                continue
+            if b' ' not in ident and b'\t' not in ident:
+                continue
+        elif c == 0x23:     # '#'
+            try:
+                t = int(line[1:])
+            except ValueError:
+                t = _slow_line(line, t, start, wanted)
+            if end is not None and t > end:
+                break
+            continue
+        elif c in (0x62, 0x42):     # 'b', 'B'
+            parts = line[1:].split()
+            if len(parts) == 2:
+                sig = wanted.get(parts[1])
+                if sig is not None:
+                    sig.append(max(t, start), _vector_value(parts[0]))
+                continue
+        elif c in (0x72, 0x52) or len(line.strip()) == 0:
+            # Reals can't be asked for
+            continue
+        # Keywords ($dumpvars ...), and several changes on one line
+        t = _slow_line(line, t, start, wanted)
+        if end is not None and t > end:
+            break
+    return out
+
+def _slow_line(line, t, start, wanted):
+    """Apply every token on 'line'.  Returns the current time."""
+    tokens = line.split()
+    n = 0
+    while n < len(tokens):
+        tok = tokens[n]
+        c = tok[0]
+        if c == 0x23:
+            t = int(tok[1:])
+        elif c in _SCALAR_CHARS:
+            sig = wanted.get(tok[1:])
+            if sig is not None:
+                sig.append(max(t, start), 1 if c == 0x31 else 0)
+        elif c in (0x62, 0x42, 0x72, 0x52):
+            n += 1
+            if n < len(tokens) and c in (0x62, 0x42):
+                sig = wanted.get(tokens[n])
+                if sig is not None:
+                    sig.append(max(t, start), _vector_value(tok[1:]))
+        # Anything else is a $keyword or $end
+        n += 1
+    return t
+
+def list_signals(filename):
+    """[(name, width)] for every variable declared in VCD file 'filename'."""
+    with open(filename, 'rb') as fd:
+        variables, timescale = read_header(fd)
+    return [(v.name, v.width) for v in variables]
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 3:
+        for name, width in list_signals(sys.argv[1]):
+            print("{} [{}]".format(name, width))
+    else:
+        for name, sig in read(sys.argv[1], sys.argv[2:]).items():
+            if len(sig) > 0:
+                print("{}: {} bits, {} changes from {} to {}".format(sig.name, sig.width, len(sig), sig.times[0], sig.times[-1]))
+            else:
+                print("{}: {} bits, no changes".format(sig.name, sig.width))
@@ -0,0 +1,226 @@
+#! /usr/bin/python3
+
+# Memory-mapped columnar cache of signals read from a VCD
+#
+# Reading a big VCD is slow, so the signals pulled out of it (see vcdread)
+# are saved once to a cache directory and memory-mapped on later runs:
+#   'times.bin'     Every time at which any cached signal changes (uint64,
+#                   ascending); one flat time axis shared by all signals
+#   'sig<n>.bin'    One value column per signal, giving its value at each of
+#                   those times (uint8 up to 8 bits wide, else uint64)
+#   'header.json'   Signal names, widths and files, the row count, timescale
+#                   and the size and mtime of the VCD it came from
+# Opening a cache reads only the header; the columns are mapped, and a
+# window of time is found by binary search on 'times.bin', so only the pages
+# of the window that's read are touched.
+#
+# Usage:
+#   import wavecache
+#   cache = wavecache.load("sim.vcd", ["gmii_rx_clk", "gmii_rxd", "gmii_rx_dv"])
+#   rxd = cache.signal("gmii_rxd", 1000000, 2000000)    # A vcdread.Signal
+#
+#   python3 wavecache.py sim.vcd gmii_rx_clk gmii_rxd gmii_rx_dv   # Build sim.vcd.wave
+
+import json
+import os
+import sys
+from array import array
+
+import vcdread
+
+class CacheError(Exception):
+    pass
+
+CACHE_VERSION = 1
+HEADER_NAME = 'header.json'
+TIMES_NAME = 'times.bin'
+
+def default_path(vcd_path):
+    """Where load() keeps the cache for 'vcd_path'."""
+    return vcd_path + '.wave'
+
+def _source_stamp(path):
+    st = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': st.st_size, 'mtime': st.st_mtime}
+
+def save(dirname, signals, source=None):
+    """Write {name: vcdread.Signal} 'signals' to cache directory 'dirname'.
+    'source' is the VCD they came from (recorded so stale caches can be
+    spotted)."""
+    import numpy as np
+    os.makedirs(dirname, exist_ok=True)
+    # A rebuild in place must not leave the old header behind while the
+    # columns are rewritten: its stamp would still match
+    header_path = os.path.join(dirname, HEADER_NAME)
+    if os.path.exists(header_path):
+        os.remove(header_path)
+    sigs = list(signals.items())
+    if len(sigs) > 0:
+        times = np.unique(np.concatenate([np.asarray(sig.times, dtype=np.uint64) for name, sig in sigs]))
+    else:
+        times = np.zeros(0, dtype=np.uint64)
+    entries = []
+    for n, (name, sig) in enumerate(sigs):
+        sig_times = np.asarray(sig.times, dtype=np.uint64)
+        sig_values = np.asarray(sig.values)
+        # Value in effect at each shared time (0 before the first change)
+        idx = np.searchsorted(sig_times, times, side='right') - 1
+        if len(sig_values) > 0:
+            col = np.where(idx >= 0, sig_values[np.maximum(idx, 0)], 0).astype(sig_values.dtype)
+        else:
+            col = np.zeros(len(times), dtype=sig_values.dtype)
+        filename = 'sig{}.bin'.format(n)
+        col.tofile(os.path.join(dirname, filename))
+        entries.append({
+            'name': name,
+            'vcd_name': sig.name,
+            'width': sig.width,
+            'file': filename,
+            'typecode': sig.values.typecode,
+            'first': int(sig.times[0]) if len(sig) > 0 else None,
+        })
+    times.tofile(os.path.join(dirname, TIMES_NAME))
+    header = {
+        'version': CACHE_VERSION,
+        'rows': len(times),
+        'byteorder': sys.byteorder,
+        'timescale': sigs[0][1].timescale if len(sigs) > 0 else None,
+        'source': _source_stamp(source) if source is not None else None,
+        'signals': entries,
+    }
+    # Header last, and whole or not at all: a cache without one is incomplete
+    with open(header_path + '.tmp', 'w') as fd:
+        json.dump(header, fd, indent=2)
+    os.replace(header_path + '.tmp', header_path)
+    return
+
+class WaveCache():
+    """An opened cache directory.  Columns are memory-mapped on first use."""
+    def __init__(self, dirname):
+        self.dirname = dirname
+        try:
+            with open(os.path.join(dirname, HEADER_NAME), 'r') as fd:
+                self.header = json.load(fd)
+        except (OSError, ValueError) as err:
+            raise CacheError("Can't read cache header in {}: {}".format(dirname, err))
+        if self.header.get('version') != CACHE_VERSION:
+            raise CacheError("{} is cache version {}; expected {}".format(dirname, self.header.get('version'), CACHE_VERSION))
+        self.rows = self.header['rows']
+        self.timescale = self.header['timescale']
+        self._signals = {entry['name']: entry for entry in self.header['signals']}
+        self._endian = '<' if self.header['byteorder'] == 'little' else '>'
+        self._maps = {}
+
+    def names(self):
+        return list(self._signals.keys())
+
+    def has(self, names):
+        return all([name in self._signals for name in names])
+
+    def is_fresh(self, vcd_path):
+        """True if this cache was built from 'vcd_path' as it is now."""
+        source = self.header.get('source')
+        if source is None or not os.path.exists(vcd_path):
+            return False
+        stamp = _source_stamp(vcd_path)
+        return source['size'] == stamp['size'] and source['mtime'] == stamp['mtime']
+
+    def _map(self, filename, typecode):
+        col = self._maps.get(filename)
+        if col is None:
+            import numpy as np
+            dtype = np.dtype(self._endian + typecode)
+            if self.rows == 0:
+                col = np.zeros(0, dtype=dtype)
+            else:
+                col = np.memmap(os.path.join(self.dirname, filename), dtype=dtype, mode='r', shape=(self.rows,))
+            self._maps[filename] = col
+        return col
+
+    @property
+    def times(self):
+        """The shared time column (memory-mapped)."""
+        return self._map(TIMES_NAME, 'Q')
+
+    def values(self, name):
+        """Signal 'name''s value column (memory-mapped), one entry per time."""
+        entry = self._signals.get(name)
+        if entry is None:
+            raise CacheError("No signal '{}' in {}".format(name, self.dirname))
+        return self._map(entry['file'], entry['typecode'])
+
+    def window(self, t0=None, t1=None):
+        """Row range [start, end) covering times t0 to t1: 'start' is the
+        row in effect at t0 and 'end' is past the last row at or before t1."""
+        import numpy as np
+        times = self.times
+        start = 0
+        end = self.rows
+        if t0 is not None:
+            start = max(int(np.searchsorted(times, t0, side='right')) - 1, 0)
+        if t1 is not None:
+            end = int(np.searchsorted(times, t1, side='right'))
+        return start, max(start, end)
+
+    def columns(self, name, t0=None, t1=None):
+        """(times, values) numpy arrays of signal 'name''s changes between
+        t0 and t1 (the first entry is its value at t0)."""
+        import numpy as np
+        entry = self._signals.get(name)
+        if entry is None:
+            raise CacheError("No signal '{}' in {}".format(name, self.dirname))
+        if entry['first'] is not None and (t0 is None or t0 < entry['first']):
+            # Nothing before the signal's first change
+            t0 = entry['first']
+        start, end = self.window(t0, t1)
+        times = np.asarray(self.times[start:end])
+        values = np.asarray(self.values(name)[start:end])
+        if entry['first'] is None or len(times) == 0:
+            return times[:0], values[:0]
+        # The shared axis repeats a value wherever another signal changed
+        keep = np.ones(len(values), dtype=bool)
+        keep[1:] = values[1:] != values[:-1]
+        times = times[keep]
+        values = values[keep]
+        if t0 is not None and times[0] < t0:
+            times[0] = t0
+        return times, values
+
+    def signal(self, name, t0=None, t1=None):
+        """Signal 'name' between t0 and t1 as a vcdread.Signal."""
+        entry = self._signals.get(name)
+        if entry is None:
+            raise CacheError("No signal '{}' in {}".format(name, self.dirname))
+        times, values = self.columns(name, t0, t1)
+        sig = vcdread.Signal(entry['vcd_name'], None, entry['width'], self.timescale)
+        sig.times = array('Q', times.astype('=u8').tobytes())
+        sig.values = array(entry['typecode'], values.astype('=' + entry['typecode']).tobytes())
+        return sig
+
+def load(vcd_path, names, cache_path=None):
+    """Open the cache of signals 'names' from 'vcd_path', building it (from
+    a single pass over the VCD) if there isn't one, it's out of date or it
+    lacks any of 'names'.  Returns a WaveCache."""
+    if cache_path is None:
+        cache_path = default_path(vcd_path)
+    names = list(names)
+    if os.path.exists(os.path.join(cache_path, HEADER_NAME)):
+        try:
+            cache = WaveCache(cache_path)
+            if cache.is_fresh(vcd_path):
+                if cache.has(names):
+                    return cache
+                # Keep what's already cached in the rebuilt cache
+                names = cache.names() + [name for name in names if not cache.has([name])]
+        except CacheError:
+            pass
+    signals = vcdread.read(vcd_path, names)
+    save(cache_path, signals, source=vcd_path)
+    return WaveCache(cache_path)
+
+if __name__ == "__main__":
+    cache = load(sys.argv[1], sys.argv[2:])
+    print("{}: {} rows".format(cache.dirname, cache.rows))
+    for name in cache.names():
+        times, values = cache.columns(name)
+        print("{}: {} changes".format(name, len(times)))